@@ -0,0 +1,102 @@
+"""
+Compare the compact packet model against scapy on the data path
+
+    python -m benchmarks.packets
+    python -m benchmarks.packets --pings 2000
+
+Times building an Ether/IP/ICMP/payload stack, taking a TTL-decremented
+clone of the IP layer and reading the fields a receiver looks at, then
+pings between two servers on a switch with each model.
+"""
+import argparse
+import contextlib
+import io
+import json
+import logging
+import time
+from routersim import packets
+from routersim.messaging import FrameType, ICMPType, MACAddress, clone
+from routersim.topology import Topology
+from routersim.server import Server
+
+
+SRC_MAC = MACAddress(bytes([0x42, 0, 0, 0, 0, 1]))
+DST_MAC = MACAddress(bytes([0x42, 0, 0, 0, 0, 2]))
+
+
+def build_and_receive(count):
+    for i in range(count):
+        frame = packets.ether(src=SRC_MAC, dst=DST_MAC, type=FrameType.IPV4) / (
+            packets.ipv4(src="10.0.0.1", dst="10.0.0.2") /
+            packets.icmp(type=ICMPType.EchoRequest) /
+            json.dumps({'id': i, 'time': 0}))
+
+        # What a switch, a forwarding router and the receiver look at
+        if frame.dst != DST_MAC or int(frame.type) != FrameType.IPV4:
+            raise Exception("Unexpected frame")
+        packet = clone(frame.payload)
+        packet.ttl -= 1
+        if packet.payload.type != ICMPType.EchoRequest.value:
+            raise Exception("Unexpected packet")
+        json.loads(packet.payload.payload.load)
+
+
+def ping_run(pings):
+    topology = Topology("bench", seed=0)
+    switch = topology.add_switch("sw1")
+
+    pc1 = Server('pc1', context=topology.context)
+    pc1.add_ip_address('et1', '192.168.1.100/24')
+    pc2 = Server('pc2', context=topology.context)
+    pc2.add_ip_address('et1', '192.168.1.200/24')
+
+    switch.interface('et1').connect(pc1.interface('et1'), latency_ms=1)
+    switch.interface('et2').connect(pc2.interface('et1'), latency_ms=1)
+
+    pc1.ping("192.168.1.200", count=pings)
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        topology.run_another(pings * 20 + 100)
+
+    replies = output.getvalue().count("Received reply")
+    if replies == 0:
+        raise Exception("No ping replies")
+    return replies
+
+
+def timed(fn, *args):
+    start = time.perf_counter()
+    result = fn(*args)
+    return time.perf_counter() - start, result
+
+
+def run(frames=20000, pings=500):
+    results = {}
+    for fast in (True, False):
+        packets.FAST_PATH = fast
+        try:
+            frame_time, _ = timed(build_and_receive, frames)
+            ping_time, replies = timed(ping_run, pings)
+            results['fast' if fast else 'scapy'] = {
+                'frames_per_second': frames / frame_time,
+                'replies_per_second': replies / ping_time,
+            }
+        finally:
+            packets.FAST_PATH = True
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--frames', type=int, default=20000)
+    parser.add_argument('--pings', type=int, default=500)
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    results = run(args.frames, args.pings)
+    for model, result in results.items():
+        print(f"{model:>6}  {result['frames_per_second']:10.0f} frames/s"
+              f"  {result['replies_per_second']:8.0f} ping replies/s")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,168 @@
+"""
+Compare the heap based SPF against the original O(V^2) loop
+
+    python -m benchmarks.spf
+    python -m benchmarks.spf --sizes 1000 5000 --degree 4
+
+Each run builds a synthetic LSP database (a ring with random chords, so
+it is always connected) and computes SPF from the first system with both
+implementations, checking that they agree on every prefix.
+
+It then times keeping that tree up to date as a leaf prefix flaps (PRC)
+and as a link metric changes (iSPF), each checked against a full run.
+"""
+import argparse
+import random
+import sys
+import time
+from routersim.isis.spf import SPFGraph, ShortestPathTree
+from routersim.isis.synthetic import generate_database, system_id, flap_prefix, change_metric
+
+
+def legacy_spf(database, root):
+    """
+    The original IsisProcess.run_full_dijkstra loop, minus logging
+    """
+    distance = {}
+    system_distance = {}
+    prev = {}
+    prev_system = {}
+    queue = []
+
+    dbvalues = sorted(database.values(), key=lambda lsp: lsp.pdu.source_address)
+    for wrapper in dbvalues:
+        entry_node = wrapper.pdu.source_address
+        system_distance[entry_node] = sys.maxsize
+        prev_system[entry_node] = None
+        queue.append(wrapper.pdu.source_address)
+
+    system_distance[root] = 0
+
+    while len(queue) > 0:
+        min_idx = 0
+        min_dist = sys.maxsize
+        for i in range(len(queue)):
+            if system_distance[queue[i]] < min_dist:
+                min_idx = i
+                min_dist = system_distance[queue[i]]
+
+        node = queue.pop(min_idx)
+        lsp = database[node].pdu
+
+        for neigh in lsp.neighbors:
+            if neigh.system_id not in system_distance:
+                return None
+            new_dist = system_distance[node] + neigh.metric
+            if new_dist < system_distance[neigh.system_id]:
+                system_distance[neigh.system_id] = new_dist
+                prev_system[neigh.system_id] = lsp.source_address
+
+        for network in lsp.addresses:
+            if network.state.name != 'UP':
+                continue
+            new_dist = system_distance[node] + network.metric
+            existing_metric = distance.get(network.prefix)
+            if existing_metric is None or existing_metric > new_dist:
+                distance[network.prefix] = new_dist
+                prev[network.prefix] = lsp.source_address
+
+    return distance, prev, prev_system
+
+
+def heap_spf(database, root):
+    spt = ShortestPathTree(SPFGraph(database), root)
+    nodes = spt.graph.nodes
+    prev = {prefix: nodes[node] for prefix, node in spt.prefix_node.items()}
+    return spt.prefix_distance, prev, spt
+
+
+def incremental_spf(database, root, mutate, changes=20, seed=0):
+    """
+    Average time to apply one mutation to an existing tree
+    """
+    rng = random.Random(seed)
+    graph = SPFGraph(database)
+    spt = ShortestPathTree(graph, root)
+
+    elapsed = 0
+    for _ in range(changes):
+        dirty = mutate(database, rng)
+
+        start = time.perf_counter()
+        topology_changes = {}
+        prefix_changes = set()
+        for system in dirty:
+            old_links, prefixes = graph.update(system, database[system].pdu)
+            if old_links is not None:
+                topology_changes[graph.index[system]] = old_links
+            prefix_changes.update(prefixes)
+        spt.update(topology_changes, prefix_changes)
+        elapsed += time.perf_counter() - start
+
+    full = ShortestPathTree(SPFGraph(database), root)
+    if (full.prefix_distance != spt.prefix_distance or
+            full.prefix_node != spt.prefix_node or full.parent != spt.parent):
+        raise Exception(f"Incremental SPF differs after {mutate.__name__}")
+    return elapsed / changes
+
+
+def timed(fn, *args, repeat=1):
+    best = None
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = fn(*args)
+        elapsed = time.perf_counter() - start
+        if best is None or elapsed < best:
+            best = elapsed
+    return best, result
+
+
+def run(sizes, degree=4, seed=0, repeat=3, legacy=True):
+    results = []
+    for size in sizes:
+        database = generate_database(size, degree=degree, seed=seed)
+        root = system_id(0)
+
+        heap_time, (distance, prev, _) = timed(heap_spf, database, root, repeat=repeat)
+        result = {
+            'nodes': size,
+            'prefixes': len(distance),
+            'heap_seconds': heap_time,
+        }
+
+        if legacy:
+            legacy_time, (old_distance, old_prev, _) = timed(legacy_spf, database, root)
+            if old_distance != distance or old_prev != prev:
+                raise Exception(f"SPF results differ for {size} nodes")
+            result['legacy_seconds'] = legacy_time
+            result['speedup'] = legacy_time / heap_time
+
+        result['prc_seconds'] = incremental_spf(database, root, flap_prefix, seed=seed)
+        result['ispf_seconds'] = incremental_spf(database, root, change_metric, seed=seed)
+
+        results.append(result)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', type=int, nargs='+', default=[1000, 5000])
+    parser.add_argument('--degree', type=int, default=4)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--no-legacy', action='store_true',
+                        help="Only time the heap implementation")
+    args = parser.parse_args(argv)
+
+    for result in run(args.sizes, args.degree, args.seed, args.repeat,
+                      legacy=not args.no_legacy):
+        line = f"{result['nodes']:>7} nodes {result['prefixes']:>7} prefixes  heap {result['heap_seconds']*1000:9.1f}ms"
+        if 'legacy_seconds' in result:
+            line += f"  legacy {result['legacy_seconds']*1000:9.1f}ms  x{result['speedup']:.1f}"
+        line += f"  prc {result['prc_seconds']*1000:7.2f}ms  ispf {result['ispf_seconds']*1000:7.2f}ms"
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
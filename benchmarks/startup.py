@@ -0,0 +1,94 @@
+"""
+Measure how long it takes to get routersim going in a fresh interpreter
+
+    python -m benchmarks.startup
+    python -m benchmarks.startup --repeat 20
+
+Each module is imported in its own python process, so nothing is
+already cached, and reports whether scapy ended up being loaded. The
+'ping' case also builds two hosts on a switch and pings between them,
+which shouldn't need scapy either.
+"""
+import argparse
+import json
+import statistics
+import subprocess
+import sys
+
+
+MODULES = [
+    'routersim',
+    'routersim.topology',
+    'routersim.junos',
+    'routersim.scapy',
+]
+
+IMPORT = """
+import json, sys, time
+start = time.perf_counter()
+import {module}
+elapsed = time.perf_counter() - start
+print(json.dumps({{'ms': elapsed * 1000, 'scapy': 'scapy' in sys.modules}}))
+"""
+
+PING = """
+import contextlib, io, json, logging, sys, time
+start = time.perf_counter()
+from routersim.topology import Topology
+from routersim.server import Server
+logging.disable(logging.INFO)
+topology = Topology("startup", seed=0)
+switch = topology.add_switch("sw1")
+pc1 = Server('pc1', context=topology.context)
+pc1.add_ip_address('et1', '192.168.1.100/24')
+pc2 = Server('pc2', context=topology.context)
+pc2.add_ip_address('et1', '192.168.1.200/24')
+switch.interface('et1').connect(pc1.interface('et1'), latency_ms=1)
+switch.interface('et2').connect(pc2.interface('et1'), latency_ms=1)
+pc1.ping("192.168.1.200", count=1)
+with contextlib.redirect_stdout(io.StringIO()):
+    topology.run_another(100)
+elapsed = time.perf_counter() - start
+print(json.dumps({'ms': elapsed * 1000, 'scapy': 'scapy' in sys.modules}))
+"""
+
+
+def measure(code, repeat):
+    times = []
+    scapy = False
+    for _ in range(repeat):
+        output = subprocess.run(
+            [sys.executable, '-c', code],
+            check=True, capture_output=True, text=True).stdout
+        result = json.loads(output.strip().splitlines()[-1])
+        times.append(result['ms'])
+        scapy = scapy or result['scapy']
+    return {
+        'median_ms': statistics.median(times),
+        'min_ms': min(times),
+        'scapy_loaded': scapy,
+    }
+
+
+def run(repeat=5):
+    results = {}
+    for module in MODULES:
+        results[module] = measure(IMPORT.format(module=module), repeat)
+    results['ping'] = measure(PING, repeat)
+    return results
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--repeat', type=int, default=5)
+    args = parser.parse_args(argv)
+
+    results = run(args.repeat)
+    for name, result in results.items():
+        scapy = "scapy loaded" if result['scapy_loaded'] else ""
+        print(f"{name:>20}  {result['median_ms']:8.1f} ms"
+              f"  (min {result['min_ms']:.1f})  {scapy}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,521 @@
+"""
+Benchmark the simulator's core engines and write the results as JSON
+
+    python -m benchmarks.suite
+    python -m benchmarks.suite --shapes grid clos --sizes 16 64 --output after.json
+    python -m benchmarks.suite --output after.json --compare before.json
+
+For each topology shape (see benchmarks.topologies) and size this
+measures:
+
+    isis       building the topology and running IS-IS until every
+               router has a route to every loopback
+    fib        FIB lookups of every loopback on a converged router
+    rsvp       signalling LSPs between random pairs of routers
+    mesh       signalling a full mesh of LSPs
+    lfib       label lookups and swaps on the busiest transit router
+               of a full mesh of LSPs
+    churn      setting up and tearing down batches of LSPs between random
+               pairs of routers, and how big the label tables get
+    refresh    keeping a full mesh of LSPs up, without and with RSVP
+               refresh reduction, counted in messages sent
+
+and once per run:
+
+    scheduler  raw event queue throughput with do-nothing callbacks
+    bridging   hosts on a switch pinging each other, so ARP and MAC
+               learning, counted in frames received
+
+Each case is run a second time under tracemalloc for its peak memory,
+unless --no-memory is given. --include adds the spf, packets and
+startup benchmarks to the output.
+"""
+import argparse
+import contextlib
+import io
+import ipaddress
+import json
+import logging
+import platform
+import random
+import subprocess
+import sys
+import time
+import tracemalloc
+from copy import copy
+from routersim.mpls import MPLSPacket
+from routersim.observers import EventType, SimulationContext
+from routersim.topology import Topology
+from .topologies import SHAPES, build
+
+
+def run_isis(shape, size, seed=0, step_ms=1000, timeout_ms=600 * 1000):
+    """
+    Build the topology and run IS-IS until it has converged
+    """
+    start = time.perf_counter()
+    topology, routers = build(shape, size, seed=seed)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    build_seconds = time.perf_counter() - start
+
+    queue = topology.context.queue
+    processed = queue.processed
+
+    # Loopbacks each router has yet to learn, routes don't go away
+    # while nothing is changing so they only need finding once
+    loopbacks = [router.loopback_address for router in routers]
+    pending = {router: list(loopbacks) for router in routers}
+
+    run_seconds = 0.0
+    while len(pending) > 0 and topology.clock.clockfn() < timeout_ms:
+        start = time.perf_counter()
+        topology.run_another(step_ms)
+        run_seconds += time.perf_counter() - start
+
+        for router in list(pending):
+            missing = pending[router]
+            while len(missing) > 0 and router.routing.lookup_ip(missing[-1]) is not None:
+                missing.pop()
+            if len(missing) == 0:
+                del pending[router]
+
+    if len(pending) > 0:
+        raise Exception(f"{shape}-{size} didn't converge within {timeout_ms}ms")
+
+    events = queue.processed - processed
+    return topology, routers, {
+        'build_seconds': build_seconds,
+        'converge_seconds': run_seconds,
+        'converged_ms': topology.clock.clockfn(),
+        'events': events,
+        'events_per_second': events / run_seconds,
+    }
+
+
+def isis_case(shape, size, seed=0, **_):
+    _, _, result = run_isis(shape, size, seed=seed)
+    return result
+
+
+def fib_case(shape, size, seed=0, lookups=100000, **_):
+    _, routers, _ = run_isis(shape, size, seed=seed)
+    rng = random.Random(seed)
+    addresses = [router.loopback_address for router in routers]
+    addresses = [rng.choice(addresses) for _ in range(min(lookups, 10000))]
+
+    fib = routers[0]._forwarding
+    start = time.perf_counter()
+    done = 0
+    while done < lookups:
+        for address in addresses:
+            if fib.lookup_ip(address) is None:
+                raise Exception(f"No forwarding entry for {address}")
+        done += len(addresses)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'lookups': done,
+        'lookups_per_second': done / elapsed,
+    }
+
+
+def signal_lsps(topology, pairs, step_ms=100, timeout_ms=60 * 1000):
+    """
+    Create an LSP for each (ingress, egress) pair and run until they
+    are all up
+    """
+    start = time.perf_counter()
+    pending = []
+    for idx, (ingress, egress) in enumerate(pairs):
+        ingress.create_lsp(f"lsp-{idx}", egress.loopback_address)
+        pending.append(
+            (ingress, ipaddress.ip_network(f"{egress.loopback_address}/32")))
+    topology.rsvp_start_all()
+
+    started = topology.clock.clockfn()
+    while len(pending) > 0 and topology.clock.clockfn() - started < timeout_ms:
+        topology.run_another(step_ms)
+        pending = [(ingress, prefix) for ingress, prefix in pending
+                   if prefix not in ingress.routing.tables['rsvp']]
+    elapsed = time.perf_counter() - start
+
+    if len(pending) > 0:
+        raise Exception(f"{len(pending)} of {len(pairs)} LSPs weren't set up within {timeout_ms}ms")
+
+    return {
+        'lsps': len(pairs),
+        'setup_seconds': elapsed,
+        'setup_ms': topology.clock.clockfn() - started,
+        'lsps_per_second': len(pairs) / elapsed,
+    }
+
+
+def rsvp_case(shape, size, seed=0, lsps=20, **_):
+    topology, routers, _ = run_isis(shape, size, seed=seed)
+    rng = random.Random(seed)
+    return signal_lsps(topology, [rng.sample(routers, 2) for _ in range(lsps)])
+
+
+def mesh_case(shape, size, seed=0, **_):
+    """
+    An LSP from every router to every other router
+    """
+    topology, routers, _ = run_isis(shape, size, seed=seed)
+    return signal_lsps(topology, [(ingress, egress) for ingress in routers
+                                  for egress in routers if ingress is not egress])
+
+
+def lfib_case(shape, size, seed=0, lookups=100000, **_):
+    topology, routers, _ = run_isis(shape, size, seed=seed)
+    signal_lsps(topology, [(ingress, egress) for ingress in routers
+                           for egress in routers if ingress is not egress])
+
+    router = max(routers, key=lambda router: len(router.routing.mpls))
+    fib = router._forwarding
+    packets = []
+    for label in router.routing.mpls:
+        packet = MPLSPacket(None)
+        packet.label_stack.append(label)
+        packets.append(packet)
+    if len(packets) == 0:
+        raise Exception(f"{shape}-{size} has no transit LSPs")
+
+    # What the PFE does with a labelled frame, short of sending it
+    start = time.perf_counter()
+    done = 0
+    while done < lookups:
+        for packet in packets:
+            packet = copy(packet)
+            entry = fib.lookup_label(packet.label_stack[-1])[0]
+            entry.action.apply(packet, router)
+        done += len(packets)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'labels': len(packets),
+        'lookups': done,
+        'lookups_per_second': done / elapsed,
+    }
+
+
+def churn_case(shape, size, seed=0, lsps=20, rounds=20, **_):
+    topology, routers, _ = run_isis(shape, size, seed=seed)
+    rng = random.Random(seed)
+    topology.rsvp_start_all()
+
+    # Largest any router's ILM gets, while the LSPs are up
+    ilm_slots = 0
+    start = time.perf_counter()
+    for round in range(rounds):
+        pairs = [rng.sample(routers, 2) for _ in range(lsps)]
+        for idx, (ingress, egress) in enumerate(pairs):
+            ingress.create_lsp(f"churn-{round}-{idx}", egress.loopback_address)
+        topology.run_another(2000)
+        ilm_slots = max([ilm_slots] + [router._forwarding.ilm.capacity() for router in routers])
+        for idx, (ingress, _) in enumerate(pairs):
+            ingress.delete_lsp(f"churn-{round}-{idx}")
+        topology.run_another(2000)
+    elapsed = time.perf_counter() - start
+
+    def span(labels):
+        # How far into its range a router has ever had to go
+        high_water = labels.statistics()['high_water']
+        return 0 if high_water is None else high_water - labels.first + 1
+
+    return {
+        'lsps': lsps * rounds,
+        'churn_seconds': elapsed,
+        'label_allocations': sum(router.labels.allocations for router in routers),
+        'labels_in_use': sum(len(router.labels) for router in routers),
+        'max_label_span': max(span(router.labels) for router in routers),
+        'max_ilm_slots': ilm_slots,
+    }
+
+
+def steady_rsvp(shape, size, seed=0, refresh_reduction=False, steady_ms=300 * 1000):
+    """
+    Set up a full mesh of LSPs and keep it up for steady_ms, returning
+    the messages and packets sent and the seconds taken meanwhile
+    """
+    topology, routers, _ = run_isis(shape, size, seed=seed)
+    for router in routers:
+        router.process['rsvp'].refresh_reduction = refresh_reduction
+    signal_lsps(topology, [(ingress, egress) for ingress in routers
+                           for egress in routers if ingress is not egress])
+
+    before = [router.process['rsvp'].statistics() for router in routers]
+    start = time.perf_counter()
+    topology.run_another(steady_ms)
+    elapsed = time.perf_counter() - start
+    after = [router.process['rsvp'].statistics() for router in routers]
+
+    messages = sum(sum(stats['sent'].values()) for stats in after)
+    messages -= sum(sum(stats['sent'].values()) for stats in before)
+    packets = sum(stats['packets_sent'] for stats in after)
+    packets -= sum(stats['packets_sent'] for stats in before)
+    # Bundles count as messages as well as what's in them
+    bundles = sum(stats['sent'].get('Bundle', 0) for stats in after)
+    bundles -= sum(stats['sent'].get('Bundle', 0) for stats in before)
+    return messages - bundles, packets, elapsed
+
+
+def refresh_case(shape, size, seed=0, steady_ms=300 * 1000, **_):
+    messages, packets, seconds = steady_rsvp(
+        shape, size, seed=seed, steady_ms=steady_ms)
+    rr_messages, rr_packets, rr_seconds = steady_rsvp(
+        shape, size, seed=seed, refresh_reduction=True, steady_ms=steady_ms)
+    return {
+        'steady_ms': steady_ms,
+        'messages': messages,
+        'packets': packets,
+        'steady_seconds': seconds,
+        'rr_messages': rr_messages,
+        'rr_packets': rr_packets,
+        'rr_steady_seconds': rr_seconds,
+    }
+
+
+def scheduler_case(events=200000, seed=0, **_):
+    context = SimulationContext(seed=seed)
+    rng = random.Random(seed)
+
+    def action():
+        pass
+
+    start = time.perf_counter()
+    for _ in range(events):
+        context.enqueue(rng.randint(0, 1000), action)
+    context.run_until(1000)
+    elapsed = time.perf_counter() - start
+
+    return {
+        'events': context.queue.processed,
+        'events_per_second': context.queue.processed / elapsed,
+    }
+
+
+def bridging_case(hosts=32, pings=50, seed=0, **_):
+    topology = Topology("bridging", seed=seed)
+    switch = topology.add_switch(
+        "sw1", interfaces=[f"et{port}" for port in range(1, hosts + 1)])
+
+    servers = []
+    for idx in range(hosts):
+        server = topology.add_server(
+            f"h{idx}", interface_addr=f"10.0.{idx // 250}.{idx % 250 + 1}/16")
+        switch.interface(f"et{idx + 1}").connect(server.main_interface, latency_ms=1)
+        servers.append(server)
+    topology.run_another(10)
+
+    # Everybody pings the host half way round, so every host has to
+    # ARP and the switch has to learn every MAC
+    for idx, server in enumerate(servers):
+        target = servers[(idx + hosts // 2) % hosts]
+        server.ping(target.main_interface.logical().address().ip, count=pings)
+
+    frames = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()) as output:
+        for _, evt in topology.run_another(pings * 20 + 1000, stream=True):
+            if evt.event_type == EventType.PACKET_RECV:
+                frames += 1
+    elapsed = time.perf_counter() - start
+
+    replies = output.getvalue().count("Received reply")
+    if replies == 0:
+        raise Exception("No ping replies")
+
+    return {
+        'frames': frames,
+        'replies': replies,
+        'frames_per_second': frames / elapsed,
+    }
+
+
+TOPOLOGY_CASES = {
+    'isis': isis_case,
+    'fib': fib_case,
+    'rsvp': rsvp_case,
+    'mesh': mesh_case,
+    'lfib': lfib_case,
+    'churn': churn_case,
+    'refresh': refresh_case,
+}
+
+CASES = {
+    'scheduler': scheduler_case,
+    'bridging': bridging_case,
+}
+
+
+def peak_memory(case, **parameters):
+    tracemalloc.start()
+    try:
+        case(**parameters)
+        return tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+
+
+def run_case(name, case, memory=True, **parameters):
+    result = {'case': name}
+    result.update(parameters)
+    result.update(case(**parameters))
+    if memory:
+        result['peak_memory_kb'] = peak_memory(case, **parameters) / 1024
+    return result
+
+
+def extras(include, seed=0):
+    results = {}
+    if 'spf' in include:
+        from . import spf
+        results['spf'] = spf.run([1000], seed=seed, repeat=1, legacy=False)
+    if 'packets' in include:
+        from . import packets
+        results['packets'] = packets.run(frames=5000, pings=200)
+    if 'startup' in include:
+        from . import startup
+        results['startup'] = startup.run(repeat=3)
+    return results
+
+
+def environment():
+    try:
+        commit = subprocess.run(
+            ['git', 'rev-parse', 'HEAD'], check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        commit = None
+    return {
+        'python': platform.python_version(),
+        'implementation': platform.python_implementation(),
+        'platform': platform.platform(),
+        'commit': commit,
+        'time': time.strftime('%Y-%m-%dT%H:%M:%S%z'),
+    }
+
+
+def run(shapes=None, sizes=(8, 32), cases=None, seed=0, memory=True,
+        include=(), lsps=20, lookups=100000, events=200000, hosts=32, pings=50):
+    if shapes is None:
+        shapes = list(SHAPES)
+    if cases is None:
+        cases = list(TOPOLOGY_CASES) + list(CASES)
+
+    results = []
+    for name in cases:
+        if name in CASES:
+            parameters = {
+                'scheduler': {'events': events},
+                'bridging': {'hosts': hosts, 'pings': pings},
+            }[name]
+            results.append(run_case(name, CASES[name], memory=memory,
+                                    seed=seed, **parameters))
+            continue
+
+        for shape in shapes:
+            for size in sizes:
+                parameters = {'shape': shape, 'size': size, 'seed': seed}
+                if name in ('rsvp', 'churn'):
+                    parameters['lsps'] = lsps
+                elif name in ('fib', 'lfib'):
+                    parameters['lookups'] = lookups
+                results.append(run_case(name, TOPOLOGY_CASES[name],
+                                        memory=memory, **parameters))
+
+    return {
+        'environment': environment(),
+        'results': results,
+        'extras': extras(include, seed=seed),
+    }
+
+
+def result_key(result):
+    return (result['case'], result.get('shape'), result.get('size'))
+
+
+def compare(baseline, current):
+    """
+    (key, metric, baseline, current) for every rate and duration
+    present in both
+    """
+    before = {result_key(result): result for result in baseline['results']}
+    changes = []
+    for result in current['results']:
+        old = before.get(result_key(result))
+        if old is None:
+            continue
+        for metric, value in result.items():
+            if not (metric.endswith('_per_second') or metric.endswith('_seconds')
+                    or metric == 'peak_memory_kb'):
+                continue
+            if metric in old:
+                changes.append((result_key(result), metric, old[metric], value))
+    return changes
+
+
+def describe(result):
+    name = result['case']
+    if 'shape' in result:
+        name += f" {result['shape']}-{result['size']}"
+    metrics = []
+    for metric, value in result.items():
+        if metric.endswith('_per_second'):
+            metrics.append(f"{value:12.0f} {metric[:-len('_per_second')]}/s")
+        elif metric.endswith('_seconds'):
+            metrics.append(f"{metric[:-len('_seconds')]} {value * 1000:9.1f}ms")
+        elif metric == 'peak_memory_kb':
+            metrics.append(f"peak {value:9.0f}KB")
+    return f"{name:>16}  " + "  ".join(metrics)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--shapes', nargs='+', choices=list(SHAPES))
+    parser.add_argument('--sizes', type=int, nargs='+', default=[8, 32])
+    parser.add_argument('--cases', nargs='+',
+                        choices=list(TOPOLOGY_CASES) + list(CASES))
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--lsps', type=int, default=20)
+    parser.add_argument('--lookups', type=int, default=100000)
+    parser.add_argument('--events', type=int, default=200000)
+    parser.add_argument('--hosts', type=int, default=32)
+    parser.add_argument('--pings', type=int, default=50)
+    parser.add_argument('--include', nargs='+', default=[],
+                        choices=['spf', 'packets', 'startup'])
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Don't rerun each case to measure its peak memory")
+    parser.add_argument('--output', help="Write the results to this JSON file")
+    parser.add_argument('--compare', help="Results JSON of an earlier run to compare against")
+    args = parser.parse_args(argv)
+
+    logging.disable(logging.INFO)
+    results = run(args.shapes, args.sizes, args.cases, seed=args.seed,
+                  memory=not args.no_memory, include=args.include,
+                  lsps=args.lsps, lookups=args.lookups, events=args.events,
+                  hosts=args.hosts, pings=args.pings)
+
+    for result in results['results']:
+        print(describe(result))
+
+    if args.output is not None:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+    else:
+        json.dump(results, sys.stdout, indent=2)
+        print()
+
+    if args.compare is not None:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print()
+        for (case, shape, size), metric, old, new in compare(baseline, results):
+            name = case if shape is None else f"{case} {shape}-{size}"
+            change = (new - old) / old * 100 if old else 0.0
+            print(f"{name:>16}  {metric:<20} {old:14.4g} -> {new:14.4g}  {change:+7.1f}%")
+
+
+if __name__ == '__main__':
+    main()
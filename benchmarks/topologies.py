@@ -0,0 +1,108 @@
+"""
+Parametrized router topologies for the benchmarks
+
+    topology, routers = build('grid', 25, seed=0)
+
+Every shape is built with Topology.add_router and link_router_pairs,
+the same way a script would, so building it is part of what gets
+measured. Each router gets exactly as many interfaces as it has links.
+"""
+import ipaddress
+import math
+import random
+from routersim.topology import Topology
+
+
+def line_links(size, seed=0):
+    return [(idx, idx + 1) for idx in range(size - 1)]
+
+
+def ring_links(size, seed=0):
+    links = line_links(size)
+    if size > 2:
+        links.append((size - 1, 0))
+    return links
+
+
+def grid_links(size, seed=0):
+    """
+    As square as possible, filled in row by row
+    """
+    columns = math.ceil(math.sqrt(size))
+    links = []
+    for idx in range(size):
+        if (idx + 1) % columns != 0 and idx + 1 < size:
+            links.append((idx, idx + 1))
+        if idx + columns < size:
+            links.append((idx, idx + columns))
+    return links
+
+
+def clos_links(size, seed=0):
+    """
+    Two tier leaf/spine, one spine for every four leaves, and every
+    leaf linked to every spine
+    """
+    spines = max(1, size // 5)
+    links = []
+    for leaf in range(spines, size):
+        for spine in range(spines):
+            links.append((leaf, spine))
+    return links
+
+
+def random_links(size, seed=0, degree=3):
+    """
+    A ring (so it is always connected) with random chords added until
+    the average degree is reached
+    """
+    rng = random.Random(seed)
+    links = ring_links(size)
+    seen = set(links)
+    chords = min(size * max(degree - 2, 0) // 2,
+                 size * (size - 1) // 2 - len(links))
+    while chords > 0:
+        a, b = rng.randrange(size), rng.randrange(size)
+        if a == b or (a, b) in seen or (b, a) in seen:
+            continue
+        seen.add((a, b))
+        links.append((a, b))
+        chords -= 1
+    return links
+
+
+SHAPES = {
+    'line': line_links,
+    'ring': ring_links,
+    'grid': grid_links,
+    'clos': clos_links,
+    'random': random_links,
+}
+
+
+def build(shape, size, seed=0, latency_ms=10, collect_events=False):
+    """
+    Topology of size routers linked up as shape, returning it and the
+    routers in the order they were added
+    """
+    links = SHAPES[shape](size, seed=seed)
+
+    ports = [0] * size
+    for a, b in links:
+        ports[a] += 1
+        ports[b] += 1
+
+    # The default loopback range only has room for 254 routers
+    topology = Topology(f"{shape}-{size}", seed=seed,
+                        loopback_network=ipaddress.ip_network("10.255.0.0/16"),
+                        collect_events=collect_events)
+
+    routers = []
+    for idx in range(size):
+        interfaces = [f"et{port}" for port in range(1, ports[idx] + 1)]
+        routers.append(topology.add_router(f"r{idx}", interfaces=interfaces))
+
+    topology.link_router_pairs(
+        [(routers[a], routers[b]) for a, b in links], latency_ms=latency_ms)
+
+    return topology, routers
@@ -0,0 +1,204 @@
+"""
+Listening for events (routersim.observers): subscriptions only see what
+they asked for, nobody formats a message nobody reads, and however the
+events of a run are gathered (all at once, the last N, streamed) they
+are the same events
+
+    python eventtest.py
+    python -m pytest eventtest.py
+"""
+from routersim.observers import Event, EventCollector, EventManager, EventType
+from routersim.observers import LoggingObserver, SimulationContext
+from routersim.topology import Topology
+import logging
+
+
+class Lazy:
+    """
+    A msg which counts how often it is formatted
+    """
+    def __init__(self, msg):
+        self.msg = msg
+        self.calls = 0
+
+    def __call__(self):
+        self.calls += 1
+        return self.msg
+
+
+def event_manager():
+    return EventManager("eventtest", context=SimulationContext())
+
+
+def test_subscription_filters():
+    manager = event_manager()
+    source, other = object(), object()
+    by_sub_type, by_source, everything = [], [], []
+    manager.listen(EventType.ISIS, by_sub_type.append, sub_type=("ADJ_UP", "ADJ_DOWN"))
+    manager.listen(EventType.ISIS, by_source.append, source=source)
+    manager.listen('*', everything.append)
+
+    events = [Event(EventType.ISIS, source, "up", sub_type="ADJ_UP"),
+              Event(EventType.ISIS, other, "spf", sub_type="SPF_RUN"),
+              Event(EventType.ISIS, other, "down", sub_type="ADJ_DOWN"),
+              Event(EventType.RSVP, source, "path", sub_type="ADJ_UP")]
+    for evt in events:
+        manager.observe(evt)
+
+    assert by_sub_type == [events[0], events[2]]
+    assert by_source == [events[0]]
+    assert everything == events
+
+    # Handing back the original listener stops the subscription
+    manager.stop_listening(EventType.ISIS, by_sub_type.append)
+    manager.observe(Event(EventType.ISIS, source, "up", sub_type="ADJ_UP"))
+    assert len(by_sub_type) == 2
+    assert len(by_source) == 2
+
+
+def test_is_enabled():
+    manager = event_manager()
+    assert not manager.is_enabled(EventType.ISIS)
+
+    manager.listen(EventType.ISIS, lambda evt: None, sub_type="ADJ_UP")
+    assert manager.is_enabled(EventType.ISIS)
+    assert manager.is_enabled(EventType.ISIS, "ADJ_UP")
+    assert not manager.is_enabled(EventType.ISIS, "SPF_RUN")
+    assert not manager.is_enabled(EventType.RSVP)
+
+    # Listeners which don't currently want anything don't count
+    collector = EventCollector(enabled=False)
+    logger = logging.getLogger("eventtest.quiet")
+    logger.setLevel(logging.WARNING)
+    manager.listen('*', collector.observer("eventtest"))
+    manager.listen('*', LoggingObserver("eventtest", logger))
+    assert not manager.is_enabled(EventType.RSVP)
+    collector.enabled = True
+    assert manager.is_enabled(EventType.RSVP)
+
+
+def test_filtered_out_msg_never_formatted():
+    manager = event_manager()
+    seen = []
+    manager.listen(EventType.ISIS, seen.append, sub_type="ADJ_UP")
+    manager.listen(EventType.RSVP, seen.append, source=manager)
+    collector = EventCollector(enabled=False)
+    manager.listen('*', collector.observer("eventtest"))
+
+    ignored = [Lazy("spf"), Lazy("path"), Lazy("mpls")]
+    manager.observe(Event(EventType.ISIS, None, ignored[0], sub_type="SPF_RUN"))
+    manager.observe(Event(EventType.RSVP, None, ignored[1]))
+    manager.observe(Event(EventType.MPLS, None, ignored[2]))
+    assert seen == []
+    assert len(collector.events()) == 0
+    assert [lazy.calls for lazy in ignored] == [0, 0, 0]
+
+    wanted = Lazy("up")
+    manager.observe(Event(EventType.ISIS, None, wanted, sub_type="ADJ_UP"))
+    assert wanted.calls == 0
+    assert seen[0].msg == "up" and seen[0].msg == "up"
+    # Only formatted the once
+    assert wanted.calls == 1
+
+
+def test_nothing_formatted_without_collecting():
+    formatted = []
+    msg = Event.msg
+
+    def counting(evt):
+        if callable(evt._msg):
+            formatted.append(evt)
+        return msg.fget(evt)
+
+    topology = Topology("eventtest", seed=1, collect_events=False)
+    topology.build_ring(3)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    Event.msg = property(counting, msg.fset)
+    try:
+        assert topology.run_another(15000) == []
+    finally:
+        Event.msg = msg
+    assert formatted == []
+    assert len(topology.collector.events()) == 0
+
+
+def test_retention_caps_collector():
+    collector = EventCollector(retention=5)
+    observer = collector.observer("eventtest")
+    for idx in range(12):
+        observer(idx)
+    assert list(collector.events()) == [("eventtest", idx) for idx in range(7, 12)]
+
+    taken = collector.take()
+    assert len(taken) == 5
+    assert len(collector.events()) == 0
+    observer(12)
+    # A fresh buffer, with the same cap
+    assert list(collector.events()) == [("eventtest", 12)]
+    assert collector.events().maxlen == 5
+    assert len(taken) == 5
+
+
+def test_take_hands_over_everything():
+    collector = EventCollector()
+    observer = collector.observer("eventtest")
+    for idx in range(3):
+        observer(idx)
+    taken = collector.take()
+    observer(3)
+    assert taken == [("eventtest", 0), ("eventtest", 1), ("eventtest", 2)]
+    assert collector.events() == [("eventtest", 3)]
+
+    collector.enabled = False
+    observer(4)
+    assert collector.take() == [("eventtest", 3)]
+    assert collector.take() == []
+
+
+def ring_events(stream=False, retention=None, ticks=15000):
+    topology = Topology("eventtest", seed=1, event_retention=retention)
+    topology.build_ring(4)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    events = topology.run_another(ticks, stream=stream)
+    # Streaming runs nothing until it's iterated
+    if stream:
+        assert topology.context.queue.processed == 0
+    events = [(name, evt.when, str(evt.event_type), str(evt.sub_type), evt.msg)
+              for name, evt in events]
+    assert topology.clock.clockfn() == ticks
+    return events
+
+
+def test_streamed_same_as_collected():
+    collected = ring_events()
+    assert len(collected) > 0
+    assert ring_events(stream=True) == collected
+    # Still in time order
+    assert [evt[1] for evt in collected] == sorted(evt[1] for evt in collected)
+
+
+def test_retained_are_the_most_recent():
+    collected = ring_events()
+    assert ring_events(retention=100) == collected[-100:]
+
+
+def test_stream_stopped_early():
+    topology = Topology("eventtest", seed=1)
+    topology.build_ring(3)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    for name, evt in topology.run_another(15000, stream=True):
+        if evt.when >= 100:
+            break
+    # Left at the tick it had got to
+    assert 100 <= topology.clock.clockfn() < 15000
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
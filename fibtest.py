@@ -0,0 +1,148 @@
+"""
+The FIB is kept up to date a change at a time (see
+router.ForwardingTableUpdater), so after anything happens it should
+still be exactly what regenerating it from the routing tables gives
+
+    python fibtest.py
+    python -m pytest fibtest.py
+"""
+from routersim.topology import Topology
+from routersim.messaging import FrameType
+from routersim.routing import BGPRoute, RSVPRoute
+from routersim.mpls import PushStackOperation
+from ipaddress import ip_address, ip_network
+import logging
+
+
+def fib_mismatches(router):
+    """
+    prefix or label -> (installed, regenerated) for every entry which
+    differs
+    """
+    installed = router._forwarding.fib
+    regenerated = router.routing.forwarding_table()
+
+    mismatches = {}
+    for frame_type in (FrameType.IPV4, FrameType.MPLSU):
+        ours = {key: str(entry) for key, entry in installed[frame_type].items()}
+        theirs = {key: str(entry) for key, entry in regenerated[frame_type].items()
+                  if entry is not None}
+        for key in set(ours) | set(theirs):
+            if ours.get(key) != theirs.get(key):
+                mismatches[key] = (ours.get(key), theirs.get(key))
+
+    # What the PFE actually looks labels up in
+    ilm = {label: str(entry) for label, entry in router._forwarding.ilm.items()}
+    labels = {label: str(entry) for label, entry in installed[FrameType.MPLSU].items()}
+    if ilm != labels:
+        mismatches['ilm'] = (ilm, labels)
+    return mismatches
+
+
+def protected_ring():
+    topology = Topology("fibtest", seed=1, collect_events=False)
+    routers = topology.build_ring(5)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(15000)
+
+    routers[0].create_lsp("lsp1", routers[2].loopback_address, link_protection=True)
+    topology.rsvp_start_all()
+    topology.run_another(10000)
+    return topology, routers
+
+
+def assert_fibs_match(routers):
+    for router in routers:
+        mismatches = fib_mismatches(router)
+        assert len(mismatches) == 0, f"{router.hostname}: {mismatches}"
+
+
+def test_fib_matches_after_convergence():
+    _, routers = protected_ring()
+    assert len(routers[1].routing.mpls) > 0
+    assert_fibs_match(routers)
+
+
+def test_fib_matches_after_link_down():
+    topology, routers = protected_ring()
+    routers[0].interface('et1').link.down()
+    topology.run_another(5000)
+    assert_fibs_match(routers)
+
+
+def test_fib_matches_after_link_flap():
+    topology, routers = protected_ring()
+    # r1 is transit for lsp1, and has a bypass round the link on to r2
+    link = routers[1].interface('et2').link
+
+    link.down()
+    topology.run_another(5000)
+    # Labels through the failed link should have moved onto the bypass
+    moved = [entry for entry in routers[1]._forwarding.ilm.items()
+             if ',' in str(entry[1].action)]
+    assert len(moved) > 0
+
+    link.up()
+    topology.run_another(30000)
+    assert_fibs_match(routers)
+
+
+def peer_address(interface):
+    address = interface.address()
+    return next(ip for ip in address.network if ip != address.ip)
+
+
+def test_bgp_routes_follow_interface_up():
+    # No IGP, so nothing but the interface coming back up moves
+    # the BGP routes back off the bypass
+    topology = Topology("fibtest", seed=1, collect_events=False)
+    routers = topology.build_ring(3)
+    topology.run_another(100)
+    r0 = routers[0]
+    primary = r0.interface('et1').logical()
+    backup = r0.interface('et2').logical()
+
+    lsp = RSVPRoute(ip_network("10.9.9.9/32"), primary,
+                    peer_address(primary), "lsp", PushStackOperation(100))
+    lsp.bypass = RSVPRoute(ip_network("10.9.9.9/32"), backup,
+                           peer_address(backup), "bypass", PushStackOperation(200))
+    r0.routing.add_route(lsp, 'rsvp')
+
+    over_lsp = ip_network("10.1.42.0/24")
+    r0.routing.add_route(
+        BGPRoute(over_lsp, None, None, ['I'], ip_address("10.9.9.9")), 'bgp')
+    assert_fibs_match(routers)
+
+    link = r0.interface('et1').link
+    link.down()
+    topology.run_another(100)
+    assert r0._forwarding.fib[FrameType.IPV4][over_lsp].interface is backup
+    assert_fibs_match(routers)
+
+    link.up()
+    topology.run_another(100)
+    assert r0._forwarding.fib[FrameType.IPV4][over_lsp].interface is primary
+    assert_fibs_match(routers)
+
+
+def test_fib_matches_after_lsp_deleted():
+    topology, routers = protected_ring()
+    routers[0].delete_lsp("lsp1")
+    topology.run_another(20000)
+
+    # The bypasses only it wanted go with it, labels and all
+    for router in routers:
+        rsvp = router.process['rsvp']
+        assert len(rsvp.sessions) == 0, f"{router.hostname}: {rsvp.sessions}"
+        assert len(rsvp.path_state) == 0
+        assert len(router.routing.tables['mpls']) == 0
+    assert_fibs_match(routers)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
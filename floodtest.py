@@ -0,0 +1,133 @@
+"""
+Flooding from the per-interface SRM/SSN queues (FloodingQueues in
+routersim.isis.process): a converged area has nothing queued and
+nothing to send, and a new LSP still reaches every router
+
+    python floodtest.py
+    python -m pytest floodtest.py
+"""
+from routersim.isis.pdu import LinkStatePDU, PSNPPDU
+from routersim.isis.process import FloodingQueues, LinkStatePacketWrapper
+from routersim.observers import EventType
+from routersim.topology import Topology
+import logging
+
+
+def converged_grid(rows=3, columns=3):
+    topology = Topology("floodtest", seed=1, collect_events=False)
+    routers = topology.build_grid(rows, columns)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(30000)
+    return topology, routers
+
+
+def count_sent(routers):
+    sent = {}
+
+    def packet_sent(evt):
+        name = type(evt.object.payload).__name__
+        sent[name] = sent.get(name, 0) + 1
+
+    for router in routers:
+        router.event_manager.listen(EventType.PACKET_SEND, packet_sent)
+    return sent
+
+
+def assert_databases_agree(routers):
+    system_ids = sorted(router.process['isis'].system_id for router in routers)
+    for router in routers:
+        isis = router.process['isis']
+        assert sorted(isis.database) == system_ids, router.hostname
+        for other in routers:
+            theirs = other.process['isis']
+            assert isis.database[theirs.system_id].seq_no == theirs.database[theirs.system_id].seq_no
+
+
+def assert_nothing_queued(routers):
+    """
+    Except on interfaces which are down, those are left until there is
+    an adjacency to send to again
+    """
+    for router in routers:
+        isis = router.process['isis']
+        for queues in (isis.flooding.srm, isis.flooding.ssn):
+            for ifacename, queue in queues.items():
+                if isis.has_up_adjacency(ifacename):
+                    assert len(queue) == 0, f"{router.hostname} {ifacename}"
+
+
+def test_queues():
+    flooding = FloodingQueues()
+    lsp = LinkStatePacketWrapper(LinkStatePDU("0000.0000.0001", "0000.0000.0001", 1),
+                                 flooding=flooding)
+    lsp.set_srm("et1.0")
+    lsp.set_srm("et2.0")
+    lsp.set_srm("et1.0")
+    lsp.set_ssn("et2.0")
+    assert flooding.srm == {"et1.0": {"0000.0000.0001": True}, "et2.0": {"0000.0000.0001": True}}
+    assert flooding.ssn == {"et2.0": {"0000.0000.0001": True}}
+
+    # Left queued, the flag is checked when the queue is worked through
+    lsp.clear_srm("et1.0")
+    lsp.clear_ssn("et2.0")
+    assert "et1.0" not in lsp.srms and "et2.0" not in lsp.ssns
+    assert "0000.0000.0001" in flooding.srm["et1.0"]
+
+
+def test_converged_area_does_no_lsp_work():
+    topology, routers = converged_grid()
+    assert_databases_agree(routers)
+    assert_nothing_queued(routers)
+
+    snapshots = []
+    snapshot = LinkStatePacketWrapper.snapshot
+
+    def counting(self):
+        snapshots.append(self)
+        return snapshot(self)
+
+    sent = count_sent(routers)
+    LinkStatePacketWrapper.snapshot = counting
+    try:
+        # Plenty of runs of the LSP and PSNP timers
+        topology.run_another(5000)
+    finally:
+        LinkStatePacketWrapper.snapshot = snapshot
+
+    # Only hellos
+    assert sent.get(LinkStatePDU.__name__, 0) == 0
+    assert sent.get(PSNPPDU.__name__, 0) == 0
+    assert sent.get("P2PHelloPDU", 0) > 0
+    assert snapshots == []
+    assert_nothing_queued(routers)
+
+
+def test_new_lsp_reaches_every_router():
+    topology, routers = converged_grid()
+    center = routers[4].process['isis']
+    seq_no = center.database[center.system_id].seq_no
+
+    sent = count_sent(routers)
+    routers[4].interface('et1').link.down()
+    topology.run_another(30000)
+
+    assert center.database[center.system_id].seq_no > seq_no
+    assert sent[LinkStatePDU.__name__] > 0
+    assert_databases_agree(routers)
+    assert_nothing_queued(routers)
+    assert len(center.flooding.srm['et1.0']) > 0
+
+    # And back again
+    routers[4].interface('et1').link.up()
+    topology.run_another(30000)
+    assert_databases_agree(routers)
+    assert_nothing_queued(routers)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
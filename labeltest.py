@@ -0,0 +1,253 @@
+"""
+The label indexed tables in routersim.mpls against a plain dict,
+including that they shrink back down as labels go, and the
+LabelManager handing labels out again once they're released
+
+    python labeltest.py
+    python -m pytest labeltest.py
+"""
+from routersim.mpls import LabelTable, IncomingLabelMap, NextHopLabelForwardingEntry, PopStackOperation
+from routersim.mpls import LabelManager, FIRST_UNRESERVED_LABEL, MAX_LABEL
+from routersim.topology import Topology
+import logging
+import random
+
+
+def expected_capacity(labels, size=16):
+    """
+    Smallest doubling of size that fits the highest label in use
+    """
+    capacity = size
+    if len(labels) > 0:
+        while capacity <= max(labels):
+            capacity *= 2
+    return capacity
+
+
+def assert_matches(table, reference):
+    assert len(table) == len(reference)
+    assert dict(table.items()) == reference
+    assert sorted(table) == sorted(reference)
+    assert table.capacity() == expected_capacity(reference)
+
+
+def test_label_table_matches_dict():
+    rng = random.Random(1)
+    table = LabelTable()
+    reference = {}
+
+    for step in range(5000):
+        label = int(rng.expovariate(1 / 200))
+        if label in reference and rng.random() < 0.6:
+            del table[label]
+            del reference[label]
+        else:
+            table[label] = step
+            reference[label] = step
+
+        assert table.get(label) == reference.get(label)
+        assert (label in table) == (label in reference)
+        if step % 100 == 0:
+            assert_matches(table, reference)
+
+    assert_matches(table, reference)
+
+
+def test_label_table_grows_and_shrinks():
+    table = LabelTable()
+    assert table.capacity() == 16
+
+    table[1000] = 'high'
+    assert table.capacity() == 1024
+    table[20] = 'low'
+
+    # Nothing else above 32 once the high one goes
+    del table[1000]
+    assert table.capacity() == 32
+    assert table.get(20) == 'low'
+    assert table.get(1000) is None
+
+    del table[20]
+    assert table.capacity() == 16
+    assert len(table) == 0
+
+
+def test_removing_low_labels_keeps_space_for_high_ones():
+    table = LabelTable((label, label) for label in range(16, 200))
+    assert table.capacity() == 256
+
+    for label in range(16, 199):
+        del table[label]
+        assert table.capacity() == 256
+    assert list(table.items()) == [(199, 199)]
+
+    del table[199]
+    assert table.capacity() == 16
+
+
+def test_missing_labels():
+    table = LabelTable()
+    table[17] = 'x'
+    for label in (16, 18, 5000):
+        assert label not in table
+        assert table.get(label, 'default') == 'default'
+        try:
+            del table[label]
+        except KeyError:
+            pass
+        else:
+            assert False, f"deleted missing {label}"
+    assert table.pop(5000) is None
+    assert table.pop(17) == 'x'
+    assert len(table) == 0
+
+
+def test_table_starts_at_base():
+    table = LabelTable(base=400)
+    for label in (400, 401, 402):
+        table[label] = label
+    # Sized by the span of labels, not the labels themselves
+    assert table.capacity() == 16
+    assert dict(table.items()) == {400: 400, 401: 401, 402: 402}
+    assert sorted(table) == [400, 401, 402]
+    assert table.get(399) is None
+    assert 16 not in table
+
+    del table[402]
+    assert table.pop(401) == 401
+    assert list(table) == [400]
+
+
+def test_label_below_base_moves_base():
+    table = LabelTable(base=400)
+    table[401] = 'dynamic'
+    table[42] = 'static'
+    assert table.base == 42
+    assert dict(table.items()) == {42: 'static', 401: 'dynamic'}
+
+    del table[401]
+    assert dict(table.items()) == {42: 'static'}
+    assert table.get(401) is None
+
+
+def test_negative_labels_rejected():
+    table = LabelTable()
+    table[15] = 'last slot'
+    # Not the last slot through negative indexing
+    assert table.get(-1) is None
+    assert -1 not in table
+    try:
+        table[-1] = 'x'
+    except KeyError:
+        pass
+    else:
+        assert False, "stored a negative label"
+    assert dict(table.items()) == {15: 'last slot'}
+
+
+def test_incoming_label_map_lookup():
+    ilm = IncomingLabelMap()
+    entry = NextHopLabelForwardingEntry("et1", PopStackOperation())
+    ilm[300] = entry
+
+    assert ilm.lookup(300) == [entry]
+    assert ilm.lookup(301) is None
+    assert ilm.lookup(100000) is None
+
+    del ilm[300]
+    assert ilm.lookup(300) is None
+    assert ilm.capacity() == 16
+
+
+def test_released_labels_reused_lowest_first():
+    labels = LabelManager()
+    allocated = [labels.allocate() for _ in range(10)]
+    assert allocated == list(range(FIRST_UNRESERVED_LABEL, FIRST_UNRESERVED_LABEL + 10))
+
+    for label in (allocated[7], allocated[2], allocated[5]):
+        labels.release(label)
+    assert allocated[2] not in labels
+    assert [labels.allocate() for _ in range(4)] == [
+        allocated[2], allocated[5], allocated[7], FIRST_UNRESERVED_LABEL + 10]
+
+    stats = labels.statistics()
+    assert stats['in_use'] == len(labels) == 11
+    assert stats['free'] == 0
+    assert stats['high_water'] == FIRST_UNRESERVED_LABEL + 10
+    assert stats['allocations'] == 14
+    assert stats['releases'] == 3
+
+
+def test_label_range_enforced():
+    labels = LabelManager(first=100, last=102)
+    assert labels.statistics()['high_water'] is None
+    assert [labels.allocate() for _ in range(3)] == [100, 101, 102]
+    for bad in (labels.allocate, lambda: labels.release(50)):
+        try:
+            bad()
+        except Exception:
+            pass
+        else:
+            assert False, "expected an exception"
+
+    labels.release(101)
+    try:
+        labels.release(101)
+    except Exception:
+        pass
+    else:
+        assert False, "released twice"
+    assert labels.allocate() == 101
+
+    for first, last in ((0, 100), (16, MAX_LABEL + 1), (200, 100)):
+        try:
+            LabelManager(first, last)
+        except Exception:
+            pass
+        else:
+            assert False, f"accepted {first}-{last}"
+
+
+def test_lsp_churn_reuses_labels():
+    topology = Topology("labeltest", seed=1, collect_events=False)
+    routers = topology.build_ring(5)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(15000)
+    topology.rsvp_start_all()
+
+    rng = random.Random(1)
+    for rnd in range(10):
+        lsps = []
+        for i in range(5):
+            source, dest = rng.sample(routers, 2)
+            source.create_lsp(f"lsp{rnd}-{i}", dest.loopback_address)
+            lsps.append((source, f"lsp{rnd}-{i}"))
+        topology.run_another(2000)
+        assert sum(len(router.routing.tables['mpls']) for router in routers) > 0
+
+        for source, name in lsps:
+            source.delete_lsp(name)
+        topology.run_another(2000)
+
+        for router in routers:
+            assert len(router.labels) == 0, router.hostname
+            assert len(router.routing.tables['mpls']) == 0
+            assert router._forwarding.ilm.base == router.labels.first
+            assert router._forwarding.ilm.capacity() == 16
+
+    # Never more than a round's worth in use, so never more than
+    # that handed out
+    for router in routers:
+        stats = router.labels.statistics()
+        assert stats['allocations'] == stats['releases']
+        if stats['high_water'] is not None:
+            assert stats['high_water'] - router.labels.first < 5
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
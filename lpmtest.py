@@ -0,0 +1,102 @@
+"""
+PrefixTable (routersim.lpm) against a brute force longest match
+
+    python lpmtest.py
+    python -m pytest lpmtest.py
+"""
+from ipaddress import ip_address, ip_network
+from routersim.lpm import PrefixTable
+import random
+
+
+def longest_match(prefixes, address):
+    best = None
+    for prefix in prefixes:
+        if address in prefix and (best is None or prefix.prefixlen > best.prefixlen):
+            best = prefix
+    return best
+
+
+def random_prefixes(rng, count):
+    prefixes = set()
+    while len(prefixes) < count:
+        # Keep to a small corner of the address space so they overlap
+        address = (10 << 24) | rng.getrandbits(12) << 12
+        length = rng.choice([8, 12, 16, 18, 20, 22, 24, 28, 32])
+        prefixes.add(ip_network((address, length), strict=False))
+    return list(prefixes)
+
+
+def test_lookup_matches_brute_force():
+    rng = random.Random(1)
+    prefixes = random_prefixes(rng, 300)
+    table = PrefixTable((prefix, str(prefix)) for prefix in prefixes)
+    assert len(table) == len(prefixes)
+
+    for _ in range(2000):
+        address = ip_address((10 << 24) | rng.getrandbits(24))
+        best = longest_match(prefixes, address)
+        if best is None:
+            assert table.lookup(address) is None
+        else:
+            assert table.lookup_prefix(address) == (best, str(best)), address
+            assert table.lookup(str(address)) == str(best)
+            assert table.lookup(int(address)) == str(best)
+
+
+def test_lookup_after_deletes():
+    rng = random.Random(2)
+    prefixes = random_prefixes(rng, 200)
+    table = PrefixTable((prefix, str(prefix)) for prefix in prefixes)
+
+    rng.shuffle(prefixes)
+    for prefix in prefixes[:150]:
+        del table[prefix]
+        assert prefix not in table
+    prefixes = prefixes[150:]
+    assert len(table) == len(prefixes)
+    assert sorted(prefix for prefix, _ in table.items()) == sorted(prefixes)
+
+    for _ in range(1000):
+        address = ip_address((10 << 24) | rng.getrandbits(24))
+        best = longest_match(prefixes, address)
+        assert table.lookup(address) == (str(best) if best is not None else None)
+
+
+def test_default_and_host_routes():
+    table = PrefixTable()
+    table['0.0.0.0/0'] = 'default'
+    table['192.168.1.0/24'] = 'lan'
+    table['192.168.1.5/32'] = 'host'
+
+    assert table.lookup('192.168.1.5') == 'host'
+    assert table.lookup('192.168.1.6') == 'lan'
+    assert table.lookup('8.8.8.8') == 'default'
+
+    # Replacing a value doesn't add another entry
+    table['192.168.1.0/24'] = 'lan2'
+    assert len(table) == 3
+    assert table.lookup('192.168.1.6') == 'lan2'
+
+    del table['0.0.0.0/0']
+    assert table.lookup('8.8.8.8') is None
+
+
+def test_lookup_of_prefix_ignores_longer_ones():
+    table = PrefixTable()
+    table['10.0.0.0/8'] = 'wide'
+    table['10.1.0.0/16'] = 'narrow'
+
+    assert table.lookup('10.1.0.0/16') == 'narrow'
+    assert table.lookup('10.0.0.0/12') == 'wide'
+    assert table.lookup(ip_network('10.0.0.0/15')) == 'wide'
+    # Exact match only
+    assert table.get('10.0.0.0/12') is None
+    assert table.get('10.1.0.0/16') == 'narrow'
+
+
+if __name__ == '__main__':
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
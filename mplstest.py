@@ -133,7 +133,7 @@ print("")
 # This is actually the end of our line here
 r2.routing.add_route(
     RSVPRoute(
-        "42",
+        42,
         r2.interface('et2.0'),
         r3.interface('et1.0').address(),
         lsp_name="lsp-r1-to-r3",
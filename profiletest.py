@@ -0,0 +1,96 @@
+"""
+Profiling a run (routersim.profiling) attributes the callbacks to the
+right device and handler
+
+    python profiletest.py
+    python -m pytest profiletest.py
+"""
+from functools import partial
+from routersim.profiling import Profiler
+from routersim.topology import Topology
+import logging
+
+
+def isis_ring(count=3):
+    topology = Topology("profiletest", seed=1, collect_events=False)
+    routers = topology.build_ring(count)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    return topology, routers
+
+
+def test_report_by_device_and_handler():
+    topology, routers = isis_ring()
+    topology.enable_profiling()
+    topology.run_another(10000)
+
+    report = topology.profile_report()
+    assert len(report) > 0
+    devices = set(entry.device for entry in report)
+    for router in routers:
+        assert router.hostname in devices
+
+    calls = sum(entry.calls for entry in report)
+    assert calls == topology.context.queue.processed
+
+    # Most expensive first, each handler only once per device
+    assert [entry.total_time for entry in report] == sorted(
+        (entry.total_time for entry in report), reverse=True)
+    names = [(entry.device, entry.handler) for entry in report]
+    assert len(names) == len(set(names))
+
+    for router in routers:
+        mine = topology.profile_report(device=router.hostname)
+        assert all(entry.device == router.hostname for entry in mine)
+        handlers = set(entry.handler for entry in mine)
+        # Frames arriving and IS-IS's own timers
+        assert any(handler.startswith("PhysicalInterface.") for handler in handlers), handlers
+        assert any("Isis" in handler for handler in handlers), handlers
+
+    totals = topology.profiler.by_device()
+    for router in routers:
+        assert abs(totals[router.hostname] - sum(
+            entry.total_time for entry in topology.profile_report(device=router.hostname))) < 1e-9
+
+    assert len(topology.profile_report(limit=2)) == 2
+
+
+def test_callbacks_not_kept_alive():
+    class Owner:
+        def __init__(self, hostname):
+            self.hostname = hostname
+
+        def tick(self):
+            pass
+
+    def made_by(owner):
+        return lambda: owner
+
+    profiler = Profiler()
+    owners = [Owner("a"), Owner("b")]
+    for _ in range(100):
+        for owner in owners:
+            profiler.call(made_by(owner), (), None)
+            profiler.call(partial(made_by(owner)), (), None)
+            profiler.call(owner.tick, (), None)
+            profiler.call(partial(owner.tick), (), None)
+
+    # One cached entry per (method, owner), nothing for the closures
+    assert len(profiler._by_action) == len(owners)
+
+    # Closures are still attributed by what they close over
+    by_name = {(entry.device, entry.handler): entry.calls for entry in profiler.report()}
+    ticks = {device: calls for (device, handler), calls in by_name.items()
+             if handler.endswith("Owner.tick")}
+    assert ticks == {"a": 200, "b": 200}
+    closures = {device: calls for (device, handler), calls in by_name.items()
+                if handler.endswith("<lambda>")}
+    assert closures == {"a": 200, "b": 200}
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
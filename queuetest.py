@@ -0,0 +1,132 @@
+"""
+EventQueue (routersim.observers): same-tick events replay in the same
+order for a seed, and an exception doesn't lose the rest of its batch
+
+    python queuetest.py
+    python -m pytest queuetest.py
+"""
+from routersim.observers import Clock, EventQueue
+from routersim.topology import Topology
+import logging
+
+
+def event_queue(seed):
+    clock = Clock()
+    return EventQueue(clock.clockfn, clock.delayfn, seed=seed), clock
+
+
+def run_order(seed, count=50, shuffle=True):
+    queue, _ = event_queue(seed)
+    ran = []
+    for idx in range(count):
+        # Everything on one of two ticks
+        queue.enqueue(5 + idx % 2 * 5, ran.append, (idx, ), shuffle=shuffle)
+    queue.run_until(100)
+    return ran
+
+
+def test_same_seed_same_order():
+    assert run_order(1) == run_order(1)
+    assert run_order("x") == run_order("x")
+    # Still in tick order, whatever the order within a tick
+    ran = run_order(1)
+    assert set(ran[:25]) == set(range(0, 50, 2))
+    assert set(ran[25:]) == set(range(1, 50, 2))
+
+
+def test_different_seed_reorders_same_tick():
+    orders = set(tuple(run_order(seed)) for seed in range(5))
+    assert len(orders) > 1
+    for order in orders:
+        assert sorted(order[:25]) == list(range(0, 50, 2))
+
+
+def test_unshuffled_run_fifo_after_the_rest():
+    assert run_order(1, shuffle=False) == list(range(0, 50, 2)) + list(range(1, 50, 2))
+
+    queue, _ = event_queue(1)
+    ran = []
+    for idx in range(10):
+        queue.enqueue(5, ran.append, (("unshuffled", idx), ), shuffle=False)
+        queue.enqueue(5, ran.append, (("shuffled", idx), ))
+    queue.run_until(5)
+    assert [kind for kind, _ in ran] == ["shuffled"] * 10 + ["unshuffled"] * 10
+    assert [idx for kind, idx in ran if kind == "unshuffled"] == list(range(10))
+
+
+def test_unshuffled_dont_change_the_order():
+    def order(observations):
+        queue, _ = event_queue(3)
+        ran = []
+        for idx in range(30):
+            queue.enqueue(5, ran.append, (idx, ))
+            if observations:
+                queue.enqueue(5, lambda: None, shuffle=False)
+        queue.run_until(10)
+        return ran
+    assert order(False) == order(True)
+
+
+def test_exception_keeps_rest_of_batch():
+    queue, clock = event_queue(1)
+    ran = []
+
+    def fail():
+        ran.append("fail")
+        raise RuntimeError("fail")
+
+    for idx in range(10):
+        queue.enqueue(5, ran.append, (idx, ))
+    queue.enqueue(5, fail)
+    queue.enqueue(8, ran.append, ("later", ))
+
+    try:
+        queue.run_until(20)
+    except RuntimeError:
+        pass
+    else:
+        assert False, "expected the exception"
+
+    # Stopped at the failing tick, with whatever came after fail()
+    # still to run
+    assert clock.clockfn() == 5
+    done = ran.index("fail") + 1
+    assert queue.processed == done
+    assert len(queue) == 11 - done + 1
+
+    queue.run_until(20)
+    assert sorted(idx for idx in ran if isinstance(idx, int)) == list(range(10))
+    assert ran[-1] == "later"
+    assert queue.processed == 12
+    assert clock.clockfn() == 20
+
+
+def test_run_returns_delay_to_next():
+    queue, clock = event_queue(1)
+    queue.enqueue(0, lambda: None)
+    queue.enqueue(7, lambda: None)
+    assert queue.run() == 7
+    clock.delayfn(7)
+    assert queue.run() is None
+    assert queue.processed == 2
+
+
+def test_topology_replays_for_a_seed():
+    def run(seed):
+        topology = Topology("queuetest", seed=seed)
+        topology.build_ring(4)
+        topology.isis_enable_all()
+        topology.isis_start_all()
+        return [(evt.when, name, str(evt.event_type), str(evt.sub_type), evt.msg)
+                for name, evt in topology.run_another(5000)]
+
+    assert run(1) == run(1)
+    assert run(1) != run(2)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
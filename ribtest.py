@@ -0,0 +1,136 @@
+"""
+The longest-match indexes RoutingTables keeps over its chains (inet,
+inet3, recursive) should give the same answers as scanning the tables,
+however routes come and go
+
+    python ribtest.py
+    python -m pytest ribtest.py
+"""
+from ipaddress import ip_address, ip_network
+from routersim.observers import EventManager, SimulationContext
+from routersim.routing import RoutingTables, Route, RouteType
+import logging
+import random
+
+
+TABLE_TYPES = {
+    'direct': RouteType.CONNECTED,
+    'static': RouteType.STATIC,
+    'isis': RouteType.ISIS,
+    'bgp': RouteType.BGP,
+    'rsvp': RouteType.RSVP,
+}
+
+
+def routing_tables():
+    return RoutingTables(
+        evt_manager=EventManager("ribtest", context=SimulationContext()),
+        parent_logger=logging.getLogger("ribtest"))
+
+
+def chains(routing):
+    return {'inet': routing.inet, 'inet3': routing.inet3, 'recursive': routing.recursive}
+
+
+def chain_prefixes(chain):
+    prefixes = set()
+    for table in chain.maps:
+        prefixes.update(table.keys())
+    return prefixes
+
+
+def assert_indexes_match(routing, rng, lookups=200):
+    for name, chain in chains(routing).items():
+        index = routing._indexes[id(chain)]
+        assert set(prefix for prefix, _ in index.items()) == chain_prefixes(chain), name
+
+        for _ in range(lookups):
+            address = ip_address((10 << 24) | rng.getrandbits(16))
+            indexed = routing.lookup_ip(address, chain)
+            scanned = routing._scan_lookup_ip(address, chain)
+            assert str(indexed) == str(scanned), f"{name} {address}: {indexed} != {scanned}"
+
+
+def random_prefix(rng):
+    length = rng.choice([8, 16, 20, 24, 32])
+    return ip_network(((10 << 24) | rng.getrandbits(16), length), strict=False)
+
+
+def test_indexes_follow_adds_and_deletes():
+    rng = random.Random(1)
+    routing = routing_tables()
+    installed = []
+
+    for step in range(600):
+        if len(installed) > 0 and rng.random() < 0.4:
+            table_name, route = installed.pop(rng.randrange(len(installed)))
+            routing.del_route(route, table_name)
+        else:
+            table_name = rng.choice(list(TABLE_TYPES))
+            route = Route(random_prefix(rng), TABLE_TYPES[table_name],
+                          f"et{step}", ip_address(0x0A000000 + step))
+            routing.add_route(route, table_name)
+            installed.append((table_name, route))
+
+        if step % 50 == 0:
+            assert_indexes_match(routing, rng)
+
+    assert_indexes_match(routing, rng)
+
+
+def test_prefix_in_several_tables():
+    routing = routing_tables()
+    prefix = ip_network("10.1.0.0/16")
+    static = Route(prefix, RouteType.STATIC, "et1", ip_address("10.0.0.1"))
+    isis = Route(prefix, RouteType.ISIS, "et2", ip_address("10.0.0.2"))
+    routing.add_route(static, 'static')
+    routing.add_route(isis, 'isis')
+    wider = Route(ip_network("10.0.0.0/8"), RouteType.ISIS, "et3", ip_address("10.0.0.3"))
+    routing.add_route(wider, 'isis')
+
+    # static is ahead of isis in the chain
+    assert routing.lookup_ip(ip_address("10.1.2.3")).interface == "et1"
+
+    # Still there while any table in the chain has it
+    routing.del_route(static, 'static')
+    assert routing.lookup_ip(ip_address("10.1.2.3")).interface == "et2"
+
+    routing.del_route(isis, 'isis')
+    assert routing.lookup_ip(ip_address("10.1.2.3")).interface == "et3"
+    assert prefix not in routing._indexes[id(routing.inet)]
+
+
+def test_rsvp_routes_stay_out_of_inet():
+    routing = routing_tables()
+    lsp = Route(ip_network("10.9.9.9/32"), RouteType.RSVP, "et1", ip_address("10.0.0.1"))
+    routing.add_route(lsp, 'rsvp')
+
+    address = ip_address("10.9.9.9")
+    assert routing.lookup_ip(address) is None
+    assert routing.lookup_ip(address, routing.inet3).interface == "et1"
+    assert routing.lookup_ip(address, routing.recursive).interface == "et1"
+
+    routing.del_route(lsp, 'rsvp')
+    assert routing.lookup_ip(address, routing.recursive) is None
+
+
+def test_set_routes_keeps_indexes():
+    rng = random.Random(2)
+    routing = routing_tables()
+
+    for _ in range(10):
+        routes = [Route(random_prefix(rng), RouteType.ISIS, f"et{i}", ip_address("10.0.0.1"))
+                  for i in range(50)]
+        routing.set_routes(routes, 'isis')
+        assert_indexes_match(routing, rng, lookups=50)
+
+    routing.set_routes([], 'isis')
+    assert len(routing._indexes[id(routing.inet)]) == 0
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -3,10 +3,9 @@ import binascii
 from enum import Enum
 from ipaddress import IPv4Address, ip_address, IPv4Interface
 
-from scapy.layers.inet import IP
-from scapy.layers.l2 import ARP
 from .messaging import MACAddress
 from .interface import LogicalInterface
+from .packets import arp
 
 
 from .observers import GlobalQueueManager, EventType, Event
@@ -23,11 +22,14 @@ class ArpEvent(Event):
 
 
 class ArpCache(UserDict):
-    def __init__(self):
+    def __init__(self, context=None):
         super().__init__()
+        if context is None:
+            context = GlobalQueueManager.default()
+        self.context = context
 
     def __setitem__(self, key: IPv4Address|str, value):
-         self.data[str(key)] = ArpEntry(key, value, GlobalQueueManager.now())
+         self.data[str(key)] = ArpEntry(key, value, self.context.now())
 
     def __getitem__(self, key: IPv4Address|str):
         entry = self.data.get(str(key))
@@ -50,12 +52,15 @@ class ArpEntry:
         self.last_used = used
 
 class ArpHandler:
-    def __init__(self, sender, event_manager, logger, cache=None, queue=None):
+    def __init__(self, sender, event_manager, logger, cache=None, queue=None, context=None):
         self.sender = sender
         self.event_manager = event_manager
         self.logger = logger.getChild("arp")
+        if context is None:
+            context = GlobalQueueManager.default()
+        self.context = context
         if cache is None:
-            self.cache = ArpCache()
+            self.cache = ArpCache(context)
         else:
             self.cache = cache
 
@@ -65,11 +70,12 @@ class ArpHandler:
         else:
             self.send_q = queue
 
-    def process(self, packet: ARP, interface: LogicalInterface):
+    def process(self, packet, interface: LogicalInterface):
         # ARP Poisoning, whaddup
         # TODO: What should be proper src address when we don't have one?
         if packet.psrc != ip_address("0.0.0.0"):
-            if self.cache[packet.psrc] != packet.hwsrc:
+            if (self.cache[packet.psrc] != packet.hwsrc and
+                    self.event_manager.is_enabled(EventType.ARP, "ARP_ADD")):
                 self.event_manager.observe(
                     ArpEvent(
                         self,
@@ -101,7 +107,7 @@ class ArpHandler:
             del self.send_q[packet.psrc]
 
     # TODO: This probably belongs in the "sender"
-    def enqueue(self, nh: IPv4Address|str, pdu: IP, interface: LogicalInterface):
+    def enqueue(self, nh: IPv4Address|str, pdu, interface: LogicalInterface):
         if str(nh) not in self.send_q:
             self.send_q[str(nh)] = []
 
@@ -117,7 +123,7 @@ class ArpHandler:
             interface_addr = interface_addr.ip
 
 
-        packet = ARP(
+        packet = arp(
             op=ArpType.Request,
             hwsrc = interface.hw_address,
             psrc = str(interface_addr),
@@ -133,7 +139,7 @@ class ArpHandler:
               from_address: IPv4Address|str,
               interface: LogicalInterface):
 
-        packet = ARP(
+        packet = arp(
             op = ArpType.Reply,
             hwsrc = interface.hw_address,
             psrc = str(from_address),
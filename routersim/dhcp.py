@@ -1,10 +1,9 @@
+from .scapy import IP,UDP
 from scapy.layers.dhcp import DHCP,BOOTP
-from scapy.layers.inet import IP,UDP
 from ipaddress import ip_address,ip_network,IPv4Address,IPv4Network
-from random import randint
 from .messaging import BROADCAST_MAC, FrameType
 from .interface import LogicalInterface
-from .observers import GlobalQueueManager, EventType, Event
+from .observers import EventType, Event
 
 
 # https://en.wikipedia.org/wiki/Dynamic_Host_Configuration_Protocol
@@ -48,10 +47,13 @@ class DHCPEvent(Event):
 
 class DHCPClient():
 
-    def __init__(self, host):
+    def __init__(self, host, context=None):
         self.hostname = host.hostname
         self.host = host
         self.logger = host.logger.getChild("DHCPClient")
+        if context is None:
+            context = host.context
+        self.context = context
 
     # Issue a DHCPDiscover request
     def discover(self, iface):
@@ -82,7 +84,7 @@ class DHCPClient():
             sport=BOOTP_CLIENT_PORT, dport=BOOTP_SERVER_PORT
         ) / BOOTP(
             chaddr=iface.hw_address, 
-            xid=randint(0,10000), 
+            xid=self.context.random.randint(0,10000), 
             flags="B"
         ) / DHCP(
             options=options
@@ -110,7 +112,7 @@ class DHCPClient():
             sport=BOOTP_CLIENT_PORT, dport=BOOTP_SERVER_PORT
         ) / BOOTP(
             chaddr=iface.hw_address, 
-            xid=randint(0,10000), 
+            xid=self.context.random.randint(0,10000), 
             flags="B",
             siaddr=bootp.siaddr     # who's offer are we accepting
         ) / DHCP(
@@ -140,7 +142,7 @@ class DHCPClient():
                 self.logger.warn(f"Cannot accept {offered_address}, its already taken!")
 
         # Wait 100ms
-        GlobalQueueManager.enqueue(100, check_and_request)
+        self.context.enqueue(100, check_and_request)
 
     # Fully apply the IP config we got from the DHCP server
     def apply_config(self, iface: LogicalInterface, ack: BOOTP):
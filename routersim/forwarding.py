@@ -1,11 +1,11 @@
 
 from routersim.interface import LogicalInterface
-from .messaging import FrameType
+from .messaging import FrameType, clone
 from .messaging import ICMPType, UnreachableType
-from .mpls import MPLSPacket, PopStackOperation
+from .mpls import MPLSPacket, PopStackOperation, IncomingLabelMap, IMPLICIT_NULL
 from .observers import Event, EventType
-from scapy.layers.inet import IP,ICMP,icmptypes
-from copy import copy
+from .lpm import PrefixTable
+from .packets import IPv4Packet, ipv4, icmp, is_scapy
 import ipaddress
 
 
@@ -15,43 +15,68 @@ class ForwardingTable:
         self.fib = None
         self.event_manager = event_manager
         self.logger = parent_logger.getChild('forwarding')
+        # Compiled forms of the IPv4 and label FIBs used for lookups
+        self._ipv4 = PrefixTable()
+        self.ilm = IncomingLabelMap()
 
     def __str__(self):
         return "Forwarding Table"
 
     def set_fib(self, fib):
         self.fib = fib
+        self._ipv4 = PrefixTable(fib[FrameType.IPV4].items())
+        self.ilm = IncomingLabelMap(fib[FrameType.MPLSU].items(), base=self.ilm.base)
         self.logger.debug("Installed new forwarding table")
 
+    def set_label_base(self, first):
+        """
+        The labels we hand out start at first, so the ILM only needs
+        room from there up
+        """
+        self.ilm = IncomingLabelMap(self.ilm.items(), base=first)
+
+    def update_ip(self, prefix, entry):
+        """
+        Install (or with entry=None, remove) the entry for a single prefix
+        """
+        ipfib = self.fib[FrameType.IPV4]
+        if entry is None:
+            if prefix in ipfib:
+                del ipfib[prefix]
+                del self._ipv4[prefix]
+        else:
+            ipfib[prefix] = entry
+            self._ipv4[prefix] = entry
+
+    def update_label(self, label, entry):
+        mplsfib = self.fib[FrameType.MPLSU]
+        if entry is None:
+            mplsfib.pop(label, None)
+            self.ilm.pop(label)
+        else:
+            mplsfib[label] = entry
+            self.ilm[label] = entry
+
     def lookup_ip(self, ip_address):
-        as_network = ipaddress.ip_network(ip_address)
-        # ASSUMPTION: fib is sorted with highest prefix first
-        # so we should always arrive at something more specific first
-        # yes, this is very inefficient
         if self.fib is None:
             return None
 
-        for prefix in self.fib[FrameType.IPV4]:
-            if as_network.overlaps(prefix):
-                self.event_manager.observe(
-                    Event(
-                        EventType.FORWARDING,
-                        self,
-                        f"Identified forwarding entry for {ip_address}"
-                    )
-                )
-                return [self.fib[FrameType.IPV4][prefix]]
-
-        return None
-
-    def lookup_label(self, label):
-        if self.fib is None:
+        entry = self._ipv4.lookup(ip_address)
+        if entry is None:
             return None
 
-        if self.fib is None or FrameType.MPLSU not in self.fib:
-            return None
+        if self.event_manager.is_enabled(EventType.FORWARDING):
+            self.event_manager.observe(
+                Event(
+                    EventType.FORWARDING,
+                    self,
+                    f"Identified forwarding entry for {ip_address}"
+                )
+            )
+        return [entry]
 
-        return [self.fib[FrameType.MPLSU][str(label)]]
+    def lookup_label(self, label):
+        return self.ilm.lookup(label)
 
     def print_fib(self):
         print("** IPV4 FIB ***")
@@ -75,12 +100,14 @@ class PacketForwardingEngine():
 
     # Intended for internal communications
     def accept_frame(self, frame, dest_interface=None):
-        self.router.event_manager.observe(
-            Event(
-                EventType.PACKET_SEND,
-                self.router, f"PFE Sending {frame.type}", object=frame, target=dest_interface,
-                sub_type="LOCAL_SEND")
-            )
+        event_manager = self.router.event_manager
+        if event_manager.is_enabled(EventType.PACKET_SEND, "LOCAL_SEND"):
+            event_manager.observe(
+                Event(
+                    EventType.PACKET_SEND,
+                    self.router, f"PFE Sending {frame.type}", object=frame, target=dest_interface,
+                    sub_type="LOCAL_SEND")
+                )
         # parameter naming was confusing...
         self.process_frame(frame, dest_interface=dest_interface, from_self=True)
 
@@ -108,7 +135,12 @@ class PacketForwardingEngine():
 
                     self.logger.info(f"New pdu is {newpdu}")
                     if isinstance(newpdu, MPLSPacket):
-                        hop_action.interface.phy.send(FrameType.MPLSU, newpdu)
+                        self.send_encapsulated(
+                            hop_action.next_hop_ip,
+                            FrameType.MPLSU,
+                            newpdu,
+                            hop_action.interface
+                        )
                     else:
                         self.logger.warn("Didn't get back an MPLSPacket")
                 else:
@@ -134,10 +166,10 @@ class PacketForwardingEngine():
                     elif hop_action.action == 'REJECT' and source_interface is not None:
                         #print(f"Sending reject from {source_interface.name}:{source_interface.address().ip} to {pdu.source_ip}")
                         
-                        packet = IP(
+                        packet = ipv4(
                             dst=pdu.src,
                             src=source_interface.address().ip
-                        ) / ICMP(
+                        ) / icmp(
                             type = ICMPType.DestinationUnreachable,
                             code=UnreachableType.NetworkUnreachable
                         ) / (
@@ -153,7 +185,14 @@ class PacketForwardingEngine():
                 pass
                 # send unreachable
 
-        pdu = copy(frame.pdu)
+        # The frame may also have been delivered elsewhere, so
+        # change TTL/labels on our own copy
+        if frame.type == FrameType.CLNS:
+            # IS-IS doesn't change what it receives, no need to clone
+            self.router.process['isis'].process_pdu(source_interface, frame.payload)
+            return
+
+        pdu = clone(frame.payload)
         if frame.type == FrameType.IPV4:
             self.logger.info("Calling process_ip")
             process_ip(pdu, dest_interface)
@@ -165,38 +204,34 @@ class PacketForwardingEngine():
             # would is also happen on routed interfaces?
             self.router.process_arp(source_interface, pdu)
             # TODO: If we're switching, we also want to forward it!
-        elif frame.type == FrameType.CLNS:
-            self.router.process['isis'].process_pdu(source_interface, frame.pdu)
         elif frame.type == FrameType.MPLSU:
             # pdu should be an MPLSPacket
-            potential_next_hops = None
-            try:
-                potential_next_hops = self.forwarding.lookup_label(
-                    pdu.label_stack[len(pdu.label_stack)-1]
-                )
-            except:
-                if pdu.label_stack[0] == '3':
-                    newpdu = PopStackOperation().apply(pdu, self.router, event_manager=self.router.event_manager)
-                    if isinstance(newpdu, IP):
+            event_manager = self.router.event_manager
+            if not event_manager.is_enabled(EventType.MPLS):
+                # Saves every label operation asking again
+                event_manager = None
+
+            fibentry = self.forwarding.ilm.get(pdu.label_stack[-1])
+            if fibentry is None:
+                if pdu.label_stack[0] == IMPLICIT_NULL:
+                    newpdu = PopStackOperation().apply(pdu, self.router, event_manager=event_manager)
+                    if isinstance(newpdu, IPv4Packet) or is_scapy(newpdu, 'IP'):
                         process_ip(newpdu)
                         return
 
-                self.logger.warn(f"Unable to find {pdu.label_stack[0]}")
+                self.logger.error(f"**** No action found for label {pdu.label_stack[-1]}")
+                return
 
-            if potential_next_hops is not None:
-                fibentry = potential_next_hops[0]
-                newpdu = fibentry.action.apply(pdu,
-                                               self.router, 
-                                               event_manager=self.router.event_manager)
-                if isinstance(newpdu, MPLSPacket):
-                    fibentry.interface.parent.send(
-                        FrameType.MPLSU, newpdu, logical=None)
-                elif isinstance(newpdu, IP):
-                    fibentry.interface.send_ip(newpdu)
-                else:
-                    print(f"Unknown de-encapsulated packet type!")
+            newpdu = fibentry.action.apply(pdu, self.router, event_manager=event_manager)
+            if isinstance(newpdu, MPLSPacket):
+                self.send_encapsulated(
+                    fibentry.next_hop_ip, FrameType.MPLSU, newpdu, fibentry.interface)
+            elif isinstance(newpdu, IPv4Packet) or is_scapy(newpdu, 'IP'):
+                # Penultimate hop popping
+                self.send_encapsulated(
+                    fibentry.next_hop_ip, FrameType.IPV4, newpdu, fibentry.interface)
             else:
-                self.logger.error(f"**** No action found for label {pdu.label_stack[0]}")
+                print(f"Unknown de-encapsulated packet type!")
 
     def send_encapsulated(self,
                           next_hop: ipaddress.IPv4Address,
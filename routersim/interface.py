@@ -2,8 +2,8 @@ from enum import Enum
 import ipaddress
 import binascii
 from .observers import Event, EventType, GlobalQueueManager
-from .messaging import frame, FrameType, MACAddress
-from scapy.layers.l2 import Ether
+from .messaging import frame, FrameType, MACAddress, ALL_ISS_MAC
+from .packets import ether
 #from scapy.layers.clns import 
 from copy import deepcopy
 
@@ -81,9 +81,15 @@ class PhysicalInterface:
         for intname in self.interfaces:
             self.interfaces[intname].down()
 
-    def connect(self, other, latency_ms=10):
-        self.link = PhysicalLink(self, other, latency_ms=latency_ms)
-        self.link.up()
+    def connect(self, other, latency_ms=10, up=True):
+        """
+        Cable this interface to other. With up=False the link is left
+        down, to be brought up later (see PhysicalLink.up_all)
+        """
+        self.link = PhysicalLink(self, other, latency_ms=latency_ms,
+                                 context=self.parent.context)
+        if up:
+            self.link.up()
 
         return self.link
 
@@ -102,7 +108,7 @@ class PhysicalInterface:
                 Event(
                     EventType.PACKET_RECV,
                     self,
-                    f"Received {frame.payload}",
+                    lambda: f"Received {frame.payload}",
                     object=frame)
             )
 
@@ -116,11 +122,17 @@ class LogicalInterface:
         self.addresses = {}
         self.parent = physical_interface
         self.te_metric = 10
+        # Traffic engineering attributes advertised for the link, the
+        # admin groups as a bit mask and the bandwidth in bits per second
+        self.admin_group = 0
+        self.bandwidth = None
 
         if addresses is not None:
             if 'ip' in addresses:
-                self.addresses['ipv4'] = ipaddress.ip_interface(
-                    addresses['ip'])
+                address = addresses['ip']
+                if not isinstance(address, ipaddress.IPv4Interface):
+                    address = ipaddress.ip_interface(address)
+                self.addresses['ipv4'] = address
 
             if 'iso' in addresses:
                 self.addresses['iso'] = addresses['iso']
@@ -141,7 +153,7 @@ class LogicalInterface:
     def logical(self):
         return self
 
-    def send_frame(self, frame: Ether):
+    def send_frame(self, frame):
         self.parent.send_frame(frame, logical=self)
 
     def send(self,
@@ -149,15 +161,14 @@ class LogicalInterface:
              frame_type: FrameType,
              pdu):
 
-        frame = Ether(src=self.hw_address, dst=dest_address, type=frame_type) / pdu
+        frame = ether(src=self.hw_address, dst=dest_address, type=frame_type) / pdu
         self.send_frame(frame)
 
     def _send_ip(self, pdu):
         self.phy.send(FrameType.IPV4, pdu, logical=self)
 
     def send_clns(self, pdu):
-        frame = Frame('000', '0000', FrameType.CLNS, pdu)
-        self.phy.send_frame(frame, logical=self)
+        self.send(ALL_ISS_MAC, FrameType.CLNS, pdu)
 
     def is_up(self):
         return (
@@ -190,33 +201,64 @@ class LogicalInterface:
 
 class PhysicalLink:
 
+    # Frames are delivered as is, which means a sender must not change
+    # a frame once sent and a receiver which wants to change one has
+    # to clone() it first. Setting this gives every receiver its own
+    # deep copy again, handy when hunting for something that breaks
+    # that rule
+    copy_frames = False
+
     # TODO: add jitter parameter
-    def __init__(self, endpoint1, endpoint2, latency_ms=10):
+    def __init__(self, endpoint1, endpoint2, latency_ms=10, context=None):
         self.endpoint1 = endpoint1
         self.endpoint2 = endpoint2
         self.endpoint2.link = self
         self.state = ConnectionState.DOWN
         self.latency_ms = latency_ms
+        if context is None:
+            context = GlobalQueueManager.default()
+        self.context = context
 
     def up(self):
         self.state = ConnectionState.UP
-        GlobalQueueManager.enqueue(
+        self.context.enqueue(
             self.latency_ms / 2,
             self.endpoint1.up
         )
-        GlobalQueueManager.enqueue(
+        self.context.enqueue(
             self.latency_ms / 2,
             self.endpoint2.up
         )
 
+    @staticmethod
+    def up_all(links):
+        """
+        Bring up a batch of links, the same as calling up() on each
+        but with one scheduled callback per distinct latency rather
+        than two per link
+        """
+        batches = {}
+        for link in links:
+            link.state = ConnectionState.UP
+            batches.setdefault((link.context, link.latency_ms / 2), []).append(link)
+
+        for (context, delay), batch in batches.items():
+            context.enqueue(delay, PhysicalLink._endpoints_up, arguments=(batch, ))
+
+    @staticmethod
+    def _endpoints_up(links):
+        for link in links:
+            link.endpoint1.up()
+            link.endpoint2.up()
+
     def down(self):
         self.state = ConnectionState.DOWN
 
-        GlobalQueueManager.enqueue(
+        self.context.enqueue(
             self.latency_ms / 2,
             self.endpoint1.down
         )
-        GlobalQueueManager.enqueue(
+        self.context.enqueue(
             self.latency_ms / 2,
             self.endpoint2.down
         )
@@ -232,17 +274,22 @@ class PhysicalLink:
             receiver = self.endpoint2
 
         if sender.is_up():
-            event = Event(
-                EventType.PACKET_SEND,
-                sender, f"Sending {frame.type}", object=frame, target=receiver)
-
-            # This is so we don't lose event between observations
-            GlobalQueueManager.enqueue(
-                0,
-                sender.parent.event_manager.observe,
-                arguments=(event, )
-            )
+            event_manager = sender.parent.event_manager
+            if event_manager.is_enabled(EventType.PACKET_SEND):
+                event = Event(
+                    EventType.PACKET_SEND,
+                    sender, lambda: f"Sending {frame.type}", object=frame, target=receiver)
+
+                # This is so we don't lose event between observations
+                self.context.enqueue(
+                    0,
+                    event_manager.observe,
+                    arguments=(event, ),
+                    shuffle=False
+                )
             #sender.parent.event_manager.observe()
 
+            if self.copy_frames:
+                frame = deepcopy(frame)
             # receiver.receive(frame)
-            GlobalQueueManager.enqueue(self.latency_ms, receiver.receive, arguments=(deepcopy(frame),))
+            self.context.enqueue(self.latency_ms, receiver.receive, arguments=(frame,))
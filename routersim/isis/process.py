@@ -1,13 +1,13 @@
-from ..observers import GlobalQueueManager, Event, EventType
+from ..observers import Event, EventType
 from ..routing import Route, RouteType
 from ..interface import ConnectionState
 from .pdu import LinkStatePDU, P2PHelloPDU, CSNPPDU, PSNPPDU
 from .tlv import *
-import random
-import sys
+from .spf import SPFGraph, ShortestPathTree
+from .throttle import Throttle
+from .ted import TrafficEngineeringDatabase
 import logging
 import pprint
-import ipaddress
 from copy import deepcopy
 
 # Intermediate-System to Intermediate-System
@@ -53,10 +53,43 @@ class Neighbor:
         return f"{self.system_id}({self.name})"
 
 
+class FloodingQueues:
+    """
+    LSP ids which have had their SRM or SSN flag set on each
+    interface, so sending LSPs and PSNPs only has to look at those
+    rather than the whole database.
+
+    Clearing a flag leaves the id queued, whoever works through the
+    queue checks the flag is still set.
+    """
+
+    def __init__(self):
+        self.srm = {}
+        self.ssn = {}
+
+    def add_srm(self, ifacename, lsp_id):
+        queue = self.srm.get(ifacename)
+        if queue is None:
+            queue = self.srm[ifacename] = {}
+        queue[lsp_id] = True
+
+    def add_ssn(self, ifacename, lsp_id):
+        queue = self.ssn.get(ifacename)
+        if queue is None:
+            queue = self.ssn[ifacename] = {}
+        queue[lsp_id] = True
+
+
 class LinkStatePacketWrapper:
-    def __init__(self, source_pdu, remaining_lifetime=1200):
+    def __init__(self, source_pdu, remaining_lifetime=1200, shared=False,
+                 flooding=None):
         self.pdu = source_pdu
         self.remaining_lifetime = remaining_lifetime
+        # A shared PDU is one we received, which may also be sitting in
+        # other systems' databases, so it must never be changed. Our own
+        # LSP is edited in place, so what we flood is a copy of it
+        self.shared = shared
+        self._snapshot = None
 #        self.system_id = system_id
         # Transitionary, we really should just store the PDU as the entry..
 #        self.source_pdu = source_pdu
@@ -76,6 +109,9 @@ class LinkStatePacketWrapper:
         self.ssns = {}
         self.hostname = None
 
+        # FloodingQueues to tell when a flag gets set
+        self.flooding = flooding
+
     def __str__(self):
         return str(self.pdu)
 
@@ -89,14 +125,28 @@ class LinkStatePacketWrapper:
     def increment_seq(self):
         self.pdu.seq_no += 1
 
+    def snapshot(self):
+        """
+        The PDU as it should be sent, copied at most once per sequence number
+        """
+        if self.shared:
+            return self.pdu
+        if self._snapshot is None or self._snapshot.seq_no != self.pdu.seq_no:
+            self._snapshot = deepcopy(self.pdu)
+        return self._snapshot
+
     def set_srm(self, ifacename):
         self.srms[ifacename] = True
+        if self.flooding is not None:
+            self.flooding.add_srm(ifacename, self.pdu.lsp_id)
 
     def clear_srm(self, ifacename):
         self.srms.pop(ifacename, None)
 
     def set_ssn(self, ifacename):
         self.ssns[ifacename] = True
+        if self.flooding is not None:
+            self.flooding.add_ssn(ifacename, self.pdu.lsp_id)
 
     def clear_ssn(self, ifacename):
         self.ssns.pop(ifacename, None)
@@ -104,13 +154,19 @@ class LinkStatePacketWrapper:
 
 class IsisProcess:
 
-    def __init__(self, event_manager, hostname, routing):
+    def __init__(self, event_manager, hostname, routing, context=None):
         self.hostname = hostname
+        if context is None:
+            context = event_manager.context
+        self.context = context
         self.started = False
         self.adjacencies = {}
+        # interface -> system ids of the adjacencies on it which are UP
+        self.up_adjacencies = {}
         self.neighbors = {}  # shortcut
         self.interfaces = {}
         self.database = {}
+        self.flooding = FloodingQueues()
         self.event_manager = event_manager
         self.routing = routing
         self.hello_interval = 3 * 1000
@@ -122,13 +178,38 @@ class IsisProcess:
 
         self.hostmapping = {}
 
-        self.spf_pending = False
+        # Back off running SPF and regenerating our own LSP while
+        # things keep changing, the waits are in ms
+        self.spf_throttle = Throttle(
+            context, self.run_ispf, initial=50, secondary=200, maximum=5000)
+        self.lsp_throttle = Throttle(
+            context, self.__refresh_local, initial=50, secondary=200, maximum=5000)
 
         # TED
+        self.ted = TrafficEngineeringDatabase(self.database)
         self.address_paths = None
+        # Result of the last SPF run, kept up to date incrementally
+        self.spt = None
+        # LSPs which have changed since the last SPF run
+        self.spf_dirty = set()
+
+        # next hop system -> (interface, address) our routes were installed with
+        self._installed_via = {}
+        # prefixes we couldn't install as we didn't know the next hop
+        self._unresolved = set()
 
     def __str__(self):
         return "ISIS"
+
+    @property
+    def spf_pending(self):
+        return self.spf_throttle.pending
+
+    def throttle_statistics(self):
+        return {
+            'spf': self.spf_throttle.statistics(),
+            'lsp': self.lsp_throttle.statistics(),
+        }
     # A passive interface will be advertised into ISIS, but
     # won't be used to form adjacencies
 
@@ -140,9 +221,21 @@ class IsisProcess:
             'point-to-point': p2p
         }
         self.adjacencies[interface.name] = {}
+        self.up_adjacencies[interface.name] = set()
         self.event_manager.observe(Event(
             EventType.ISIS, self, f"ADD_INTERFACE ({interface.name}->{passive})", object=self.interfaces[interface.name], sub_type="INTERFACE_ADD"))
 
+    def has_up_adjacency(self, ifacename):
+        return len(self.up_adjacencies.get(ifacename, ())) > 0
+
+    def __set_adjacency_state(self, ifacename, neighbor, state):
+        neighbor.state = state
+        up = self.up_adjacencies.setdefault(ifacename, set())
+        if state == 'UP':
+            up.add(neighbor.system_id)
+        else:
+            up.discard(neighbor.system_id)
+
     def __send_hello(self):
         # TODO: This would be on a timer
         for ifacename in self.interfaces:
@@ -162,13 +255,13 @@ class IsisProcess:
                     for neighbor_id in self.adjacencies[ifacename]:
                         neighbor = self.adjacencies[ifacename][neighbor_id]
                         if neighbor.state == 'NEW' or neighbor.state == 'DOWN':
-                            neighbor.state = 'Initializing'
+                            self.__set_adjacency_state(ifacename, neighbor, 'Initializing')
                         hello.tlvs.append(P2PAdjacencyTLV(
                             neighbor.system_id, neighbor.state))
 
                     iface.send_clns(hello)
 
-        GlobalQueueManager.enqueue(random.randint(
+        self.context.enqueue(self.context.random.randint(
             self.hello_interval-1, self.hello_interval+1), self.__send_hello)
 
     def __send_complete_snp(self, interface_name=None):
@@ -195,52 +288,60 @@ class IsisProcess:
     def __send_partial_snps(self):
 
         self.logger.debug("Sending Partial SNPs")
-        for ifacename in self.adjacencies:
-            if len([neigh for neigh in self.adjacencies[ifacename].values() if neigh.state == 'UP']) > 0:
+        for ifacename, queue in self.flooding.ssn.items():
+            if len(queue) == 0 or not self.has_up_adjacency(ifacename):
+                continue
 
+            psnp = PSNPPDU(self.system_id)
+            for lspid in queue:
+                lsp = self.database.get(lspid)
                 # ssn gets cleared when we hear about it
-                candidateids = [lspid for lspid in self.database if self.database[lspid].ssns.get(
-                    ifacename) is not None]
-
-                if len(candidateids) > 0:
-                    psnp = PSNPPDU(self.system_id)
-
-                    for lspid in candidateids:
-                        lsp = self.database[lspid]
-                        psnp.tlvs.append(LSPEntryTLV(
-                            lsp.pdu.lsp_id, lsp.seq_no, lsp.remaining_lifetime, hostname=lsp.hostname))
-                        # TODO: sort by something actually reasonable
-                        psnp.tlvs.sort(key=lambda entry: entry.lsp_id)
-                        self.logger.debug(
-                            f"Added {lspid} to PSNP to through {ifacename}")
-                        lsp.clear_ssn(ifacename)
+                if lsp is None or lsp.ssns.get(ifacename) is None:
+                    continue
 
-                    iface = self.interfaces[ifacename]['interface']
-                    if iface.is_up():
-                        iface.send_clns(psnp)
-                else:
-                    self.logger.debug(
-                        "SSN list is empty, don't need to send anything")
-        GlobalQueueManager.enqueue(random.randint(
+                psnp.tlvs.append(LSPEntryTLV(
+                    lsp.pdu.lsp_id, lsp.seq_no, lsp.remaining_lifetime, hostname=lsp.hostname))
+                self.logger.debug(
+                    f"Added {lspid} to PSNP to through {ifacename}")
+                lsp.clear_ssn(ifacename)
+            queue.clear()
+
+            if len(psnp.tlvs) > 0:
+                # TODO: sort by something actually reasonable
+                psnp.tlvs.sort(key=lambda entry: entry.lsp_id)
+
+                iface = self.interfaces[ifacename]['interface']
+                if iface.is_up():
+                    iface.send_clns(psnp)
+            else:
+                self.logger.debug(
+                    "SSN list is empty, don't need to send anything")
+        self.context.enqueue(self.context.random.randint(
             self.partial_snp_interval-1, self.partial_snp_interval+1), self.__send_partial_snps)
 
     # Send LSPs on all circuits which have been flagged with SRM
     # TODO: There is a bug where we are sending LSPs before they are requested
     # Maybe that's fine for new ones?
     def __send_lsps(self):
-        for lspid in self.database:
-            lsp = self.database[lspid]
+        for ifacename, queue in self.flooding.srm.items():
+            if len(queue) == 0 or not self.has_up_adjacency(ifacename):
+                continue
 
-            if len(lsp.srms) > 0:
-                pdu = lsp.pdu
+            iface = self.interfaces[ifacename]['interface']
+            for lspid in list(queue):
+                lsp = self.database.get(lspid)
+                if lsp is None or ifacename not in lsp.srms:
+                    # Acknowledged (or replaced) since it was queued
+                    del queue[lspid]
+                    continue
 
+                # Stays queued until it's acknowledged, so it gets sent
+                # again next time round
                 # TODO: See what's in Sub-TLV Traffic Engineering Metric
-                for ifacename in lsp.srms:
-                    if len([neigh for neigh in self.adjacencies[ifacename].values() if neigh.state == 'UP']) > 0:
-                        if self.interfaces[ifacename]['interface'].is_up():
-                            self.interfaces[ifacename]['interface'].send_clns(pdu)
+                if iface.is_up():
+                    iface.send_clns(lsp.snapshot())
 
-        GlobalQueueManager.enqueue(random.randint(
+        self.context.enqueue(self.context.random.randint(
             self.minimum_lsp_interval-1, self.minimum_lsp_interval+1), self.__send_lsps)
 
     def __neighbor(self, iface_name, addr):
@@ -284,7 +385,7 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
         lsp = None
         if wrapper is None:
             lsp = LinkStatePDU(self.system_id, self.system_id, 1)
-            wrapper = LinkStatePacketWrapper(lsp)
+            wrapper = LinkStatePacketWrapper(lsp, flooding=self.flooding)
 
             lsp.tlvs.append(DynamicHostnameTLV(self.hostname))
             lsp.tlvs.append(TrafficEngineeringIPRouter(self.interfaces['lo.0']['interface'].address().ip))
@@ -310,7 +411,7 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
                 found = False
 
                 if not iface.is_up() and neigh.state != 'DOWN':
-                    neigh.state = 'DOWN'
+                    self.__set_adjacency_state(ifacename, neigh, 'DOWN')
                     self.event_manager.observe(Event(
                         EventType.ISIS, self, f"Mark ({neigh})->DOWN", 
                         object=neigh, sub_type="ADJ_CHANGE"))
@@ -328,6 +429,8 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
                             if lspneigh.metric != metric:
                                 lspneigh.metric = metric
                                 changed = True
+                            if lspneigh.set_te_attributes(iface.admin_group, iface.bandwidth):
+                                changed = True
 
                 if not found and neigh.state != 'DOWN':
                     tlv = ExtendedISReachabilityTLV(neighborid, metric) 
@@ -342,7 +445,8 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
                         if ip != iface.address('ipv4').ip:
                             tlv.tlvs.append(NeighborIPAddressTLV(ip))
                             break
-                        changed = True
+                    tlv.set_te_attributes(iface.admin_group, iface.bandwidth)
+                    changed = True
 
 
             found = False
@@ -367,8 +471,9 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
             for ifacename in up_interfaces:
                 wrapper.set_srm(ifacename)
 
-            if not self.spf_pending:
-                GlobalQueueManager.enqueue(200, self.run_full_dijkstra)
+            self.spf_dirty.add(self.system_id)
+            self.ted.changed(self.system_id)
+            self.spf_throttle.trigger()
 
     def process_hello(self, recv_interface, pdu):
         other_address = pdu.source_address
@@ -394,19 +499,19 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
                 # yay, we see ourselves, which means they've gotten our packets
                 if tlv.state == 'UP' or tlv.state == 'Initializing':
                     if neighbor.state != 'UP' and not neighbor.state == 'NEW':
-                        neighbor.state = 'UP'
+                        self.__set_adjacency_state(recv_interface.name, neighbor, 'UP')
                         neighbor.interface_name = recv_interface.name
                         self.neighbors[neighbor.system_id] = neighbor
 
                         self.event_manager.observe(Event(
                             EventType.ISIS, self, f"Mark ({neighbor})->UP", object=neighbor, sub_type="ADJ_CHANGE"))
-                        self.__refresh_local()
+                        self.lsp_throttle.trigger()
 
-                        GlobalQueueManager.enqueue(
+                        self.context.enqueue(
                             1, self.__send_complete_snp, arguments=(recv_interface.name,))
 
                     elif neighbor.state == 'NEW':
-                        neighbor.state = 'Initializing'
+                        self.__set_adjacency_state(recv_interface.name, neighbor, 'Initializing')
                         # TODO: Just encode this instead in neighbor.set_state()
                         self.event_manager.observe(Event(
                             EventType.ISIS, self, f"Mark ({neighbor})->Initializing", object=neighbor, sub_type="ADJ_CHANGE"))
@@ -420,7 +525,7 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
             seen.append(tlv.lsp_id)
             if lsp is None:
                 newlsp = LinkStatePacketWrapper(
-                    LinkStatePDU(tlv.lsp_id, tlv.lsp_id, 0))
+                    LinkStatePDU(tlv.lsp_id, tlv.lsp_id, 0), flooding=self.flooding)
                 self.database[tlv.lsp_id] = newlsp
                 newlsp.set_ssn(recv_interface.name)
                 newlsp.clear_srm(recv_interface.name)
@@ -438,7 +543,7 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
     # 7.3.15.1 Action on receipt of a link state PDU
     def process_lsp(self, recv_interface, pdu):
 
-        if len([neigh for neigh in self.adjacencies[recv_interface.name].values() if neigh.state == 'UP']) < 1:
+        if not self.has_up_adjacency(recv_interface.name):
             self.logger.debug(
                 f"Received LSP on {recv_interface}, but do not have UP neighbor, ignoring")
             return
@@ -446,11 +551,10 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
 
         neigh = self.neighbors.get(pdu.source_address)
         if neigh is not None:
-            ip_tlvs = [tlv for tlv in pdu.tlvs if isinstance(tlv, ExtendedISReachabilityTLV)]
-            for ip in ip_tlvs:
+            network = recv_interface.address('ipv4').network
+            for ip in pdu.neighbors:
                 # Todo what if it came from the "other side" ?
-                network = recv_interface.address('ipv4').network
-                if network.supernet_of(ipaddress.ip_network(ip.local_ip)):
+                if ip.local_ip in network:
                     # just assuming single one for now
                     self.logger.debug(f"Neighbor address is {ip.local_ip}")
                     neigh.iface_address = ip.local_ip
@@ -458,16 +562,23 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
             self.logger.info(f"COuldn't find neighbor for {pdu.source_address}")
 
         if lsp is None or lsp.seq_no < pdu.seq_no:
-            lsp = LinkStatePacketWrapper(deepcopy(pdu))
+            if pdu.lsp_id == self.system_id:
+                # We'll be editing this one
+                lsp = LinkStatePacketWrapper(deepcopy(pdu), flooding=self.flooding)
+            else:
+                # Nobody changes an LSP once it's been flooded, so
+                # there's no need for our own copy
+                lsp = LinkStatePacketWrapper(pdu, shared=True, flooding=self.flooding)
 #            lsp = LinkStatePacket(pdu.lsp_id, deepcopy(pdu), seq_no=pdu.seq_no)
 
             self.database[pdu.lsp_id] = lsp
-            self.event_manager.observe(Event(
-                EventType.ISIS, self, f"Added LSP Entry {pdu.lsp_id}(seq={pdu.seq_no})", object=lsp, sub_type="LSP_ADDED"))
-
-            if not self.spf_pending:
-                GlobalQueueManager.enqueue(200, self.run_full_dijkstra)
+            if self.event_manager.is_enabled(EventType.ISIS, "LSP_ADDED"):
+                self.event_manager.observe(Event(
+                    EventType.ISIS, self, f"Added LSP Entry {pdu.lsp_id}(seq={pdu.seq_no})", object=lsp, sub_type="LSP_ADDED"))
 
+            self.spf_dirty.add(pdu.lsp_id)
+            self.ted.changed(pdu.lsp_id)
+            self.spf_throttle.trigger()
 
             for ifacename in self.interfaces:
                 if self.interfaces[ifacename]['active']:
@@ -531,18 +642,16 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
 
         self.__refresh_local()
 
-        GlobalQueueManager.enqueue(random.randint(
+        self.context.enqueue(self.context.random.randint(
             self.hello_interval-1, self.hello_interval+1), self.__send_hello)
-        GlobalQueueManager.enqueue(random.randint(
+        self.context.enqueue(self.context.random.randint(
             self.partial_snp_interval-1, self.partial_snp_interval+1), self.__send_partial_snps)
-        GlobalQueueManager.enqueue(random.randint(
+        self.context.enqueue(self.context.random.randint(
             self.minimum_lsp_interval-1, self.minimum_lsp_interval+1), self.__send_lsps)
 
         def link_handler(evt):
-            GlobalQueueManager.enqueue(
-                10, self.__refresh_local
-            )
-            
+            self.lsp_throttle.trigger()
+
         self.event_manager.listen(EventType.LINK_STATE, link_handler)
         self.started = True
 
@@ -562,149 +671,189 @@ In addition to the periodic generation of LSPs, an Intermediate system shall gen
         moment this implementation is for point-to-point
     """
 
-        # The final calculated distance to each prefix
-        distance = {}
-
-        # Calculated distance to each system, most useful for debugging
-        system_distance = {}
-
-        # linked list of paths from the destination back to us
-        prev = {}
-
-        # linked list of paths from another system back to us over shortest path
-        prev_system = {}
-
-        # Remaining LSPs we need to process
-        queue = []
-
-        dbvalues = sorted(
-            self.database.values(),
-            key=lambda lsp: lsp.pdu.source_address)
-        # https://en.wikipedia.org/wiki/Dijkstra%27s_algorithm
-        for wrapper in dbvalues:
-            entry_node = wrapper.pdu.source_address
-            # Note the shortcut we're taking of treating the lsp_id as the system_id
-            system_distance[entry_node] = sys.maxsize
-            prev_system[entry_node] = None
-            queue.append(wrapper.pdu.source_address)
+        graph = SPFGraph(self.database)
+        if not graph.complete:
+            logger.debug(f"ignoring due to {graph.missing}")
+            # We haven't actually converged
+            self.spt = None
+            return None
 
-        system_distance[self.system_id] = 0
+        spt = ShortestPathTree(graph, self.system_id)
+        nodes = graph.nodes
 
-        while len(queue) > 0:
+        # Now convert to more useful paths
+        node_paths = spt.paths
 
-            # find shortest element
-            min_idx = 0
-            min_dist = sys.maxsize
-            for i in range(len(queue)):
+        # The final calculated distance to each prefix
+        distance = spt.prefix_distance
 
-                if system_distance[queue[i]] < min_dist:
-                    min_idx = i
-                    min_dist = system_distance[queue[i]]
+        # path from our first hop to the system advertising the prefix
+        address_paths = {
+            address: node_paths[node]
+            for address, node in spt.prefix_node.items()
+        }
 
-            node = queue.pop(min_idx)
+        # path from another system's predecessor back towards us
+        system_paths = {}
+        for idx, systemid in enumerate(nodes):
+            parent = spt.parent[idx]
+            if parent is None:
+                system_paths[systemid] = []
+            else:
+                system_paths[systemid] = node_paths[parent][::-1]
 
-            lsp = self.database[node].pdu
+        self.spt = spt
+        self.address_distances = distance
+        self.system_paths = system_paths
+        self.address_paths = address_paths
+        self.event_manager.observe(Event(
+            EventType.ISIS, self, f"Recalculated shortest paths", object=spt, sub_type="SPF_RUN"))
+        self.spf_dirty.clear()
+        self.update_routing_table()
 
-            neighbors = lsp.neighbors
+    def run_ispf(self):
+        """
+        Apply the LSPs which have changed since the last SPF run to the
+        tree we kept from it. A change in links only recalculates the
+        part of the tree below it (iSPF), a change in prefixes just
+        re-resolves those prefixes (PRC). Systems appearing in the
+        database means a full run.
+        """
+        spt = self.spt
+        if (spt is None or spt.root is None or
+                len(spt.graph) != len(self.database)):
+            return self.run_full_dijkstra()
 
-            for neigh in neighbors:
-                # this is same as "system_id" currently
-                neigh_id = neigh.system_id
-                metric = neigh.metric
-                
-                logger.debug(f"processing {neigh_id} neighbor of {node}")
-                if neigh_id not in system_distance:
-                    logger.debug(f"ignoring due to {neigh_id}")
-                    # We haven't actually converged
-                    return None
+        logger = self.logger.getChild("spf")
+        graph = spt.graph
+
+        # Our own LSP is changed in place, so always check it
+        dirty = self.spf_dirty
+        dirty.add(self.system_id)
+
+        topology_changes = {}
+        prefix_changes = set()
+        for lsp_id in dirty:
+            lsp = self.database[lsp_id].pdu
+            if lsp.source_address not in graph.index:
+                return self.run_full_dijkstra()
+            old_links, prefixes = graph.update(lsp.source_address, lsp)
+            if old_links is not None:
+                topology_changes[graph.index[lsp.source_address]] = old_links
+            prefix_changes.update(prefixes)
+
+        if not graph.complete:
+            logger.debug(f"ignoring due to {graph.missing}")
+            # Can't trust the tree any more, start over once we've converged
+            self.spt = None
+            return None
 
-                new_dist = system_distance[node] + metric
+        changed_nodes, changed_prefixes = spt.update(topology_changes, prefix_changes)
 
-                if new_dist < system_distance[neigh_id]:
-                    system_distance[neigh_id] = new_dist
-                    logger.debug(f"updated {neigh_id} distance to {new_dist}")
-                    prev_system[neigh_id] = lsp.source_address
+        nodes = graph.nodes
+        for node in changed_nodes:
+            parent = spt.parent[node]
+            if parent is None:
+                self.system_paths[nodes[node]] = []
+            else:
+                self.system_paths[nodes[node]] = spt.paths[parent][::-1]
 
-            # Now deal with our routable prefixes
-            for network in lsp.addresses:
-                if network.state.name != 'UP':
-                    continue
-                address = network.prefix
-                metric = network.metric
+        for address in changed_prefixes:
+            node = spt.prefix_node.get(address)
+            if node is None:
+                self.address_distances.pop(address, None)
+                self.address_paths.pop(address, None)
+            else:
+                self.address_distances[address] = spt.prefix_distance[address]
+                self.address_paths[address] = spt.paths[node]
 
-                new_dist = system_distance[node] + metric
+        if len(topology_changes) > 0:
+            self.event_manager.observe(Event(
+                EventType.ISIS, self,
+                lambda: f"Incrementally recalculated shortest paths ({len(changed_nodes)} systems, {len(changed_prefixes)} prefixes)",
+                object=spt, sub_type="ISPF_RUN"))
+        else:
+            self.event_manager.observe(Event(
+                EventType.ISIS, self,
+                f"Recalculated {len(changed_prefixes)} prefixes",
+                object=spt, sub_type="PRC_RUN"))
+        self.spf_dirty = set()
+        self.update_routing_table(changed_prefixes | self.__stale_routes())
 
-                existing_metric = distance.get(address)
-                if existing_metric is None or existing_metric > new_dist:
-                    distance[address] = new_dist
-                    prev[address] = lsp.source_address
-                    self.logger.debug(
-                        f"SPF set prev for {address} to {lsp.source_address}")
+    def __next_hop_details(self, next_hop):
+        neighbor = self.neighbors[next_hop]
+        return (neighbor.interface_name, neighbor.iface_address)
 
-        # Now convert to more useful paths
-        system_paths = {}
-        address_paths = {}
-
-        def resolve_path(cur_elem):
-            the_path = []
-            while cur_elem is not None:
-                if cur_elem != self.system_id:
-                    the_path.append(cur_elem)
-                cur_elem = prev_system.get(cur_elem)
-            return the_path
+    def __stale_routes(self):
+        """
+        Prefixes whose route needs re-installing even though the SPF
+        result for them is the same, as what we know about the
+        neighbor we route them through has changed
+        """
+        stale = set(self._unresolved)
+
+        moved = set()
+        for next_hop, details in self._installed_via.items():
+            if next_hop not in self.neighbors or self.__next_hop_details(next_hop) != details:
+                moved.add(next_hop)
+
+        if len(moved) > 0:
+            for address, path in self.address_paths.items():
+                if len(path) > 0 and path[0] in moved:
+                    stale.add(address)
+        return stale
+
+    def __route(self, address):
+        path = self.address_paths.get(address)
+        if path is None or len(path) == 0:
+            # Don't think we need to put ourself in the routes
+            # as it's implied that it'll be in a direct route
+            return None
 
-        for address in prev:
-            path_elem = prev[address]
-            this_path = resolve_path(path_elem)
-            address_paths[address] = this_path
-            address_paths[address].reverse()
+        next_hop = path[0]
+        if next_hop not in self.neighbors:
+            self.logger.error(
+                f"{self.hostname} Invalid state: {next_hop} is not one of our neighbors")
+            self._unresolved.add(address)
+            return None
+        next_hop_iface, true_nh = self.__next_hop_details(next_hop)
+        self._installed_via[next_hop] = (next_hop_iface, true_nh)
 
-        for systemid in prev_system:
-            this_path = []
+        # we used to put next_hop_addr her
+        route = Route(
+                address, "ISIS", self.interfaces[next_hop_iface]['interface'], true_nh, RouteType.ISIS.value
+        )
+        # TODO: Should we install using recursive?
+        return route
 
-            path_elem = prev_system.get(systemid)
-            this_path = resolve_path(path_elem)
-            system_paths[systemid] = this_path
+    def update_routing_table(self, prefixes=None):
+        """
+        Install our SPF results as ISIS routes, either for everything
+        or just for the given prefixes
+        """
+        if self.address_paths is None:
+            return
 
-        self.address_distances = distance
-        self.system_paths = system_paths
-        self.address_paths = address_paths
-        self.event_manager.observe(Event(
-            EventType.ISIS, self, f"Recalculated shortest paths", object=lsp, sub_type="SPF_RUN"))
-        self.spf_pending = False
-        self.update_routing_table()
+        if prefixes is None:
+            self._installed_via = {}
+            self._unresolved = set()
 
-    def update_routing_table(self):
-        routes = []
+            routes = []
+            for address in self.address_paths:
+                route = self.__route(address)
+                if route is not None:
+                    routes.append(route)
 
-        if self.address_paths is None:
+            self.routing.set_routes(routes, 'isis', src=self)
             return
-        for address in self.address_paths:
-            if len(self.address_paths[address]) == 0:
-                # Don't think we need to put ourself in the routes
-                # as it's implied that it'll be in a direct route
-                continue
-        
-            next_hop = self.address_paths[address][0]
-            if next_hop not in self.neighbors:
-                self.logger.error(
-                    f"{self.hostname} Invalid state: {next_hop} is not one of our neighbors")
-                continue
-            next_hop_iface = self.neighbors[next_hop].interface_name
-            next_hop_name = self.database[next_hop].hostname
-            next_hop_addr = self.neighbors[next_hop].address
-            true_nh = self.neighbors[next_hop].iface_address
-
-            metric = self.address_distances[address]
-            # we used to put next_hop_addr her
-            route = Route(
-                    address, "ISIS", self.interfaces[next_hop_iface]['interface'], true_nh, RouteType.ISIS.value
-            )
-            # TODO: Should we install using recursive?
 
-            routes.append(route)
+        changes = {}
+        for address in prefixes:
+            self._unresolved.discard(address)
+            route = self.__route(address)
+            changes[address] = [] if route is None else [route]
 
-        self.routing.set_routes(routes, 'isis', src=self)
+        self.routing.replace_routes(changes, 'isis', src=self)
 
     def print_database(self):
         pp = pprint.PrettyPrinter(depth=4)
@@ -0,0 +1,376 @@
+import heapq
+
+
+class SPFGraph:
+    """
+    The LSP database flattened into integer indexed arrays, so the
+    SPF run itself never has to go back to the TLVs.
+
+    Nodes are numbered in order of system id, which is also the order
+    equal-cost ties are broken in.
+    """
+
+    def __init__(self, database):
+        wrappers = sorted(
+            database.values(),
+            key=lambda lsp: lsp.pdu.source_address)
+
+        # Note the shortcut we're taking of treating the lsp_id as the system_id
+        self.nodes = [wrapper.pdu.source_address for wrapper in wrappers]
+        self.index = {node: i for i, node in enumerate(self.nodes)}
+
+        # adjacency[i] is a list of (neighbor index, metric)
+        self.adjacency = []
+        # reverse[i] is a list of (index, metric) that have i as a neighbor
+        self.reverse = [[] for _ in self.nodes]
+        # prefixes[i] is a list of (prefix, metric) which are UP
+        self.prefixes = []
+        # prefix -> {index: metric} of everyone advertising it
+        self.advertisers = {}
+
+        # Set when an LSP refers to a system we don't have an LSP for
+        self.missing = None
+
+        for idx, wrapper in enumerate(wrappers):
+            links = self._links(wrapper.pdu)
+            self.adjacency.append(links)
+            for neigh_idx, metric in links:
+                self.reverse[neigh_idx].append((idx, metric))
+
+            reachable = self._reachable(wrapper.pdu)
+            self.prefixes.append(reachable)
+            self._advertise(idx, reachable)
+
+    def _links(self, lsp):
+        links = []
+        for neigh in lsp.neighbors:
+            # this is same as "system_id" currently
+            neigh_idx = self.index.get(neigh.system_id)
+            if neigh_idx is None:
+                self.missing = neigh.system_id
+                continue
+            links.append((neigh_idx, neigh.metric))
+        return links
+
+    def _reachable(self, lsp):
+        return [(network.prefix, network.metric)
+                for network in lsp.addresses if network.state.name == 'UP']
+
+    def _advertise(self, idx, reachable):
+        for prefix, metric in reachable:
+            by_node = self.advertisers.setdefault(prefix, {})
+            existing = by_node.get(idx)
+            if existing is None or metric < existing:
+                by_node[idx] = metric
+
+    def _withdraw(self, idx, reachable):
+        for prefix, _ in reachable:
+            by_node = self.advertisers.get(prefix)
+            if by_node is None:
+                continue
+            by_node.pop(idx, None)
+            if len(by_node) == 0:
+                del self.advertisers[prefix]
+
+    def update(self, system_id, lsp):
+        """
+        Replace what we know about system_id with the contents of lsp.
+
+        Returns (old adjacency or None if the links are unchanged,
+        set of prefixes whose advertisement changed)
+        """
+        idx = self.index[system_id]
+
+        old_links = None
+        links = self._links(lsp)
+        if edge_costs(links) != edge_costs(self.adjacency[idx]):
+            old_links = self.adjacency[idx]
+            for neigh_idx, _ in old_links:
+                self.reverse[neigh_idx] = [
+                    (src, metric) for src, metric in self.reverse[neigh_idx]
+                    if src != idx]
+            for neigh_idx, metric in links:
+                self.reverse[neigh_idx].append((idx, metric))
+            self.adjacency[idx] = links
+
+        changed_prefixes = set()
+        reachable = self._reachable(lsp)
+        old_reachable = self.prefixes[idx]
+        if reachable != old_reachable:
+            old_costs = dict(old_reachable)
+            new_costs = dict(reachable)
+            for prefix in old_costs.keys() | new_costs.keys():
+                if old_costs.get(prefix) != new_costs.get(prefix):
+                    changed_prefixes.add(prefix)
+
+            self._withdraw(idx, old_reachable)
+            self._advertise(idx, reachable)
+            self.prefixes[idx] = reachable
+
+        return old_links, changed_prefixes
+
+    @property
+    def complete(self):
+        return self.missing is None
+
+    def __len__(self):
+        return len(self.nodes)
+
+
+def edge_costs(links):
+    """
+    Cheapest metric to each neighbor, parallel links collapsed
+    """
+    costs = {}
+    for neigh_idx, metric in links:
+        existing = costs.get(neigh_idx)
+        if existing is None or metric < existing:
+            costs[neigh_idx] = metric
+    return costs
+
+
+class ShortestPathTree:
+    """
+    Result of running Dijkstra over an SPFGraph from root.
+
+    distance/parent are indexed the same as graph.nodes, with unreachable
+    systems left at None. Prefixes are attributed to the closest system
+    advertising them.
+
+    The tree is kept up to date by update() as LSPs change, rather than
+    being thrown away: only the part of the tree below a changed link
+    is recalculated, and a prefix-only change just re-resolves those
+    prefixes against the existing tree.
+    """
+
+    def __init__(self, graph, root):
+        self.graph = graph
+        self.root = graph.index.get(root)
+
+        count = len(graph)
+        self.distance = [None] * count
+        self.parent = [None] * count
+        self.children = [set() for _ in range(count)]
+
+        # index -> list of system ids from our first hop to that system
+        self.paths = {}
+
+        self.prefix_distance = {}
+        self.prefix_node = {}
+
+        if self.root is not None:
+            self._run()
+
+    def _run(self):
+        adjacency = self.graph.adjacency
+        prefixes = self.graph.prefixes
+        distance = self.distance
+        parent = self.parent
+        prefix_distance = self.prefix_distance
+        prefix_node = self.prefix_node
+
+        # The order systems were settled in
+        order = []
+        settled = [False] * len(distance)
+        distance[self.root] = 0
+        heap = [(0, self.root)]
+
+        while len(heap) > 0:
+            dist, node = heapq.heappop(heap)
+            if settled[node]:
+                continue
+            settled[node] = True
+            order.append(node)
+
+            for neigh, metric in adjacency[node]:
+                new_dist = dist + metric
+                existing = distance[neigh]
+                if existing is None or new_dist < existing:
+                    distance[neigh] = new_dist
+                    parent[neigh] = node
+                    heapq.heappush(heap, (new_dist, neigh))
+
+            # Now deal with our routable prefixes
+            for prefix, metric in prefixes[node]:
+                new_dist = dist + metric
+                existing = prefix_distance.get(prefix)
+                if existing is None or existing > new_dist:
+                    prefix_distance[prefix] = new_dist
+                    prefix_node[prefix] = node
+
+        # parents are always settled before their children
+        nodes = self.graph.nodes
+        for node in order:
+            if node == self.root:
+                self.paths[node] = []
+            else:
+                self.children[parent[node]].add(node)
+                self.paths[node] = self.paths[parent[node]] + [nodes[node]]
+
+    def subtree(self, roots):
+        found = set(roots)
+        stack = list(roots)
+        while len(stack) > 0:
+            for child in self.children[stack.pop()]:
+                if child not in found:
+                    found.add(child)
+                    stack.append(child)
+        return found
+
+    def update(self, topology_changes, prefix_changes):
+        """
+        Bring the tree in line with the graph after graph.update().
+
+        topology_changes maps the index of each system whose links changed
+        to its old adjacency, prefix_changes is the set of prefixes whose
+        advertisements changed.
+
+        Returns (indexes whose distance or path changed,
+        prefixes whose distance or path changed)
+        """
+        changed_nodes = set()
+        if len(topology_changes) > 0:
+            changed_nodes = self._update_topology(topology_changes)
+
+        candidates = set(prefix_changes)
+        for node in changed_nodes:
+            for prefix, _ in self.graph.prefixes[node]:
+                candidates.add(prefix)
+
+        changed_prefixes = set()
+        for prefix in candidates:
+            if self._resolve_prefix(prefix) or self.prefix_node.get(prefix) in changed_nodes:
+                changed_prefixes.add(prefix)
+
+        return changed_nodes, changed_prefixes
+
+    def _update_topology(self, topology_changes):
+        graph = self.graph
+        adjacency = graph.adjacency
+        distance = self.distance
+        parent = self.parent
+
+        # Anything hanging off a link which has gone away or changed
+        # metric needs to find its way back to the root
+        roots = set()
+        for node, old_links in topology_changes.items():
+            new_costs = edge_costs(adjacency[node])
+            for neigh, metric in edge_costs(old_links).items():
+                if parent[neigh] == node and new_costs.get(neigh) != metric:
+                    roots.add(neigh)
+
+        affected = self.subtree(roots)
+        old_distance = {}
+        old_parent = {}
+        for node in affected:
+            old_distance[node] = distance[node]
+            old_parent[node] = parent[node]
+            distance[node] = None
+
+        heap = []
+
+        def relax(node, new_dist):
+            existing = distance[node]
+            if existing is None or new_dist < existing:
+                if node not in old_distance:
+                    old_distance[node] = existing
+                    old_parent[node] = parent[node]
+                distance[node] = new_dist
+                heapq.heappush(heap, (new_dist, node))
+
+        # Reattach the affected subtree from whatever is still connected
+        for node in affected:
+            for src, metric in graph.reverse[node]:
+                if src not in affected and distance[src] is not None:
+                    relax(node, distance[src] + metric)
+
+        # New or cheaper links may improve things beyond the subtree
+        for node in topology_changes:
+            if node not in affected and distance[node] is not None:
+                for neigh, metric in adjacency[node]:
+                    relax(neigh, distance[node] + metric)
+
+        settled = set()
+        while len(heap) > 0:
+            dist, node = heapq.heappop(heap)
+            if node in settled or dist != distance[node]:
+                continue
+            settled.add(node)
+            for neigh, metric in adjacency[node]:
+                relax(neigh, dist + metric)
+
+        # The parent of a system is its cheapest predecessor, with ties
+        # going to whoever a full run would have settled first
+        recheck = set(old_distance)
+        for node in old_distance:
+            recheck.update(neigh for neigh, _ in adjacency[node])
+        for node, old_links in topology_changes.items():
+            recheck.update(neigh for neigh, _ in old_links)
+            recheck.update(neigh for neigh, _ in adjacency[node])
+        recheck.discard(self.root)
+
+        moved = set()
+        for node in recheck:
+            before = old_parent.get(node, parent[node])
+            parent[node] = self._best_parent(node)
+            if parent[node] != before or distance[node] != old_distance.get(node, distance[node]):
+                moved.add(node)
+                if before is not None:
+                    self.children[before].discard(node)
+                if parent[node] is not None:
+                    self.children[parent[node]].add(node)
+
+        changed = self.subtree(moved)
+        self._update_paths(changed)
+        return changed
+
+    def _best_parent(self, node):
+        dist = self.distance[node]
+        if dist is None:
+            return None
+        best = None
+        for src, metric in self.graph.reverse[node]:
+            src_dist = self.distance[src]
+            if src_dist is not None and src_dist + metric == dist:
+                if best is None or (src_dist, src) < (self.distance[best], best):
+                    best = src
+        return best
+
+    def _update_paths(self, changed):
+        nodes = self.graph.nodes
+        # Walk down from the top of each changed branch so a parent's
+        # path is always in place before its children's
+        stack = [node for node in changed if self.parent[node] not in changed]
+        while len(stack) > 0:
+            node = stack.pop()
+            if self.parent[node] is None:
+                self.paths.pop(node, None)
+            else:
+                self.paths[node] = self.paths[self.parent[node]] + [nodes[node]]
+            stack.extend(self.children[node])
+
+    def _resolve_prefix(self, prefix):
+        """
+        Re-pick the closest advertiser of prefix, returning True if
+        its distance or advertiser changed
+        """
+        best = None
+        best_key = None
+        for node, metric in self.graph.advertisers.get(prefix, {}).items():
+            dist = self.distance[node]
+            if dist is None:
+                continue
+            # Matches the order a full run would have considered them in
+            key = (dist + metric, dist, node)
+            if best_key is None or key < best_key:
+                best = node
+                best_key = key
+
+        before = (self.prefix_distance.get(prefix), self.prefix_node.get(prefix))
+        if best is None:
+            self.prefix_distance.pop(prefix, None)
+            self.prefix_node.pop(prefix, None)
+        else:
+            self.prefix_distance[prefix] = best_key[0]
+            self.prefix_node[prefix] = best
+        return before != (self.prefix_distance.get(prefix), self.prefix_node.get(prefix))
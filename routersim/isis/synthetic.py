@@ -0,0 +1,97 @@
+"""
+Synthetic LSP databases, for exercising SPF and the TED without
+bringing up a topology to flood them
+
+    database = generate_database(1000, degree=4, seed=0)
+    spt = ShortestPathTree(SPFGraph(database), system_id(0))
+
+The mutations change a database in place the way a newly flooded LSP
+would, returning the system ids whose LSPs they changed.
+"""
+import ipaddress
+import random
+from ..interface import ConnectionState
+from .pdu import LinkStatePDU
+from .process import LinkStatePacketWrapper
+from .tlv import ExtendedISReachabilityTLV, ExtendedIPReachabilityTLV
+from .tlv import IPInterfaceAddressTLV, NeighborIPAddressTLV, TrafficEngineeringIPRouter
+
+
+def system_id(idx):
+    return f"0000.{idx >> 16:04x}.{idx & 0xffff:04x}"
+
+
+def router_id(idx):
+    return ipaddress.IPv4Address(0x0A000000 + idx)
+
+
+def generate_database(size, degree=4, seed=0):
+    """
+    size systems in a ring with random chords (so it is always
+    connected) until the average degree is reached. Each advertises
+    its router id as a /32 loopback, and a /31 per link with the
+    addresses at both ends for the TED
+    """
+    rng = random.Random(seed)
+
+    links = set()
+    for idx in range(size):
+        links.add((idx, (idx + 1) % size))
+    chords = min(size * max(degree - 2, 0) // 2,
+                 size * (size - 1) // 2 - len(links))
+    while chords > 0:
+        a, b = rng.randrange(size), rng.randrange(size)
+        if a == b or (a, b) in links or (b, a) in links:
+            continue
+        links.add((a, b))
+        chords -= 1
+
+    pdus = []
+    for idx in range(size):
+        pdu = LinkStatePDU(system_id(idx), system_id(idx), 1)
+        pdu.tlvs.append(TrafficEngineeringIPRouter(router_id(idx)))
+        pdu.tlvs.append(ExtendedIPReachabilityTLV(
+            ipaddress.ip_network(f"{router_id(idx)}/32"), 0, ConnectionState.UP))
+        pdus.append(pdu)
+
+    p2p = ipaddress.IPv4Network("100.64.0.0/10").subnets(new_prefix=31)
+    for a, b in sorted(links):
+        metric = rng.choice([10, 10, 10, 20, 100])
+        prefix = next(p2p)
+        addresses = {a: prefix[0], b: prefix[1]}
+        for near, far in ((a, b), (b, a)):
+            neighbor = ExtendedISReachabilityTLV(system_id(far), metric)
+            neighbor.tlvs.append(IPInterfaceAddressTLV(addresses[near], ConnectionState.UP))
+            neighbor.tlvs.append(NeighborIPAddressTLV(addresses[far]))
+            pdus[near].tlvs.append(neighbor)
+            pdus[near].tlvs.append(ExtendedIPReachabilityTLV(prefix, metric, ConnectionState.UP))
+
+    return {pdu.lsp_id: LinkStatePacketWrapper(pdu) for pdu in pdus}
+
+
+def flap_prefix(database, rng):
+    """
+    Toggle the state of one advertised prefix, returning the system id
+    """
+    lsp = database[rng.choice(sorted(database))].pdu
+    network = rng.choice(lsp.addresses)
+    if network.state == ConnectionState.UP:
+        network.state = ConnectionState.DOWN
+    else:
+        network.state = ConnectionState.UP
+    return [lsp.source_address]
+
+
+def change_metric(database, rng):
+    """
+    Change the metric of one link in both directions, returning the
+    system ids involved
+    """
+    lsp = database[rng.choice(sorted(database))].pdu
+    neighbor = rng.choice(lsp.neighbors)
+    metric = rng.choice([1, 10, 50, 100])
+    neighbor.metric = metric
+    for other in database[neighbor.system_id].pdu.neighbors:
+        if other.system_id == lsp.source_address:
+            other.metric = metric
+    return [lsp.source_address, neighbor.system_id]
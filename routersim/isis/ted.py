@@ -0,0 +1,235 @@
+"""
+Traffic engineering database (TED) and constrained SPF (CSPF)
+
+The TED is the IS-IS database boiled down to what CSPF needs: the
+links each router id advertises, with their metric, admin group and
+bandwidth. IsisProcess tells it which LSPs have changed, and they are
+only looked at again the next time a path is asked for.
+
+    constraints = Constraints(exclude_any=0x1, bandwidth=100 * 10**6)
+    ero = isis.ted.cspf(source_ip, dest_ip, constraints)
+
+Shortest path trees are cached per source and constraints until the
+TED next changes, so signalling many LSPs from the same router only
+runs CSPF once per set of constraints.
+"""
+from collections import namedtuple
+from dataclasses import dataclass, replace
+import heapq
+
+
+TELink = namedtuple(
+    "TELink",
+    ["local_ip", "remote_ip", "remote_system", "metric", "admin_group", "bandwidth"])
+
+
+@dataclass(frozen=True)
+class Constraints:
+    """
+    What every link of a path has to satisfy.
+
+    Admin groups are bit masks: a link has to be in at least one of
+    include_any (if given), all of include_all and none of exclude_any.
+    Links advertising less than bandwidth aren't used, those which
+    don't advertise a bandwidth are. exclude_nodes are router ids,
+    exclude_links addresses at either end of a link.
+    """
+    include_any: int = 0
+    include_all: int = 0
+    exclude_any: int = 0
+    bandwidth: int = 0
+    exclude_nodes: frozenset = frozenset()
+    exclude_links: frozenset = frozenset()
+
+    def allows(self, link):
+        group = link.admin_group
+        if self.include_any and not group & self.include_any:
+            return False
+        if group & self.include_all != self.include_all:
+            return False
+        if group & self.exclude_any:
+            return False
+        if (self.bandwidth and link.bandwidth is not None and
+                link.bandwidth < self.bandwidth):
+            return False
+        if link.local_ip in self.exclude_links or link.remote_ip in self.exclude_links:
+            return False
+        return True
+
+    def __post_init__(self):
+        # Constraints are used as cache keys, so take sets as given
+        object.__setattr__(self, 'exclude_nodes', frozenset(self.exclude_nodes))
+        object.__setattr__(self, 'exclude_links', frozenset(self.exclude_links))
+
+    def excluding_link(self, address):
+        return replace(self, exclude_links=self.exclude_links | {address})
+
+
+NO_CONSTRAINTS = Constraints()
+
+
+class TrafficEngineeringDatabase:
+
+    def __init__(self, database):
+        # lsp_id -> LinkStatePacketWrapper, as kept by IsisProcess
+        self.database = database
+
+        # router id -> tuple of TELinks it advertises
+        self.nodes = {}
+        # system id -> router id
+        self.router_ids = {}
+        # link address -> router id of the router it belongs to
+        self.link_owners = {}
+        # lsp_id -> router id it was last seen with
+        self._lsps = {}
+        # LSPs which have changed since we last looked
+        self._dirty = set()
+
+        # Bumped whenever anything CSPF would look at changes
+        self.version = 0
+        # (source, constraints) -> tree, valid for _trees_version
+        self._trees = {}
+        self._trees_version = 0
+
+        self.hits = 0
+        self.misses = 0
+
+    def changed(self, lsp_id):
+        self._dirty.add(lsp_id)
+
+    def sync(self):
+        if len(self._dirty) == 0:
+            return
+        dirty = self._dirty
+        self._dirty = set()
+        for lsp_id in dirty:
+            if self._update(lsp_id):
+                self.version += 1
+
+    def _update(self, lsp_id):
+        wrapper = self.database.get(lsp_id)
+        previous = self._lsps.get(lsp_id)
+        if wrapper is None:
+            if previous is None:
+                return False
+            self._remove(lsp_id)
+            return True
+
+        pdu = wrapper.pdu
+        router_id = pdu.routerid
+        links = tuple(
+            TELink(neighbor.local_ip, neighbor.neighbor_ip, neighbor.system_id,
+                   neighbor.metric, neighbor.admin_group, neighbor.bandwidth)
+            for neighbor in pdu.neighbors)
+
+        if previous is not None:
+            if previous == router_id and self.nodes.get(router_id) == links:
+                # Only the prefixes (or nothing at all) changed
+                return False
+            self._remove(lsp_id)
+
+        if router_id is None:
+            return previous is not None
+
+        self._lsps[lsp_id] = router_id
+        self.router_ids[pdu.source_address] = router_id
+        self.nodes[router_id] = links
+        for link in links:
+            self.link_owners[link.local_ip] = router_id
+        return True
+
+    def _remove(self, lsp_id):
+        router_id = self._lsps.pop(lsp_id)
+        for link in self.nodes.pop(router_id, ()):
+            if self.link_owners.get(link.local_ip) == router_id:
+                del self.link_owners[link.local_ip]
+        for system_id in [system_id for system_id, owner in self.router_ids.items()
+                          if owner == router_id]:
+            del self.router_ids[system_id]
+
+    def router_for_address(self, address):
+        """
+        Router id of whoever has address on one of its links
+        """
+        self.sync()
+        return self.link_owners.get(address)
+
+    def tree(self, source, constraints=NO_CONSTRAINTS):
+        """
+        router id -> (link, previous router id) of everything reachable
+        from source over links satisfying constraints
+        """
+        self.sync()
+        if self._trees_version != self.version:
+            self._trees.clear()
+            self._trees_version = self.version
+
+        key = (source, constraints)
+        tree = self._trees.get(key)
+        if tree is not None:
+            self.hits += 1
+            return tree
+
+        self.misses += 1
+        tree = self._trees[key] = self._dijkstra(source, constraints)
+        return tree
+
+    def _dijkstra(self, source, constraints):
+        if source not in self.nodes:
+            return {}
+
+        nodes = self.nodes
+        router_ids = self.router_ids
+        excluded = constraints.exclude_nodes
+
+        tree = {source: None}
+        distance = {source: 0}
+        done = set()
+        # Ties go to the lowest router id
+        heap = [(0, source)]
+        while len(heap) > 0:
+            dist, node = heapq.heappop(heap)
+            if node in done:
+                continue
+            done.add(node)
+
+            for link in nodes[node]:
+                neighbor = router_ids.get(link.remote_system)
+                if neighbor is None or neighbor in done or neighbor in excluded:
+                    continue
+                if not constraints.allows(link):
+                    continue
+                new_dist = dist + link.metric
+                existing = distance.get(neighbor)
+                if existing is None or new_dist < existing:
+                    distance[neighbor] = new_dist
+                    tree[neighbor] = (link, node)
+                    heapq.heappush(heap, (new_dist, neighbor))
+        return tree
+
+    def cspf(self, source, destination, constraints=NO_CONSTRAINTS):
+        """
+        Explicit route from source to destination (router ids) as the
+        far end address of each link along the shortest path satisfying
+        constraints, or None if there isn't one
+        """
+        tree = self.tree(source, constraints)
+        if destination not in tree:
+            return None
+
+        ero = []
+        node = destination
+        while node != source:
+            link, node = tree[node]
+            ero.append(link.remote_ip)
+        ero.reverse()
+        return ero
+
+    def statistics(self):
+        return {
+            'routers': len(self.nodes),
+            'version': self.version,
+            'cached_trees': len(self._trees),
+            'hits': self.hits,
+            'misses': self.misses,
+        }
@@ -0,0 +1,72 @@
+class Throttle:
+    """
+    Exponential backoff for work (SPF runs, LSP generation) which is
+    asked for far more often than it is worth doing.
+
+    The first trigger after things have been quiet runs the action
+    after initial ms. While things stay busy the gap between runs
+    starts at secondary and doubles each time, up to maximum. Once
+    nothing has triggered it for twice maximum it goes back to initial.
+
+    Anything triggered while a run is already scheduled is coalesced
+    into that run.
+    """
+
+    def __init__(self, context, action, initial=50, secondary=200, maximum=5000):
+        self.context = context
+        self.action = action
+        # So the profiler can account runs to the device
+        self.owner = getattr(action, '__self__', None)
+        self.initial = initial
+        self.secondary = secondary
+        self.maximum = maximum
+
+        self.pending = False
+        # Gap to leave after the last run for the next one
+        self.wait = initial
+        self.last_trigger = None
+        self.last_run = None
+
+        self.triggers = 0
+        self.runs = 0
+        self.coalesced = 0
+
+    def __str__(self):
+        return (f"{self.runs} runs for {self.triggers} triggers"
+                f" ({self.coalesced} coalesced, next wait {self.wait}ms)")
+
+    def trigger(self):
+        now = self.context.now()
+        self.triggers += 1
+
+        quiet = (self.last_trigger is None or
+                 now - self.last_trigger > 2 * self.maximum)
+        self.last_trigger = now
+
+        if self.pending:
+            self.coalesced += 1
+            return
+
+        if quiet or self.last_run is None:
+            delay = self.initial
+            self.wait = self.secondary
+        else:
+            delay = max(self.last_run + self.wait - now, 0)
+            self.wait = min(self.wait * 2, self.maximum)
+
+        self.pending = True
+        self.context.enqueue(delay, self._run)
+
+    def _run(self):
+        self.pending = False
+        self.last_run = self.context.now()
+        self.runs += 1
+        self.action()
+
+    def statistics(self):
+        return {
+            'triggers': self.triggers,
+            'runs': self.runs,
+            'coalesced': self.coalesced,
+            'wait': self.wait,
+        }
@@ -65,6 +65,32 @@ class NeighborIPAddressTLV(TLV):
         return "\t" + self.__str__()
 
 
+class AdministrativeGroupTLV(TLV):
+    # RFC 5305 3.1, a bit mask of the groups ("colors") the link is in
+    def __init__(self, groups):
+        super().__init__("Administrative Group", 3)
+        self.groups = groups
+
+    def __str__(self):
+        return f"\tAdministrative Group: {self.groups:#010x}"
+
+    def extensive(self):
+        return "\t" + self.__str__()
+
+
+class MaximumBandwidthTLV(TLV):
+    # RFC 5305 3.4, in bits per second
+    def __init__(self, bandwidth):
+        super().__init__("Maximum Link Bandwidth", 9)
+        self.bandwidth = bandwidth
+
+    def __str__(self):
+        return f"\tMaximum Link Bandwidth: {self.bandwidth}bps"
+
+    def extensive(self):
+        return "\t" + self.__str__()
+
+
 class TrafficEngineeringIPRouter(TLV):
     def __init__(self, address):
         super().__init__("TE IP Router ID", 134)
@@ -110,6 +136,35 @@ class ExtendedISReachabilityTLV(TLV):
             return t.address
         return None
 
+    @property
+    def admin_group(self):
+        for t in self.tlvs:
+            if isinstance(t, AdministrativeGroupTLV):
+                return t.groups
+        return 0
+
+    @property
+    def bandwidth(self):
+        for t in self.tlvs:
+            if isinstance(t, MaximumBandwidthTLV):
+                return t.bandwidth
+        return None
+
+    def set_te_attributes(self, admin_group, bandwidth):
+        """
+        Advertise the link's admin group and bandwidth (0 and None
+        aren't advertised), returning whether anything changed
+        """
+        if admin_group == self.admin_group and bandwidth == self.bandwidth:
+            return False
+        self.tlvs = [t for t in self.tlvs
+                     if not isinstance(t, (AdministrativeGroupTLV, MaximumBandwidthTLV))]
+        if admin_group:
+            self.tlvs.append(AdministrativeGroupTLV(admin_group))
+        if bandwidth is not None:
+            self.tlvs.append(MaximumBandwidthTLV(bandwidth))
+        return True
+
 
 class ExtendedIPReachabilityTLV(TLV):
     def __init__(self, prefix, metric, state, type='Internal'):
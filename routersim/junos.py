@@ -36,7 +36,17 @@ def p_error(p):
     if p:
          print("Syntax error at token", p.type)
 
-parser = yacc.yacc()
+_parser = None
+
+
+def __getattr__(name):
+    # The parser is only built the first time someone asks for it
+    global _parser
+    if name == 'parser':
+        if _parser is None:
+            _parser = yacc.yacc()
+        return _parser
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 #while True:
 #    try:
@@ -0,0 +1,123 @@
+import ipaddress
+
+
+_MASKS = [(0xFFFFFFFF << (32 - length)) & 0xFFFFFFFF for length in range(33)]
+
+
+def address_as_int(address):
+    if isinstance(address, int):
+        return address
+    if isinstance(address, ipaddress.IPv4Address):
+        return int(address)
+    if isinstance(address, (ipaddress.IPv4Network, ipaddress.IPv4Interface)):
+        return int(address.network_address)
+    return int(ipaddress.IPv4Address(address))
+
+
+class PrefixTable:
+    """
+    Longest-prefix-match table for IPv4 prefixes
+
+    Prefixes are bucketed by length, each bucket being a dict keyed on the
+    integer network address. A lookup masks the address once per prefix
+    length that is actually in use (longest first), so it costs at most
+    33 dict probes no matter how many prefixes are loaded.
+    """
+
+    def __init__(self, entries=None):
+        # prefixlen -> {network address as int: (prefix, value)}
+        self._buckets = {}
+        # prefix lengths in use, longest first
+        self._lengths = []
+        self._count = 0
+
+        if entries is not None:
+            for prefix, value in entries:
+                self[prefix] = value
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, prefix):
+        return self.get(prefix) is not None
+
+    def __setitem__(self, prefix, value):
+        if not isinstance(prefix, ipaddress.IPv4Network):
+            prefix = ipaddress.ip_network(prefix)
+
+        bucket = self._buckets.get(prefix.prefixlen)
+        if bucket is None:
+            bucket = self._buckets[prefix.prefixlen] = {}
+            self._lengths = sorted(self._buckets, reverse=True)
+
+        key = int(prefix.network_address)
+        if key not in bucket:
+            self._count += 1
+        bucket[key] = (prefix, value)
+
+    def __delitem__(self, prefix):
+        if not isinstance(prefix, ipaddress.IPv4Network):
+            prefix = ipaddress.ip_network(prefix)
+
+        bucket = self._buckets[prefix.prefixlen]
+        del bucket[int(prefix.network_address)]
+        self._count -= 1
+
+        if len(bucket) == 0:
+            del self._buckets[prefix.prefixlen]
+            self._lengths = sorted(self._buckets, reverse=True)
+
+    def get(self, prefix, default=None):
+        """
+        Exact match on prefix
+        """
+        if not isinstance(prefix, ipaddress.IPv4Network):
+            prefix = ipaddress.ip_network(prefix)
+        bucket = self._buckets.get(prefix.prefixlen)
+        if bucket is None:
+            return default
+        entry = bucket.get(int(prefix.network_address))
+        if entry is None:
+            return default
+        return entry[1]
+
+    def lookup_prefix(self, address):
+        """
+        Longest match for address, returned as (prefix, value)
+        or None if nothing covers it
+        """
+        if isinstance(address, str) and '/' in address:
+            address = ipaddress.ip_network(address)
+
+        as_int = address_as_int(address)
+        max_length = 32
+        if isinstance(address, ipaddress.IPv4Network):
+            max_length = address.prefixlen
+
+        buckets = self._buckets
+        for length in self._lengths:
+            if length > max_length:
+                continue
+            entry = buckets[length].get(as_int & _MASKS[length])
+            if entry is not None:
+                return entry
+        return None
+
+    def lookup(self, address):
+        """
+        Value stored against the longest match for address
+        """
+        entry = self.lookup_prefix(address)
+        if entry is None:
+            return None
+        return entry[1]
+
+    def items(self):
+        for length in self._lengths:
+            for prefix, value in self._buckets[length].values():
+                yield prefix, value
+
+    def clear(self):
+        self._buckets.clear()
+        self._lengths = []
+        self._count = 0
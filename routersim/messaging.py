@@ -1,5 +1,6 @@
 from enum import Enum
-from scapy.layers.l2 import Ether
+from copy import copy
+from .packets import is_scapy
 
 
 class FrameType(Enum):
@@ -65,6 +66,8 @@ class MACAddress():
         return self.bytes.hex(":", 1)
 
 BROADCAST_MAC = MACAddress(bytes([0xFF, 0xFF, 0xFF, 0xFF, 0xFF, 0xFF]))
+# IS-IS PDUs are sent to the "All Intermediate Systems" multicast address
+ALL_ISS_MAC = MACAddress(bytes([0x09, 0x00, 0x2B, 0x00, 0x00, 0x05]))
 
 class frame:
 
@@ -124,4 +127,28 @@ class ICMPMessage:
 
 
 class RSVPMessage:
-    pass
\ No newline at end of file
+
+    def __copy__(self):
+        # Route objects get appended/popped as the message is passed
+        # along, so the lists need to be our own
+        copied = self.__class__.__new__(self.__class__)
+        for key, value in self.__dict__.items():
+            if isinstance(value, list):
+                value = list(value)
+            copied.__dict__[key] = value
+        return copied
+
+
+def clone(packet):
+    """
+    Frames are handed to receivers without being copied, so anything
+    wanting to change a received packet (TTL, label stack, route
+    objects) needs to do so on a clone of it.
+
+    Only the outermost layer is copied, its payload is still shared.
+    """
+    if is_scapy(packet):
+        layer = packet.clone_with(**packet.fields)
+        layer.payload = packet.payload
+        return layer
+    return copy(packet)
\ No newline at end of file
@@ -1,5 +1,5 @@
-from collections import UserDict
 from .observers import Event, EventType
+import heapq
 
 from abc import ABC, abstractmethod
 """
@@ -8,23 +8,56 @@ MPLS - RFC 3031
 https://tools.ietf.org/html/rfc3031
 """
 
+# RFC 3032 2.1, the label an egress asks for to have the penultimate
+# hop pop instead of swap
+IMPLICIT_NULL = 3
+# 0-15 are reserved, and labels are 20 bits
+FIRST_UNRESERVED_LABEL = 16
+MAX_LABEL = (1 << 20) - 1
+
 
 class MPLSPacket():
+    __slots__ = ('encapsulated', 'label_stack', 'ttl')
 
     def __init__(self, encapsulated=None, ttl=64):
         # What are we actually carrying
         self.encapsulated = encapsulated
+        # Labels as ints, bottom of the stack first
         self.label_stack = []
         # TODO: We can also pull this from the encapsulated packet
         # 3.23. Time-to-Live (TTL)
         self.ttl = ttl
 
+    def __copy__(self):
+        clone = MPLSPacket(self.encapsulated, ttl=self.ttl)
+        clone.label_stack = list(self.label_stack)
+        return clone
+
     def __str__(self):
-        return f"MPLS (labels={','.join(self.label_stack)}"
+        return f"MPLS (labels={','.join([str(label) for label in self.label_stack])}"
 
     def seq_note(self):
         return f"Encapsulated: {self.encapsulated}"
 
+    def to_scapy(self):
+        # Only built when someone wants to look at it
+        from scapy.contrib.mpls import MPLS
+        from .packets import to_scapy
+
+        # label_stack is bottom first
+        packet = None
+        for depth, label in enumerate(reversed(self.label_stack)):
+            layer = MPLS(label=label, ttl=self.ttl,
+                         s=1 if depth == len(self.label_stack) - 1 else 0)
+            packet = layer if packet is None else packet / layer
+        if self.encapsulated is not None:
+            inner = to_scapy(self.encapsulated)
+            packet = inner if packet is None else packet / inner
+        return packet
+
+    def __bytes__(self):
+        return bytes(self.to_scapy())
+
 class LabelStackOperation(ABC):
 
     def __init__(self):
@@ -58,10 +91,11 @@ class ReplaceStackOperation(LabelStackOperation):
         self.new_label = new_label
 
     def apply(self, packet: MPLSPacket, router, event_manager=None):
-        old_label = packet.label_stack.pop()
-        packet.label_stack.append(str(self.new_label))
+        # In place, rather than a pop and a push
+        old_label = packet.label_stack[-1]
+        packet.label_stack[-1] = self.new_label
 
-        if event_manager is not None:
+        if event_manager is not None and event_manager.is_enabled(EventType.MPLS):
             event_manager.observe(Event(EventType.MPLS,
                                   router,
                                   f"Swapped {old_label} for {self.new_label}",
@@ -83,8 +117,8 @@ class PushStackOperation(LabelStackOperation):
         if not isinstance(pdu, MPLSPacket):
             packet = MPLSPacket(pdu, ttl=pdu.ttl)
 
-        packet.label_stack.append(str(self.new_label))
-        if event_manager is not None:
+        packet.label_stack.append(self.new_label)
+        if event_manager is not None and event_manager.is_enabled(EventType.MPLS):
             event_manager.observe(Event(EventType.MPLS,
                                   router,
                                   f"Pushed {self.new_label}",
@@ -100,7 +134,7 @@ class PushStackOperation(LabelStackOperation):
 class PopStackOperation(LabelStackOperation):
     def apply(self, packet: MPLSPacket, router, event_manager=None):
         old_label = packet.label_stack.pop()
-        if event_manager is not None:
+        if event_manager is not None and event_manager.is_enabled(EventType.MPLS):
             event_manager.observe(Event(EventType.MPLS,
                                   router,
                                   f"Popped {old_label} from MPLS label stack",
@@ -124,18 +158,181 @@ class NextHopLabelForwardingEntry():
         self.action = label_action
 
 
-# TODO: This may become referenced by the routing table
-class IncomingLabelMap(UserDict):
+class LabelTable:
+    """
+    Label -> entry, as a list indexed directly by the label
+
+    Labels are handed out from a small contiguous range starting at
+    base, so this is about as big as the span of labels in use and a
+    lookup is a single index rather than a hash and compare. It grows
+    (doubling) to fit whatever is put in it, and base moves down for
+    a label below it (a static one, say).
+    """
+
+    def __init__(self, entries=None, size=16, base=0):
+        self.base = base
+        self._size = size
+        self._entries = [None] * size
+        self._count = 0
+
+        if entries is not None:
+            for label, entry in entries:
+                self[label] = entry
+
+    def __len__(self):
+        return self._count
+
+    def __contains__(self, label):
+        return self.get(label) is not None
+
+    def __iter__(self):
+        base = self.base
+        return (base + idx for idx, entry in enumerate(self._entries)
+                if entry is not None)
+
+    def items(self):
+        base = self.base
+        return ((base + idx, entry) for idx, entry in enumerate(self._entries)
+                if entry is not None)
+
+    def __setitem__(self, label, entry):
+        if label < 0:
+            raise KeyError(f"Invalid label {label}")
+        idx = label - self.base
+        entries = self._entries
+        if idx < 0:
+            entries[0:0] = [None] * -idx
+            self.base = label
+            idx = 0
+        if idx >= len(entries):
+            size = len(entries)
+            while size <= idx:
+                size *= 2
+            entries.extend([None] * (size - len(entries)))
+        if entries[idx] is None:
+            self._count += 1
+        entries[idx] = entry
+
+    def __delitem__(self, label):
+        if self.get(label) is None:
+            raise KeyError(label)
+        idx = label - self.base
+        entries = self._entries
+        entries[idx] = None
+        self._count -= 1
+
+        # Give back the space once the top half is empty, so the table
+        # only stays as big as the labels still in use need
+        if idx >= len(entries) // 2:
+            top = len(entries)
+            while top > 0 and entries[top - 1] is None:
+                top -= 1
+            size = len(entries)
+            while size > self._size and size // 2 >= top:
+                size //= 2
+            del entries[size:]
+
+    def get(self, label, default=None):
+        idx = label - self.base
+        # Negative indexes would wrap round to the end
+        if idx < 0:
+            return default
+        try:
+            entry = self._entries[idx]
+        except IndexError:
+            return default
+        return default if entry is None else entry
+
+    def pop(self, label, default=None):
+        entry = self.get(label)
+        if entry is None:
+            return default
+        del self[label]
+        return entry
+
+    def capacity(self):
+        return len(self._entries)
+
+
+class IncomingLabelMap(LabelTable):
     """
     The Incoming Label Map is just responsible for taking a label
     and deriving label actions + next hop that will be applied
     to an mpls packet with that label
-    """
 
-    def __init__(self):
-        super().__init__([])
+    It's what the PFE looks labels up in, kept in step with the mpls
+    routing table by the ForwardingTable.
+    """
 
     def lookup(self, label: int) -> list[NextHopLabelForwardingEntry]:
-        return self.__get(label)
+        entry = self.get(label)
+        if entry is None:
+            return None
+        return [entry]
+
+
+class LabelManager:
+    """
+    Hands out the labels in [first, last] for a whole router (a per
+    platform label space), to whichever protocol asks.
+
+    Released labels are handed out again lowest first, so the labels in
+    use stay packed at the bottom of the range and anything indexed by
+    label (the IncomingLabelMap) stays about as big as the number of
+    labels in use, however many have come and gone.
+    """
+
+    def __init__(self, first=FIRST_UNRESERVED_LABEL, last=MAX_LABEL):
+        if first < FIRST_UNRESERVED_LABEL or last > MAX_LABEL or first > last:
+            raise Exception(
+                f"Invalid label range {first}-{last}, has to be within "
+                f"{FIRST_UNRESERVED_LABEL}-{MAX_LABEL}")
+        self.first = first
+        self.last = last
+
+        # Lowest label never handed out
+        self._next = first
+        # Released labels, as a heap
+        self._free = []
+        self._in_use = set()
+
+        self.allocations = 0
+        self.releases = 0
+
+    def __len__(self):
+        return len(self._in_use)
+
+    def __contains__(self, label):
+        return label in self._in_use
+
+    def allocate(self):
+        if len(self._free) > 0:
+            label = heapq.heappop(self._free)
+        elif self._next <= self.last:
+            label = self._next
+            self._next += 1
+        else:
+            raise Exception(f"No labels left in {self.first}-{self.last}")
+
+        self._in_use.add(label)
+        self.allocations += 1
+        return label
+
+    def release(self, label):
+        if label not in self._in_use:
+            raise Exception(f"Label {label} isn't allocated")
+        self._in_use.remove(label)
+        self.releases += 1
+        heapq.heappush(self._free, label)
+
+    def statistics(self):
+        return {
+            'in_use': len(self._in_use),
+            'free': len(self._free),
+            # Highest label ever handed out
+            'high_water': self._next - 1 if self._next > self.first else None,
+            'allocations': self.allocations,
+            'releases': self.releases,
+        }
 
 
@@ -1,27 +1,34 @@
 
 from .interface import PhysicalInterface
 from .messaging import ICMPMessage, ICMPType, IPProtocol, MACAddress
+from .packets import ICMPPacket, ipv4, icmp, is_scapy
 
 from .observers import Event, EventManager, EventType, GlobalQueueManager
-from .junos import parser as junos
+from . import junos
+from collections import deque
 import ipaddress
 import logging
-import random
 import json
 
-from scapy.layers.inet import IP,ICMP
 
 
 class NetworkDevice():
 
-    def __init__(self, hostname):
+    def __init__(self, hostname, context=None):
         # Actual interfaces which can have a cable attached
         self.hostname = hostname
         self.logger = logging.getLogger(hostname)
         self.phy_interfaces = dict()
-        self.event_manager = EventManager(self.hostname)
+        if context is None:
+            context = GlobalQueueManager.default()
+        self.context = context
+        self.event_manager = EventManager(self.hostname, context)
         self.main_interface = None
 
+        # Physical interfaces which may not have been cabled up yet,
+        # in the order they were added
+        self._free_ports = deque()
+
         self.pingid = 0
 
         # All interfaces (including logical)
@@ -32,7 +39,7 @@ class NetworkDevice():
         return self.hostname
 
     def run_junos_op(self, command: str):
-        func = junos.parse(command)
+        func = junos.parser.parse(command)
         if func is not None:
             func(self)
 
@@ -44,7 +51,7 @@ class NetworkDevice():
         if 'lo' in interface_name:
             is_loopback = True
 
-        netaddress = random.randbytes(3)
+        netaddress = self.context.random.randbytes(3)
         netasint = int.from_bytes(netaddress, 'big')
         addrasint = oui << 24 | netasint
 
@@ -59,9 +66,32 @@ class NetworkDevice():
 
         if self.main_interface is None:
             self.main_interface = intf
+        if not is_loopback:
+            self._free_ports.append(intf)
 
         return self.phy_interfaces[interface_name]
 
+    def free_port(self):
+        """
+        First physical interface (other than loopbacks) which isn't
+        linked to anything, or None if they all are
+
+        Interfaces are dropped for good once they're found to be linked
+        and are never handed out again, even if their link is later set
+        to None by hand. So if Topology.link_router_pairs() fails
+        partway, the pairs it has already linked keep their ports (and
+        their /31s), connected but down; build on a fresh topology
+        rather than retrying on the same routers
+        """
+        ports = self._free_ports
+        while len(ports) > 0:
+            intf = ports[0]
+            # Could have been replaced or cabled up by hand
+            if intf.link is None and self.phy_interfaces.get(intf.name) is intf:
+                return intf
+            ports.popleft()
+        return None
+
     def add_ip_address(self, interface_name, address):
         intf = self.interfaces.get(interface_name)
         if intf is None:
@@ -106,13 +136,13 @@ class NetworkDevice():
         payload = packet.payload
 
 
-        if isinstance(payload, ICMPMessage) or isinstance(payload, ICMP):
+        if isinstance(payload, (ICMPMessage, ICMPPacket)) or is_scapy(payload, 'ICMP'):
             self.logger.info(f"Received {payload} ({payload.type})")
             if payload.type == ICMPType.EchoRequest.value:
-                packet = IP(
+                packet = ipv4(
                     src = packet.dst,
                     dst = packet.src    
-                ) / ICMP (
+                ) / icmp (
                     type = ICMPType.EchoReply
                 ) / payload.payload
 
@@ -133,7 +163,7 @@ class NetworkDevice():
                 self.event_manager.observe(Event(
                     EventType.ICMP,
                     self,
-                    msg=f"Received Echo Reply {payload.payload}",
+                    msg=lambda: f"Received Echo Reply {payload.payload}",
                     object=packet,
                     sub_type=payload.type
                 ))
@@ -142,7 +172,7 @@ class NetworkDevice():
                 self.event_manager.observe(Event(
                     EventType.ICMP,
                     self,
-                    msg=f"Received Unreachable ({packet.pdu.code})",
+                    msg=lambda: f"Received Unreachable ({packet.pdu.code})",
                     object=packet,
                     sub_type=packet.pdu.type
                 ))
@@ -168,15 +198,14 @@ class NetworkDevice():
             'source_ip': source_ip,
         }
 
-        GlobalQueueManager.enqueue(0, print, (f"PING {ip_address}",))
+        self.context.enqueue(0, print, (f"PING {ip_address}",))
 
         def ping_handler(evt):
             # scapy
             pdu = evt.object.payload
             pingpayload = json.loads(pdu.payload.load)
             if (pdu.type == ICMPType.EchoReply.value and pingpayload['id'] == state['lastsent']):
-                delta = GlobalQueueManager.now(
-                ) - pingpayload['time']
+                delta = self.context.now() - pingpayload['time']
                 print(
                     f"\tReceived reply from {evt.object.src} - {delta} ms")
                 state['lost'] = False
@@ -219,7 +248,7 @@ class NetworkDevice():
             self.pingid = self.pingid + 1
             pingpayload = {
                 'id': self.pingid,
-                'time': GlobalQueueManager.now()
+                'time': self.context.now()
             }
             #packet = IPPacket(
             #    ip_address,
@@ -227,10 +256,10 @@ class NetworkDevice():
             #    IPProtocol.ICMP,
             #    ICMPMessage(ICMPType.EchoRequest, payload=pingpayload)
             #)
-            packet = IP(
+            packet = ipv4(
                 src = str(source_ip),
                 dst = str(ip_address)
-            ) / ICMP (
+            ) / icmp (
                 type=ICMPType.EchoRequest
             ) / json.dumps(pingpayload)
             state['lastsent'] = pingpayload['id']
@@ -238,14 +267,14 @@ class NetworkDevice():
             state['sent_time'] = self.event_manager.now()
             state['remaining'] = state['remaining'] - 1
             self.send_ip(packet, source_interface=source_interface)
-            GlobalQueueManager.enqueue(timeout, check_and_send)
+            self.context.enqueue(timeout, check_and_send)
 
         state['handler'] = ping_handler
         self.event_manager.listen(EventType.ICMP, state['handler'])
         # Add a bit of "human delay" to also allow for any events
         # that might need to occur before we ping, a la link state changes
-        GlobalQueueManager.enqueue(50, send_packet,
-                                   arguments=(
-                                       ip_address, source_interface, source_ip)
-                                   )
+        self.context.enqueue(50, send_packet,
+                             arguments=(
+                                 ip_address, source_interface, source_ip)
+                             )
         # source_interface.send_ip(packet)
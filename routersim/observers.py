@@ -1,31 +1,208 @@
-import sched
+import heapq
+import itertools
+import logging
 import random
-from functools import partial
+from collections import deque
 
 from enum import Enum
 
 
+class EventQueue:
+    """
+    Discrete-event queue which drives the simulation clock
+
+    Rather than stepping the clock and polling, the clock is jumped
+    straight to the timestamp of the next pending event and everything
+    due at that tick is popped off the heap as one batch.
+
+    Events landing on the same tick are "shuffled" by a tie-break key
+    drawn from a seeded RNG, so a given seed always replays in the
+    same order.
+    """
+
+    def __init__(self, clockfn, delayfn, seed=None):
+        self.clockfn = clockfn
+        self.delayfn = delayfn
+        self.random = random.Random(seed)
+        self._heap = []
+        self._counter = itertools.count()
+
+        # Number of callbacks which have been run
+        self.processed = 0
+
+        # Something with a call(action, arguments, kwargs) to run
+        # callbacks through, see routersim.profiling
+        self.profiler = None
+
+    def __len__(self):
+        return len(self._heap)
+
+    def enqueue(self, delay, action, arguments=(), kwargs=None, shuffle=True):
+        """
+        Run action after delay. With shuffle=False the action isn't
+        given a random tie-break, it runs after everything else due at
+        that tick and doesn't use up a draw from the RNG. This is for
+        things like observations, which may or may not be enqueued
+        depending on who is listening, and mustn't change the order the
+        rest of the simulation plays out in.
+        """
+        heapq.heappush(self._heap, (
+            self.clockfn() + delay,
+            self.random.random() if shuffle else 1.0,
+            next(self._counter),
+            action,
+            arguments,
+            kwargs
+        ))
+
+    def next_time(self):
+        if len(self._heap) == 0:
+            return None
+        return self._heap[0][0]
+
+    def run(self):
+        """
+        Run everything that is due as of the current time, returning
+        the delay until the next pending event (or None if there
+        is nothing left)
+        """
+        self.run_until(self.clockfn())
+
+        when = self.next_time()
+        if when is None:
+            return None
+        return when - self.clockfn()
+
+    def run_until(self, tick):
+        """
+        Process events in timestamp order until tick has been reached,
+        leaving the clock at tick
+        """
+        heap = self._heap
+        pop = heapq.heappop
+
+        while len(heap) > 0 and heap[0][0] <= tick:
+            when = heap[0][0]
+            now = self.clockfn()
+            if when > now:
+                self.delayfn(when - now)
+
+            batch = [pop(heap)]
+            while len(heap) > 0 and heap[0][0] == when:
+                batch.append(pop(heap))
+
+            profiler = self.profiler
+            for i, (_, _, _, action, arguments, kwargs) in enumerate(batch):
+                try:
+                    if profiler is not None:
+                        profiler.call(action, arguments, kwargs)
+                    elif kwargs:
+                        action(*arguments, **kwargs)
+                    else:
+                        action(*arguments)
+                except BaseException:
+                    # Don't lose whatever hadn't been run yet
+                    for entry in batch[i+1:]:
+                        heapq.heappush(heap, entry)
+                    self.processed += i + 1
+                    raise
+
+            self.processed += len(batch)
+
+        now = self.clockfn()
+        if now < tick:
+            self.delayfn(tick - now)
+
+
+class Clock():
+
+    def __init__(self):
+        self.tick = 0
+
+    def next_tick(self) -> int:
+        self.delayfn(1)
+        return self.tick
+
+    def clockfn(self) -> int:
+        return self.tick
+
+    def delayfn(self, delay):
+        self.tick = self.tick + delay
+
+
+class SimulationContext:
+    """
+    Everything that makes up a single running simulation: the clock,
+    the event queue and the random source.
+
+    Devices (and the protocols running on them) hold on to the context
+    they were created in, so any number of independent topologies can
+    exist side by side in one interpreter.
+    """
+
+    def __init__(self, clockfn=None, delayfn=None, seed=None):
+        self.clock = None
+        if clockfn is None:
+            self.clock = Clock()
+            clockfn = self.clock.clockfn
+            delayfn = self.clock.delayfn
+
+        self.seed = seed
+        self.random = random.Random(seed)
+        self.clockfn = clockfn
+        self.queue = EventQueue(clockfn, delayfn, seed=self.random.random())
+
+    def enqueue(self, delay, action, arguments=(), kwargs=None, shuffle=True):
+        self.queue.enqueue(delay, action, arguments, kwargs, shuffle)
+
+    def run(self):
+        return self.queue.run()
+
+    def run_until(self, tick):
+        return self.queue.run_until(tick)
+
+    def now(self):
+        return self.clockfn()
+
+
 class GlobalQueueManager:
+    """
+    Process-wide SimulationContext, used by anything which was created
+    without being handed a context of its own
+    """
+    context = None
+
+    @staticmethod
+    def setup(clockfn, delayfn, seed=None):
+        GlobalQueueManager.context = SimulationContext(clockfn, delayfn, seed=seed)
+        return GlobalQueueManager.context
 
     @staticmethod
-    def setup(clockfn, delayfn):
-        GlobalQueueManager.clockfn = clockfn
-        GlobalQueueManager.s = sched.scheduler(clockfn, delayfn)
+    def use(context):
+        GlobalQueueManager.context = context
+        return context
 
     @staticmethod
-    def enqueue(delay, action, arguments=(), kwargs={}):
-        # we do random priorit to "shuffle" the events that
-        # happen at the same time
-        GlobalQueueManager.s.enter(
-            delay, random.randint(0, 100), action, arguments)
+    def default():
+        if GlobalQueueManager.context is None:
+            GlobalQueueManager.context = SimulationContext()
+        return GlobalQueueManager.context
+
+    @staticmethod
+    def enqueue(delay, action, arguments=(), kwargs=None, shuffle=True):
+        GlobalQueueManager.default().enqueue(delay, action, arguments, kwargs, shuffle)
 
     @staticmethod
     def run():
-        return GlobalQueueManager.s.run(blocking=False)
+        return GlobalQueueManager.default().run()
+
+    @staticmethod
+    def run_until(tick):
+        return GlobalQueueManager.default().run_until(tick)
 
     @staticmethod
     def now():
-        return GlobalQueueManager.clockfn()
+        return GlobalQueueManager.default().now()
 
 
 class EventType(Enum):
@@ -50,17 +227,31 @@ class EventType(Enum):
 
 
 class Event:
+    """
+    msg can be given as a function returning the message, in which case
+    it is only formatted if somebody actually reads it
+    """
     # TODO: standard library?
     def __init__(self, event_type, source, msg,
                  object=None, sub_type="", target=None):
         self.event_type = event_type
         self.source = source
-        self.msg = msg
+        self._msg = msg
         self.object = object
         self.sub_type = sub_type
         self.target = target
         self.when = 0
 
+    @property
+    def msg(self):
+        if callable(self._msg):
+            self._msg = self._msg()
+        return self._msg
+
+    @msg.setter
+    def msg(self, msg):
+        self._msg = msg
+
 
 class LoggingObserver:
 
@@ -68,20 +259,59 @@ class LoggingObserver:
         self.prefix = prefix
         self.logger = logger
 
+    def is_enabled(self, event_type, sub_type=None):
+        return self.logger.isEnabledFor(logging.INFO)
+
     def observe(self, evt):
-        self.logger.info(
-            f"{evt.when} {self.prefix}:{evt.event_type} - from {evt.source}: {evt.msg}")
+        if self.logger.isEnabledFor(logging.INFO):
+            self.logger.info(
+                f"{evt.when} {self.prefix}:{evt.event_type} - from {evt.source}: {evt.msg}")
+
+    __call__ = observe
+
+
+class CollectorObserver:
+    """
+    What an EventCollector hands out to be registered with each
+    EventManager, tagging events with the name of where they came from
+    """
+    __slots__ = ('collector', 'aggregator_name')
+
+    def __init__(self, collector, aggregator_name):
+        self.collector = collector
+        self.aggregator_name = aggregator_name
+
+    def is_enabled(self, event_type, sub_type=None):
+        return self.collector.enabled
+
+    def __call__(self, evt):
+        if self.collector.enabled:
+            self.collector._events.append((self.aggregator_name, evt))
 
 
 class EventCollector:
-    def __init__(self):
-        self._events = []
+    """
+    Gathers (aggregator_name, event) pairs from any number of
+    EventManagers.
+
+    By default everything is kept until it is taken. With retention=N
+    only the most recent N events are held on to (a ring buffer), so
+    memory stays bounded however long the simulation runs.
+    """
+    def __init__(self, enabled=True, retention=None):
+        self.retention = retention
+        self._events = self._buffer()
+        # When disabled nothing is collected, and the devices feeding
+        # this collector won't build events just for its sake
+        self.enabled = enabled
+
+    def _buffer(self):
+        if self.retention is None:
+            return []
+        return deque(maxlen=self.retention)
 
     def observer(self, aggregator_name):
-        return partial(self._observe, aggregator_name)
-
-    def _observe(self, aggregator_name, evt):
-        self._events.append((aggregator_name, evt))
+        return CollectorObserver(self, aggregator_name)
 
     def clear(self):
         self._events.clear()
@@ -89,15 +319,101 @@ class EventCollector:
     def events(self):
         return self._events
 
+    def take(self):
+        """
+        Hand over everything collected so far, oldest first, and start
+        collecting afresh. The caller gets the buffer itself rather
+        than a copy of it
+        """
+        events = self._events
+        self._events = self._buffer()
+        return events
+
+
+class Subscription:
+    """
+    A listener which is only interested in some of the events of the
+    type it was registered for, checked before it is called.
+
+    sub_type and source can each be a single value or a collection of
+    them. Sources are matched on identity.
+    """
+    __slots__ = ('observer', 'sub_types', 'sources')
+
+    def __init__(self, observer, sub_type=None, source=None):
+        self.observer = observer
+        self.sub_types = _as_tuple(sub_type)
+        self.sources = _as_tuple(source)
+
+    def accepts(self, evt):
+        if self.sub_types is not None and evt.sub_type not in self.sub_types:
+            return False
+        if self.sources is not None:
+            return any(evt.source is source for source in self.sources)
+        return True
+
+    def is_enabled(self, event_type, sub_type=None):
+        if (sub_type is not None and self.sub_types is not None and
+                sub_type not in self.sub_types):
+            return False
+        enabled = getattr(self.observer, 'is_enabled', None)
+        return enabled is None or enabled(event_type, sub_type)
+
+    def __call__(self, evt):
+        if self.accepts(evt):
+            self.observer(evt)
+
+    def __eq__(self, other):
+        # So stop_listening() can be handed the original observer
+        if isinstance(other, Subscription):
+            return self is other
+        return self.observer == other
+
+    __hash__ = object.__hash__
+
+
+def _as_tuple(value):
+    if value is None:
+        return None
+    if isinstance(value, (tuple, list, set, frozenset)):
+        return tuple(value)
+    return (value, )
+
 
 class EventManager:
+    """
+    Fans events out to whoever is listening for them.
+
+    Listeners are any callable taking the event. A listener can also
+    have an is_enabled(event_type, sub_type) method, saying whether it
+    currently wants events at all (a LoggingObserver with logging off,
+    say). Anything raising events which are expensive to put together
+    should check is_enabled() first:
 
-    def __init__(self, name):
+        if self.event_manager.is_enabled(EventType.MPLS):
+            self.event_manager.observe(Event(...))
+    """
+
+    def __init__(self, name, context=None):
         self.name = name
         self.listeners = {}
+        if context is None:
+            context = GlobalQueueManager.default()
+        self.context = context
+
+    def is_enabled(self, event_type, sub_type=None):
+        """
+        True if anybody would do something with an event of event_type
+        """
+        for key in ('*', event_type):
+            for listener in self.listeners.get(key, ()):
+                enabled = getattr(listener, 'is_enabled', None)
+                if enabled is None or enabled(event_type, sub_type):
+                    return True
+        return False
 
     def observe(self, evt):
-        evt.when = GlobalQueueManager.now()
+        evt.when = self.context.now()
         if '*' in self.listeners:
             for listener in self.listeners['*']:
                 listener(evt)
@@ -106,7 +422,15 @@ class EventManager:
             for listener in self.listeners[evt.event_type]:
                 listener(evt)
 
-    def listen(self, event_type, observer):
+    def listen(self, event_type, observer, sub_type=None, source=None):
+        """
+        Call observer with each event of event_type ('*' for everything),
+        optionally only those with the given sub_type(s) or raised by the
+        given source(s)
+        """
+        if sub_type is not None or source is not None:
+            observer = Subscription(observer, sub_type=sub_type, source=source)
+
         if event_type not in self.listeners:
             self.listeners[event_type] = []
 
@@ -128,4 +452,4 @@ class EventManager:
             self.listeners[event_type].pop(idx)
 
     def now(self):
-        return GlobalQueueManager.now()
+        return self.context.now()
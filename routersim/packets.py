@@ -0,0 +1,342 @@
+"""
+Compact packet model for the simulator's fast path
+
+Building and reading scapy packets goes through scapy's field machinery
+on every access, which dominates data-plane heavy runs. These layers
+are plain __slots__ objects with the same field names as their scapy
+counterparts, and are stacked the same way:
+
+    packet = ipv4(src="10.0.0.1", dst="10.0.0.2") / icmp(type=8) / "hello"
+
+Nothing is converted to scapy until someone actually looks at the
+packet the scapy way: bytes(packet), packet.show(), packet[ICMP] or
+any other scapy attribute is answered by converting the whole stack
+with to_scapy() first.
+
+Set FAST_PATH = False to have the ether()/ipv4()/icmp()/udp() helpers
+hand out scapy packets instead.
+
+Unlike scapy, `/` attaches the payload in place rather than building
+copies of both sides.
+
+scapy itself is only imported (through routersim.scapy) the first time
+something needs it.
+"""
+from enum import Enum
+import sys
+
+
+FAST_PATH = True
+
+
+def _value(field):
+    # The simulator passes its Enums (FrameType, ICMPType, ...) where
+    # scapy would take an int, and scapy stores the int
+    if isinstance(field, Enum):
+        return field.value
+    return field
+
+
+class Layer:
+    __slots__ = ('payload',)
+
+    # The name scapy uses for the layer, for summaries
+    name = None
+    # (field, value) to set on the layer below us if it didn't say
+    underlayer_binding = None
+
+    def __truediv__(self, other):
+        if other is None:
+            return self
+        if isinstance(other, (str, bytes)):
+            other = RawPayload(other)
+
+        layer = self
+        while isinstance(layer.payload, Layer):
+            layer = layer.payload
+        if layer.payload is not None:
+            # Whatever is on the end isn't one of ours, let it stack
+            layer.payload = layer.payload / other
+            return self
+
+        layer.payload = other
+        binding = getattr(type(other), 'underlayer_binding', None)
+        if (binding is not None and hasattr(type(layer), binding[0]) and
+                getattr(layer, binding[0]) is None):
+            setattr(layer, binding[0], binding[1])
+        return self
+
+    def __copy__(self):
+        # The outermost layer only, the payload stays shared
+        copied = self.__class__.__new__(self.__class__)
+        for cls in self.__class__.__mro__:
+            for name in getattr(cls, '__slots__', ()):
+                setattr(copied, name, getattr(self, name))
+        return copied
+
+    def __getattr__(self, name):
+        # Only called for attributes we don't have, which means someone
+        # wants the scapy view of this packet (show(), haslayer(), ...)
+        if name.startswith('__'):
+            raise AttributeError(name)
+        return getattr(self.to_scapy(), name)
+
+    def __getitem__(self, key):
+        return self.to_scapy()[key]
+
+    def __bytes__(self):
+        return bytes(self.to_scapy())
+
+    def __str__(self):
+        parts = []
+        layer = self
+        while isinstance(layer, Layer):
+            detail = layer.describe()
+            parts.append(f"{layer.name} {detail}" if detail else layer.name)
+            layer = layer.payload
+        if layer is not None:
+            parts.append(type(layer).__name__)
+        return ' / '.join(parts)
+
+    def describe(self):
+        return ''
+
+    def to_scapy(self):
+        layer = self.scapy_layer()
+        if self.payload is not None:
+            layer = layer / to_scapy(self.payload)
+        return layer
+
+    def scapy_layer(self):
+        raise NotImplementedError()
+
+
+class EtherFrame(Layer):
+    __slots__ = ('src', 'dst', 'type')
+    name = 'Ether'
+
+    def __init__(self, src=None, dst=None, type=None):
+        self.src = src
+        self.dst = dst
+        self.type = _value(type)
+        self.payload = None
+
+    def scapy_layer(self):
+        from .scapy import Ether
+        fields = {'src': self.src, 'dst': self.dst}
+        if self.type is not None:
+            fields['type'] = self.type
+        return Ether(**fields)
+
+
+class IPv4Packet(Layer):
+    __slots__ = ('src', 'dst', 'ttl', 'proto', 'tos', 'id', 'options')
+    name = 'IP'
+    underlayer_binding = ('type', 0x0800)
+
+    def __init__(self, src=None, dst=None, ttl=64, proto=None, tos=0, id=1,
+                 options=None):
+        self.src = src
+        self.dst = dst
+        self.ttl = ttl
+        self.proto = _value(proto)
+        self.tos = tos
+        self.id = id
+        if options is None:
+            options = []
+        elif not isinstance(options, list):
+            options = [options]
+        self.options = options
+        self.payload = None
+
+    def describe(self):
+        return f"{self.src} > {self.dst}"
+
+    def inspectable(self):
+        # IP option 20 is Router Alert
+        return any(getattr(opt, 'option', None) == 20 for opt in self.options)
+
+    def seq_note(self):
+        notefn = getattr(self.payload, "seq_note", None)
+        if notefn is not None:
+            return notefn()
+        return None
+
+    def scapy_layer(self):
+        from .scapy import IP
+        fields = {'src': self.src, 'dst': self.dst, 'ttl': self.ttl,
+                  'tos': self.tos, 'id': self.id,
+                  'options': [to_scapy(opt) for opt in self.options]}
+        if self.proto is not None:
+            fields['proto'] = self.proto
+        return IP(**fields)
+
+
+class RouterAlertOption:
+    __slots__ = ()
+    # IP option 20
+    option = 20
+
+    def __str__(self):
+        return 'Router Alert'
+
+    def to_scapy(self):
+        from .scapy import IPOption_Router_Alert
+        return IPOption_Router_Alert()
+
+
+class ICMPPacket(Layer):
+    __slots__ = ('type', 'code', 'id', 'seq')
+    name = 'ICMP'
+    underlayer_binding = ('proto', 1)
+
+    def __init__(self, type=8, code=0, id=0, seq=0):
+        self.type = _value(type)
+        self.code = _value(code)
+        self.id = id
+        self.seq = seq
+        self.payload = None
+
+    def describe(self):
+        return f"type={self.type} code={self.code}"
+
+    def seq_note(self):
+        return f"{self.type}\n{getattr(self.payload, 'load', self.payload)}"
+
+    def scapy_layer(self):
+        from .scapy import ICMP
+        return ICMP(type=self.type, code=self.code, id=self.id, seq=self.seq)
+
+
+class UDPDatagram(Layer):
+    __slots__ = ('sport', 'dport')
+    name = 'UDP'
+    underlayer_binding = ('proto', 17)
+
+    def __init__(self, sport=53, dport=53):
+        self.sport = sport
+        self.dport = dport
+        self.payload = None
+
+    def describe(self):
+        return f"{self.sport} > {self.dport}"
+
+    def scapy_layer(self):
+        from .scapy import UDP
+        return UDP(sport=self.sport, dport=self.dport)
+
+
+class RawPayload(Layer):
+    __slots__ = ('load',)
+    name = 'Raw'
+
+    def __init__(self, load=b''):
+        if isinstance(load, str):
+            load = load.encode()
+        self.load = load
+        self.payload = None
+
+    def scapy_layer(self):
+        from .scapy import Raw
+        return Raw(load=self.load)
+
+
+class ARPPacket(Layer):
+    __slots__ = ('op', 'hwsrc', 'psrc', 'hwdst', 'pdst')
+    name = 'ARP'
+    underlayer_binding = ('type', 0x0806)
+
+    def __init__(self, op=1, hwsrc=None, psrc=None, hwdst=None, pdst=None):
+        self.op = _value(op)
+        self.hwsrc = hwsrc
+        self.psrc = psrc
+        self.hwdst = hwdst
+        self.pdst = pdst
+        self.payload = None
+
+    def describe(self):
+        # op 1 is a request
+        if self.op == 1:
+            return f"Request Who-Is {self.pdst}, tell {self.psrc} at {self.hwsrc}"
+        return f"Response {self.psrc} is {self.hwsrc}"
+
+    def scapy_layer(self):
+        from .scapy import ARP
+        fields = {'op': self.op, 'hwsrc': self.hwsrc, 'psrc': self.psrc,
+                  'pdst': self.pdst}
+        if self.hwdst is not None:
+            fields['hwdst'] = self.hwdst
+        return ARP(**fields)
+
+
+def is_scapy(packet, layer=None):
+    """
+    True if packet is a scapy packet, and if layer is given, that its
+    outermost layer is the scapy class of that name ('IP', 'UDP', ...)
+
+    Doesn't load scapy to find out: until somebody has, nothing can be
+    a scapy packet.
+    """
+    module = sys.modules.get('scapy.packet')
+    if module is None or not isinstance(packet, module.Packet):
+        return False
+    return layer is None or type(packet).__name__ == layer
+
+
+def to_scapy(packet):
+    """
+    Scapy version of packet, whichever model it is in
+    """
+    convert = getattr(type(packet), 'to_scapy', None)
+    if convert is not None:
+        return convert(packet)
+
+    if is_scapy(packet):
+        return packet
+
+    from .scapy import Raw
+    if isinstance(packet, (str, bytes)):
+        return Raw(load=packet)
+    return Raw(load=str(packet))
+
+
+def ether(**fields):
+    if FAST_PATH:
+        return EtherFrame(**fields)
+    from .scapy import Ether
+    return Ether(**fields)
+
+
+def ipv4(**fields):
+    if FAST_PATH:
+        return IPv4Packet(**fields)
+    from .scapy import IP
+    return IP(**fields)
+
+
+def icmp(**fields):
+    if FAST_PATH:
+        return ICMPPacket(**fields)
+    from .scapy import ICMP
+    return ICMP(**fields)
+
+
+def udp(**fields):
+    if FAST_PATH:
+        return UDPDatagram(**fields)
+    from .scapy import UDP
+    return UDP(**fields)
+
+
+def router_alert():
+    if FAST_PATH:
+        return RouterAlertOption()
+    from .scapy import IPOption_Router_Alert
+    return IPOption_Router_Alert()
+
+
+def arp(**fields):
+    if FAST_PATH:
+        return ARPPacket(**fields)
+    from .scapy import ARP
+    return ARP(**fields)
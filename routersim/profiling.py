@@ -0,0 +1,163 @@
+"""
+Where does the time go in a run?
+
+A Profiler hooked into a SimulationContext's EventQueue times every
+scheduled callback as it is run, and adds it up by the device it
+belongs to and the handler that was called:
+
+    topology.enable_profiling()
+    topology.run_another(60 * 1000)
+    for entry in topology.profile_report()[:10]:
+        print(entry)
+
+Only callbacks run by the queue are timed, and the time is inclusive:
+a PhysicalInterface.receive covers everything done synchronously with
+the frame it delivered (PFE lookups, IS-IS processing, ...).
+"""
+from dataclasses import dataclass
+import time
+from .observers import EventManager
+
+
+@dataclass
+class ProfileEntry:
+    device: str
+    handler: str
+    calls: int = 0
+    total_time: float = 0.0
+    max_time: float = 0.0
+
+    @property
+    def mean_time(self):
+        if self.calls == 0:
+            return 0.0
+        return self.total_time / self.calls
+
+    def __str__(self):
+        return (f"{self.device:>12} {self.handler:<45} {self.calls:>9} calls"
+                f" {self.total_time * 1000:10.1f} ms"
+                f" {self.mean_time * 1000000:8.1f} us/call")
+
+
+# Attributes which lead from a helper object towards the device it
+# belongs to (processes have a router, interfaces a parent, ...)
+OWNER_ATTRIBUTES = ('router', 'parent', 'sender', 'host', 'owner')
+
+
+def device_name(owner, depth=4):
+    """
+    Hostname of the device owner belongs to, or None if it can't be
+    worked out
+    """
+    for _ in range(depth):
+        if owner is None:
+            return None
+        if isinstance(owner, EventManager):
+            return owner.name
+        hostname = getattr(owner, 'hostname', None)
+        if isinstance(hostname, str):
+            return hostname
+
+        following = None
+        for attribute in OWNER_ATTRIBUTES:
+            following = getattr(owner, attribute, None)
+            if following is not None:
+                break
+        owner = following
+    return None
+
+
+def describe(action):
+    """
+    (device, handler) a scheduled action is accounted to
+    """
+    func = getattr(action, 'func', None)
+    if func is not None:
+        # functools.partial
+        action = func
+
+    handler = getattr(action, '__qualname__', None) or repr(action)
+    owner = getattr(action, '__self__', None)
+    device = device_name(owner)
+
+    if device is None:
+        # Closures (ping's timers and the like) usually hang on to
+        # the device they were created by
+        for cell in getattr(action, '__closure__', None) or ():
+            try:
+                device = device_name(cell.cell_contents, depth=1)
+            except ValueError:
+                continue
+            if device is not None:
+                break
+
+    return device or '-', handler
+
+
+class Profiler:
+
+    def __init__(self, clock=time.perf_counter):
+        self.clock = clock
+        self.entries = {}
+        # (function, owner) of bound methods -> ProfileEntry, so the
+        # owner only has to be worked out the first time
+        self._by_action = {}
+
+    def entry(self, action):
+        # partials are accounted to whatever they wrap
+        method = getattr(action, 'func', action)
+        function = getattr(method, '__func__', None)
+        key = None
+        found = None
+        if function is not None:
+            # Only bound methods (and partials of them) are cached, on
+            # the function and owner rather than the callable, which
+            # is often made afresh each time it's scheduled. Closures
+            # aren't: the same code can belong to a different device
+            # each time (its closure says which)
+            key = (function, method.__self__)
+            try:
+                found = self._by_action.get(key)
+            except TypeError:
+                # Unhashable owner, don't bother caching it
+                key = None
+        if found is None:
+            name = describe(action)
+            found = self.entries.get(name)
+            if found is None:
+                found = self.entries[name] = ProfileEntry(*name)
+            if key is not None:
+                self._by_action[key] = found
+        return found
+
+    def call(self, action, arguments, kwargs):
+        start = self.clock()
+        try:
+            if kwargs:
+                action(*arguments, **kwargs)
+            else:
+                action(*arguments)
+        finally:
+            elapsed = self.clock() - start
+            entry = self.entry(action)
+            entry.calls += 1
+            entry.total_time += elapsed
+            if elapsed > entry.max_time:
+                entry.max_time = elapsed
+
+    def report(self):
+        """
+        Everything recorded, most expensive first
+        """
+        return sorted(self.entries.values(),
+                      key=lambda entry: entry.total_time, reverse=True)
+
+    def by_device(self):
+        totals = {}
+        for entry in self.entries.values():
+            totals[entry.device] = totals.get(entry.device, 0.0) + entry.total_time
+        return dict(sorted(totals.items(), key=lambda item: item[1], reverse=True))
+
+    def clear(self):
+        self.entries.clear()
+        self._by_action.clear()
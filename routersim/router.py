@@ -1,10 +1,8 @@
-from typing import Generic
-from routersim.mpls import MPLSPacket
+from routersim.mpls import MPLSPacket, LabelManager, MAX_LABEL
 from .rsvp.process import RsvpProcess
 from .isis.process import IsisProcess
-from .routing import RoutingTables, Route, RouteType
+from .routing import RoutingTables, Route, RouteType, RouteDelta
 from .observers import EventManager, EventType, LoggingObserver, Event
-from .observers import GlobalQueueManager
 from .messaging import FrameType, MACAddress, RSVPMessage
 from .messaging import BROADCAST_MAC
 from .forwarding import PacketForwardingEngine, ForwardingTable
@@ -32,6 +30,9 @@ class RouteTableUpdater:
                 # Need to add connected routes
 
                 if not source.is_physical():
+                    # Entries which fell back to a bypass (or some other
+                    # way round) while it was down can use it again
+                    self.router._fib_updater.interface_up(source)
                     self.router.routing.add_route(
                         Route(
                             source.addresses['ipv4'].network,
@@ -84,6 +85,118 @@ class RouteTableUpdater:
                 self.router._forwarding.set_fib(self.router.routing.forwarding_table())
 
 
+class ForwardingTableUpdater:
+    """
+    Keeps the FIB in step with the routing tables by applying each
+    ROUTE_CHANGE as a per-prefix delta, rather than regenerating
+    the whole forwarding table
+    """
+
+    def __init__(self, router):
+        self.router = router
+        # protocol next hop -> BGP prefixes resolved through it
+        self._bgp_by_pnh = {}
+        self._pnh_of = {}
+
+        routing = router.routing
+        self._inet_tables = self._table_names(routing.inet)
+        self._recursive_tables = self._table_names(routing.recursive)
+
+    def _table_names(self, chain):
+        tables = self.router.routing.tables
+        return set(name for name in tables
+                   if any(table is tables[name] for table in chain.maps))
+
+    def _index_bgp(self, prefix):
+        for pnh in self._pnh_of.pop(prefix, ()):
+            prefixes = self._bgp_by_pnh[pnh]
+            prefixes.discard(prefix)
+            if len(prefixes) == 0:
+                del self._bgp_by_pnh[pnh]
+
+        pnhs = set(route.protocol_next_hop
+                   for route in self.router.routing.tables['bgp'].get(prefix, []))
+        if len(pnhs) > 0:
+            self._pnh_of[prefix] = pnhs
+            for pnh in pnhs:
+                self._bgp_by_pnh.setdefault(pnh, set()).add(prefix)
+
+    def affected_prefixes(self, table_name, prefix):
+        affected = set()
+
+        if table_name == 'bgp':
+            self._index_bgp(prefix)
+
+        if table_name in self._inet_tables:
+            affected.add(prefix)
+
+        # A change to something a protocol next hop resolves over means
+        # the BGP routes using that next hop need resolving again
+        if table_name in self._recursive_tables:
+            for pnh, prefixes in self._bgp_by_pnh.items():
+                if pnh in prefix:
+                    affected.update(prefixes)
+
+        return affected
+
+    def observe(self, evt):
+        if evt.event_type != EventType.ROUTE_CHANGE:
+            return
+
+        routing = self.router.routing
+        forwarding = self.router._forwarding
+
+        if isinstance(evt.object, RouteDelta):
+            changes = evt.object.changes()
+        else:
+            changes = [(evt.target, evt.object)]
+
+        # Several changes in a batch can touch the same prefix,
+        # only work each one out once
+        labels = set()
+        affected = set()
+        for table_name, route in changes:
+            if table_name == 'mpls':
+                labels.add(route.prefix)
+            else:
+                affected.update(self.affected_prefixes(table_name, route.prefix))
+
+        for label in labels:
+            forwarding.update_label(label, routing.mpls_forwarding_entry(label))
+
+        for prefix in affected:
+            forwarding.update_ip(prefix, routing.forwarding_entry(prefix))
+
+    def interface_up(self, interface):
+        """
+        Recompute whatever picks between routes (or a route and its
+        bypass) by whether their interfaces are up, as interface coming
+        up doesn't change any routes
+        """
+        routing = self.router.routing
+        forwarding = self.router._forwarding
+
+        for label, routes in routing.mpls.items():
+            route = routes[0] if len(routes) > 0 else None
+            if route is None:
+                continue
+            if route.interface is interface or (
+                    route.bypass is not None and route.bypass.interface is interface):
+                forwarding.update_label(label, routing.mpls_forwarding_entry(label))
+
+        # BGP routes resolve over whichever recursive route is up, so
+        # only those whose protocol next hop resolves over interface
+        # (or its bypass) can change
+        for pnh, prefixes in list(self._bgp_by_pnh.items()):
+            route = routing.recursive_lookup_ip(pnh)
+            if route is None:
+                continue
+            if route.interface is interface or (
+                    route.bypass is not None and route.bypass.interface is interface):
+                for prefix in prefixes:
+                    forwarding.update_ip(prefix, routing.forwarding_entry(prefix))
+
+
 class PacketListener:
     def __init__(self, router):
         self.router = router
@@ -109,8 +222,11 @@ class PacketListener:
 
         # Treat this as exception traffic
         # In "real life" the PFE would actuall see it first, so we're
-        # currently treating this listener as part of the PFE
-        if frame.dst == BROADCAST_MAC or frame.dst == logint.hw_address:
+        # currently treating this listener as part of the PFE.
+        # Labelled frames are only ever the PFE's business
+        if frame.type == FrameType.MPLSU:
+            self.router.pfe.process_frame(frame, source_interface=logint)
+        elif frame.dst == BROADCAST_MAC or frame.dst == logint.hw_address:
             self.router.process_frame(frame, logint)
         else:
             self.router.pfe.process_frame(frame, source_interface=logint)
@@ -120,28 +236,31 @@ class PacketListener:
 # a badass set of network cards (the fowrarding plane/packet fowarding engine)
 class Router(Server):
 
-    def __init__(self, hostname, loopback_address):
-        super().__init__(hostname)
+    def __init__(self, hostname, loopback_address, context=None, label_range=None):
+        """
+        label_range is the (first, last) labels this router hands out
+        """
+        super().__init__(hostname, context=context)
         self.loopback_address = loopback_address
-        self.arp = ArpHandler(self, self.event_manager, self.logger)
+        self.arp = ArpHandler(self, self.event_manager, self.logger, context=self.context)
         self.process = dict()
-        self.event_manager = EventManager(self.hostname)
+        self.event_manager = EventManager(self.hostname, self.context)
         self.routing = RoutingTables(evt_manager=self.event_manager, parent_logger=self.logger)
         self._forwarding = ForwardingTable(self.event_manager, self.logger)
         self.pfe = PacketForwardingEngine(self._forwarding, self)
         self.pingid = 0
 
         self.event_manager.listen(
-            '*', LoggingObserver(self.hostname, self.logger).observe)
+            '*', LoggingObserver(self.hostname, self.logger))
         self.event_manager.listen(
             EventType.LINK_STATE, RouteTableUpdater(self).observe)
         self.event_manager.listen(
             EventType.PACKET_RECV, PacketListener(self).observe)
 
+        self._forwarding.set_fib(self.routing.forwarding_table())
+        self._fib_updater = ForwardingTableUpdater(self)
         self.event_manager.listen(EventType.ROUTE_CHANGE,
-                                  lambda evt: self._forwarding.set_fib(
-                                      self.routing.forwarding_table())
-                                  )
+                                  self._fib_updater.observe)
 
         lo = self.add_physical_interface("lo").add_logical_interface(
             "lo.0", addresses={
@@ -151,10 +270,17 @@ class Router(Server):
         self.interfaces['lo'].state = ConnectionState.UP
         lo.state = ConnectionState.UP
 
+        if label_range is None:
+            # Start somewhere different on each router, so labels are
+            # easier to tell apart
+            label_range = (self.context.random.randint(100, 500), MAX_LABEL)
+        self.labels = LabelManager(*label_range)
+        self._forwarding.set_label_base(self.labels.first)
+
         self.process['rsvp'] = RsvpProcess(
-            self.event_manager, self, loopback_address)
+            self.event_manager, self, loopback_address, context=self.context)
         self.process['isis'] = IsisProcess(
-            self.event_manager, self.hostname, self.routing)
+            self.event_manager, self.hostname, self.routing, context=self.context)
 
         self.interfaces['lo.0'] = lo
 
@@ -191,7 +317,7 @@ class Router(Server):
         if super().process_packet(source_interface, packet):
             return True
 
-        if isinstance(packet.pdu, RSVPMessage):
+        if isinstance(packet.payload, RSVPMessage):
             return self.process['rsvp'].process_packet(source_interface, packet)
 
     def static_route(self, dest_prefix, gw_int):
@@ -226,11 +352,14 @@ class Router(Server):
         interface.send(dest_address, frame_type, pdu)
 
  
-    def create_lsp(self, lsp_name, dest_ip, link_protection=False):
+    def create_lsp(self, lsp_name, dest_ip, link_protection=False, constraints=None):
         """
         Kick off the logic to issue RSVP Path messages
         to build an LSP to the target IP
         Assumes access to IGP data
+
+        constraints (isis.ted.Constraints) limits the links the LSP
+        can be signalled over
         """
 
         # This create ERO based on the shortest-path
@@ -239,9 +368,17 @@ class Router(Server):
         self.process['rsvp'].create_session(
             dest_ip,
             lsp_name,
-            link_protection=link_protection
+            link_protection=link_protection,
+            constraints=constraints
         )
 
+    def delete_lsp(self, lsp_name):
+        """
+        Tear down an LSP set up with create_lsp, giving back the labels
+        it was using along the way
+        """
+        self.process['rsvp'].delete_session(lsp_name)
+
     def show_route_table(self):
         print(f"### {self.hostname} routes ###")
         self.routing.print_routes()
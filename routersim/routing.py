@@ -1,12 +1,17 @@
 from enum import Enum
 from collections import ChainMap, OrderedDict
+from contextlib import contextmanager
 from .observers import Event, EventType
 from .messaging import FrameType
 from .mpls import LabelStackOperation, CombinedAction
+from .lpm import PrefixTable
 from copy import copy, deepcopy
 import ipaddress
 
 
+DEFAULT_ROUTE = ipaddress.ip_network("0.0.0.0/0")
+
+
 class RouteType(Enum):
     LOCAL = 1
     CONNECTED = 2
@@ -112,10 +117,73 @@ class RSVPRoute(Route):
         self.action = action
         self.bypass = None
 
+    def __eq__(self, other):
+        # Several LSPs can go the same way to the same place, deleting
+        # one mustn't take out another's route
+        if not super().__eq__(other):
+            return False
+        return self.lsp_name == getattr(other, 'lsp_name', None)
+
     def __str__(self):
         return f"\t[{self.type}/{self.metric}] to {self.next_hop_ip} via {self.interface}, label-switched-path {self.lsp_name}, {self.action}"
 
 
+class RouteDelta:
+    """
+    The routes added and deleted during a RoutingTables.batch(), carried
+    as the object of the ROUTE_CHANGE events the batch emits
+    """
+
+    def __init__(self):
+        # lists of (table_name, route)
+        self.added = []
+        self.deleted = []
+
+    def __len__(self):
+        return len(self.added) + len(self.deleted)
+
+    def changes(self):
+        for table_name, route in self.deleted:
+            yield table_name, route
+        for table_name, route in self.added:
+            yield table_name, route
+
+    def tables(self):
+        """
+        Names of the tables changed, in the order they were first changed
+        """
+        return list(dict.fromkeys(table_name for table_name, _ in self.changes()))
+
+    def for_table(self, table_name):
+        delta = RouteDelta()
+        delta.added = [entry for entry in self.added if entry[0] == table_name]
+        delta.deleted = [entry for entry in self.deleted if entry[0] == table_name]
+        return delta
+
+    def __str__(self):
+        return f"{len(self.added)} added, {len(self.deleted)} deleted"
+
+    def seq_note(self):
+        note = ""
+        for table_name, route in self.deleted:
+            note += f"- {table_name} {route.prefix}\n"
+        for table_name, route in self.added:
+            note += f"+ {table_name} {route.prefix} via {route.next_hop_ip}\n"
+        return note
+
+
+def _same_routes(existing, new_routes):
+    # Route equality ignores the next hop, but a change of next hop
+    # still has to make it to the FIB
+    if len(existing) != len(new_routes):
+        return False
+    for route in new_routes:
+        if not any(route == other and route.next_hop_ip == other.next_hop_ip
+                   for other in existing):
+            return False
+    return True
+
+
 class RoutingTables:
 
     def __init__(self, evt_manager=None, parent_logger=None):
@@ -157,9 +225,69 @@ class RoutingTables:
             self.tables['mpls']
         )
 
+        # Longest-match indexes over the prefixes present in each chain,
+        # kept up to date as routes come and go. The value is the number
+        # of tables in the chain which currently hold the prefix
+        self._indexes = {}
+        # table name -> indexes of the chains it is part of
+        self._table_indexes = {name: [] for name in self.tables}
+        for chain in (self.inet, self.inet3, self.recursive):
+            index = PrefixTable()
+            self._indexes[id(chain)] = index
+            for name, table in self.tables.items():
+                if any(table is member for member in chain.maps):
+                    self._table_indexes[name].append(index)
+
+        # Set while inside batch()
+        self._delta = None
+        self._batch_depth = 0
+        self._batch_src = None
+
     def __str__(self):
         return "routing"
 
+    @contextmanager
+    def batch(self, src=None):
+        """
+        Group route changes so they are announced as one ROUTE_CHANGE
+        event (sub_type ROUTES_CHANGED) per table changed, carrying a
+        RouteDelta of that table's changes, rather than one event per
+        route. As for a single route, target is the table name:
+
+            with routing.batch():
+                routing.add_route(...)
+                routing.del_route(...)
+
+        Batches can be nested, the events go out when the outermost ends
+        """
+        if self._batch_depth == 0:
+            self._delta = RouteDelta()
+            self._batch_src = src
+        self._batch_depth += 1
+
+        try:
+            yield self._delta
+        finally:
+            self._batch_depth -= 1
+            if self._batch_depth == 0:
+                delta = self._delta
+                src = self._batch_src
+                self._delta = None
+                self._batch_src = None
+
+                for table_name in delta.tables():
+                    self.__announce(delta.for_table(table_name), table_name, src)
+
+    def __announce(self, delta, table_name, src):
+        self.event_manager.observe(
+            Event(
+                EventType.ROUTE_CHANGE,
+                src if src is not None else self,
+                lambda: f"Updated {table_name} routes: {delta}",
+                object=delta,
+                sub_type='ROUTES_CHANGED',
+                target=table_name))
+
     def table(self, table_name):
         return self.tables[table_name]
 
@@ -179,37 +307,41 @@ class RoutingTables:
     # For now not assuming ECMP, but thinking will do that via a
     # sub-class called ECMPRoute
     def set_routes(self, routes, table_name, src=None):
-        # This is super inefficient, but I like to first
-        # write things in a way that makes sense to me
+        """
+        Make table_name hold exactly routes. Only prefixes whose routes
+        actually differ are touched, so re-setting an unchanged table
+        doesn't generate any ROUTE_CHANGE events
+        """
         table = self.tables[table_name]
 
-        # In the case that we are setting the whole thing,
-        # we can just clear it
-        table.clear()
-
-        visited = {}
+        wanted = {}
         for route in routes:
-            prefix = route.prefix
+            wanted.setdefault(route.prefix, []).append(route)
 
-            if prefix not in table:
-                self.add_route(route, table_name, src=src)
-            else:
-                if route in table[prefix]:
-                    pass
-                else:
-                    # hm, should probably just provide mechanism to delete
-                    # by the prefix
-                    self.del_routes(table[prefix], table_name, src=src)
-                    self.add_route(route, table_name, src=src)
+        with self.batch(src=src):
+            self.replace_routes(wanted, table_name, src=src)
 
-            visited[prefix] = True
+            for prefix in [prefix for prefix in table if prefix not in wanted]:
+                self.del_routes(copy(table[prefix]), table_name, src=src)
 
-        prefixes = list(table.keys())
-        for prefix in prefixes:
-            if prefix not in visited:
-                routes = copy(table[prefix])
-                for route in routes:
-                    self.del_route(route, table_name)
+    def replace_routes(self, routes_by_prefix, table_name, src=None):
+        """
+        Make each prefix in routes_by_prefix hold exactly the given
+        routes (an empty list removes the prefix), leaving every other
+        prefix in table_name alone
+        """
+        table = self.tables[table_name]
+
+        with self.batch(src=src):
+            for prefix, new_routes in routes_by_prefix.items():
+                existing = table.get(prefix)
+                if existing is not None:
+                    if _same_routes(existing, new_routes):
+                        continue
+                    self.del_routes(copy(existing), table_name, src=src)
+
+                for route in new_routes:
+                    self.add_route(route, table_name, src=src)
 
     def del_routes(self, routes, table_name, src=None):
         for route in routes:
@@ -225,12 +357,17 @@ class RoutingTables:
 
             if len(table[prefix]) == 0:
                 del table[prefix]
+                self._unindex(prefix, table_name)
+
+            if self._delta is not None:
+                self._delta.deleted.append((table_name, route))
+                return
 
             self.event_manager.observe(
                 Event(
                     EventType.ROUTE_CHANGE,
                     src if src is not None else self,
-                    f"Deleted {route.type} route to {route.prefix}",
+                    lambda: f"Deleted {route.type} route to {route.prefix}",
                     object=route,
                     sub_type='ROUTE_DELETED',
                     target=table_name))
@@ -248,23 +385,24 @@ class RoutingTables:
 
         if prefix not in self.tables[table]:
             self.tables[table][prefix] = [route]
-
-            # May support ECMP route later
-            self.event_manager.observe(
-                Event(
-                    EventType.ROUTE_CHANGE,
-                    src if src is not None else self,
-                    f"Added {route.type} route to {route.prefix} via {route.next_hop_ip}",
-                    object=route,
-                    sub_type='ROUTE_ADDED',
-                    target=table))
-
-            if table == 'mpls':
-                return
+            self._index(prefix, table)
         else:
             self.tables[table][prefix].append(route)
+            self.tables[table][prefix].sort(key=lambda x: x.metric)
+
+        if self._delta is not None:
+            self._delta.added.append((table, route))
+            return
 
-        self.tables[table][prefix].sort(key=lambda x: x.metric)
+        # May support ECMP route later
+        self.event_manager.observe(
+            Event(
+                EventType.ROUTE_CHANGE,
+                src if src is not None else self,
+                lambda: f"Added {route.type} route to {route.prefix} via {route.next_hop_ip}",
+                object=route,
+                sub_type='ROUTE_ADDED',
+                target=table))
 
 
     # Return from one of the tables which can be used to
@@ -275,12 +413,49 @@ class RoutingTables:
     def recursive_lookup_ip(self, ip_address):
         return self.lookup_ip(ip_address, chain=self.recursive)
 
+    def _index(self, prefix, table_name):
+        for index in self._table_indexes[table_name]:
+            index[prefix] = index.get(prefix, 0) + 1
+
+    def _unindex(self, prefix, table_name):
+        for index in self._table_indexes[table_name]:
+            count = index.get(prefix, 0) - 1
+            if count > 0:
+                index[prefix] = count
+            elif prefix in index:
+                del index[prefix]
+
     def lookup_ip(self, ip_address, chain=None):
         # Right now this is exactly the same as the FIB lookup
         # Need to think about if this makes sense
         if chain is None:
             chain = self.inet
 
+        index = self._indexes.get(id(chain))
+        if index is None:
+            return self._scan_lookup_ip(ip_address, chain)
+
+        match = index.lookup_prefix(ip_address)
+        if match is None:
+            return None
+
+        return self._chain_route(chain, match[0])
+
+    def _chain_route(self, chain, prefix):
+        if isinstance(chain[prefix], list):
+            route = chain[prefix][0]
+        else:
+            route = chain[prefix]
+
+        route = copy(route)
+        if route.recursive is not None:
+            route.interface = route.recursive.interface
+
+        # NOTE: This doesn't apply LSPs
+        return route
+
+    # Used for chains we don't keep an index for
+    def _scan_lookup_ip(self, ip_address, chain):
         prefixes = set()
         for table in chain.maps:
             #        for table_name in self.tables:
@@ -300,20 +475,9 @@ class RoutingTables:
 
         as_network = ipaddress.ip_network(ip_address)
 
-        route = None
         for prefix in prefixes:
             if as_network.overlaps(prefix):
-                if isinstance(chain[prefix], list):
-                    route = chain[prefix][0]
-                else:
-                    route = chain[prefix]
-
-                route = copy(route)
-                if route.recursive is not None:
-                    route.interface = route.recursive.interface
-                        
-                # NOTE: This doesn't apply LSPs
-                return route
+                return self._chain_route(chain, prefix)
 
         return None
 
@@ -365,6 +529,66 @@ class RoutingTables:
                         elif route.interface.is_up():
                             print(route)
 
+    # Generate the forwarding entry for a single prefix, based on
+    # the best route we have for it (if any)
+    def forwarding_entry(self, prefix):
+        entry = None
+        for route in self.inet.get(prefix, []):
+
+            if route.type == RouteType.LOCAL:
+                # TODO: We could also install it to send out over a
+                #  private special interface
+                # .. which is really where we are moving to
+                return ForwardingEntry(
+                    prefix, route.interface, action='CONTROL')
+            elif route.type == RouteType.BGP:
+                recursive_route = self.recursive_lookup_ip(route.protocol_next_hop)
+                if recursive_route is None:
+                    self.logger.info(f"Unable to lookup pnh for {route}, will be hiding")
+                    continue
+
+                if recursive_route.interface.is_up():
+                    return ForwardingEntry(
+                        prefix,
+                        recursive_route.interface, recursive_route.action,
+                        next_hop_ip=recursive_route.next_hop_ip
+                        )
+                elif recursive_route.bypass is not None and recursive_route.bypass.interface.is_up():
+                    # Still look to see if there is something better
+                    entry = ForwardingEntry(
+                        prefix, recursive_route.bypass.interface,
+                            CombinedAction([recursive_route.action, recursive_route.bypass.action]),
+                            next_hop_ip=recursive_route.bypass.next_hop_ip)
+            else:
+                return ForwardingEntry(prefix, route.interface, next_hop_ip=route.next_hop_ip)
+
+        if entry is None and prefix == DEFAULT_ROUTE:
+            # now add a default UNREACHABLE
+            entry = ForwardingEntry(DEFAULT_ROUTE, None, action='REJECT')
+
+        return entry
+
+    def mpls_forwarding_entry(self, label):
+        routes = self.mpls.get(label)
+        if routes is None or len(routes) == 0:
+            return None
+
+        route = routes[0]
+        action = route.action
+
+        iface = route.interface
+        next_hop_ip = route.next_hop_ip
+        if route.interface is None:
+            print(route)
+        if not route.interface.is_up() and route.bypass is not None:
+            action = CombinedAction([route.action, route.bypass.action])
+            iface = route.bypass.interface
+            next_hop_ip = route.bypass.next_hop_ip
+
+        return ForwardingEntry(
+            label, iface, action=action, next_hop_ip=next_hop_ip
+        )
+
     # Generate the forwarding table, by taking a single
     # instance of each prefix
 
@@ -377,9 +601,7 @@ class RoutingTables:
         ipfib = fib[FrameType.IPV4]
         mplsfib = fib[FrameType.MPLSU]
 
-        have_default = False
-        default = ipaddress.ip_network("0.0.0.0/0")
-        prefixes = set()
+        prefixes = set([DEFAULT_ROUTE])
 #        for table_name in self.tables:
         for table in self.inet.maps:
             prefixes.update(table.keys())
@@ -397,61 +619,11 @@ class RoutingTables:
         prefixes.reverse()
 
         for prefix in prefixes:
-            if prefix == default:
-                have_default = True
-
-            applied_prefix = False
-            for route in self.inet.get(prefix):
-
-                if route.type == RouteType.LOCAL:
-                    # TODO: We could also install it to send out over a
-                    #  private special interface
-                    # .. which is really where we are moving to
-                    ipfib[prefix] = ForwardingEntry(
-                        prefix, route.interface, action='CONTROL')
-                    applied_prefix = True
-                elif route.type == RouteType.BGP:
-                    recursive_route = self.recursive_lookup_ip(route.protocol_next_hop)
-                    if recursive_route is None:
-                        self.logger.info(f"Unable to lookup pnh for {route}, will be hiding")
-                        continue
-                        
-                    if recursive_route.interface.is_up():
-                        ipfib[prefix] = ForwardingEntry(
-                            prefix,
-                            recursive_route.interface, recursive_route.action,
-                            next_hop_ip=recursive_route.next_hop_ip
-                            )
-                        applied_prefix = True
-                    elif recursive_route.bypass is not None and recursive_route.bypass.interface.is_up():
-                        ipfib[prefix] = ForwardingEntry(
-                            prefix, recursive_route.bypass.interface,
-                                CombinedAction([recursive_route.action, recursive_route.bypass.action]))
-                else:
-                    ipfib[prefix] = ForwardingEntry(prefix, route.interface, next_hop_ip=route.next_hop_ip)
-                    applied_prefix = True
-
-                # This route isn't hidden
-                if applied_prefix:
-                    break
-
-        if not have_default:
-            # now add a default UNREACHABLE
-            ipfib[default] = ForwardingEntry(default, None, action='REJECT')
+            entry = self.forwarding_entry(prefix)
+            if entry is not None:
+                ipfib[prefix] = entry
 
         for label in self.mpls:
-            route = self.mpls[label][0]
-
-            action = route.action
-
-            iface = route.interface
-            if route.interface is None:
-                print(route)
-            if not route.interface.is_up() and route.bypass is not None:
-                action = CombinedAction([route.action, route.bypass.action])
-                iface = route.bypass.interface
+            mplsfib[label] = self.mpls_forwarding_entry(label)
 
-            mplsfib[label] = ForwardingEntry(
-                label, iface, action=action
-            )
         return fib
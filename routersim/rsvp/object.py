@@ -63,6 +63,17 @@ class FilterSpec:
         return f"Filter: {self.address}/lsp={self.lsp_id}"
 
 
+class MessageId:
+    # RFC 2961 MESSAGE_ID, which stays the same for as long as the
+    # message it was sent with is just being refreshed
+    def __init__(self, epoch: int, message_id: int):
+        self.epoch = epoch
+        self.message_id = message_id
+
+    def __str__(self):
+        return f"Message ID: {self.epoch}/{self.message_id}"
+
+
 class Label:
     def __init__(self, label: int):
         self.label = label
@@ -15,6 +15,7 @@ class Path(RSVPMessage):
         # for IpV4 services
         self.explicit_route = []
         self.record_route = []
+        self.message_id = None
 
     def set_hop(self, hop_address):
         self.hop = RsvpHop(hop_address)
@@ -48,8 +49,26 @@ class PathErr(RSVPMessage):
         pass
 
 class PathTear(RSVPMessage):
-    def __init__(self):
-        pass
+    """
+    Sent along the path of an LSP which is going away, so each hop
+    removes its state (and gives back its label) without waiting for
+    it to time out
+    """
+
+    def __init__(self, session: Session, sender: IPV4SenderTemplate):
+        self.session = session
+        self.sender = sender
+
+    def set_hop(self, hop_address):
+        self.hop = RsvpHop(hop_address)
+
+    def __str__(self):
+        return f"RSVP PathTear"
+
+    def key(self):
+        return (str(self.session.dest_ip),
+                str(self.session.tunnel_id),
+                str(self.sender.lsp_id))
 
 
 class Resv(RSVPMessage):
@@ -61,6 +80,7 @@ class Resv(RSVPMessage):
         self.label = None
         self.explicit_route = []
         self.record_route = []
+        self.message_id = None
 
     def set_hop(self, hop_address):
         self.hop = RsvpHop(hop_address)
@@ -92,6 +112,51 @@ class Resv(RSVPMessage):
         return mystring
 
 
+class Srefresh(RSVPMessage):
+    """
+    RFC 2961 summary refresh: the MESSAGE_IDs of Path and Resv
+    messages being refreshed, in place of the messages themselves
+    """
+
+    def __init__(self, message_ids):
+        self.message_ids = message_ids
+
+    def __str__(self):
+        return f"RSVP Srefresh ({len(self.message_ids)})"
+
+    def seq_note(self):
+        return f"Refresh {' '.join([str(m.message_id) for m in self.message_ids])}"
+
+
+class Ack(RSVPMessage):
+    """
+    RFC 2961 ACK, only used for the MESSAGE_ID_NACKs of Srefreshes we
+    had no state for, which the sender answers with the full messages
+    """
+
+    def __init__(self, acks=None, nacks=None):
+        self.acks = acks if acks is not None else []
+        self.nacks = nacks if nacks is not None else []
+
+    def __str__(self):
+        return f"RSVP Ack"
+
+
+class Bundle(RSVPMessage):
+    """
+    RFC 2961 bundle, several messages for the same neighbor sent as one
+    """
+
+    def __init__(self, messages):
+        self.messages = messages
+
+    def __str__(self):
+        return f"RSVP Bundle ({len(self.messages)})"
+
+    def seq_note(self):
+        return "\n".join([str(message) for message in self.messages])
+
+
 class ResvTear(RSVPMessage):
     def __init__(self):
         pass
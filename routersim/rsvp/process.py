@@ -1,16 +1,17 @@
-from ..mpls import PopStackOperation, PushStackOperation, ReplaceStackOperation
-from .object import IPV4SenderTemplate, Session, LSPTunnelSessionAttribute, FilterSpec
-from .pdu import Path, Resv
+from ..mpls import PopStackOperation, PushStackOperation, ReplaceStackOperation, IMPLICIT_NULL
+from .object import IPV4SenderTemplate, Session, LSPTunnelSessionAttribute, FilterSpec, MessageId
+from .pdu import Path, PathTear, Resv, Srefresh, Ack, Bundle
 from copy import copy, deepcopy
-from ..observers import GlobalQueueManager, Event, EventType
-from ..messaging import IPProtocol
+from ..observers import Event, EventType
+from ..messaging import IPProtocol, clone
+from ..packets import ipv4, router_alert
 from ..routing import RSVPRoute, RouteType
-import random
+from ..isis.ted import NO_CONSTRAINTS
+from ..timerwheel import TimerWheel
+from collections import Counter
 import pprint
 import functools
-import sys
 from ipaddress import IPv4Address, ip_network
-from scapy.layers.inet import IP,IPOption_Router_Alert
 
 # https://www.juniper.net/documentation/en_US/release-independent/nce/topics/example/mpls-lsp-link-protect-solutions.html
 # https://www.juniper.net/documentation/en_US/release-independent/nce/topics/concept/mpls-lsp-node-link-protect-overview-solutions.html
@@ -28,6 +29,29 @@ class PathStateBlock():
         self.type = type
         self.bypassed = bypassed
         self.route = None
+        # Next hop we asked for a bypass round, when local repair
+        # was requested
+        self.repair_ip = None
+
+        # Key into path_state
+        self.key = None
+        # What we send to keep the state alive downstream (Path) and
+        # upstream (Resv), as (packet, interface, neighbor address)
+        self.path_out = None
+        self.resv_out = None
+        # When the state times out unless the neighbor upstream (Path)
+        # or downstream (Resv) refreshes it
+        self.path_expires = None
+        self.resv_expires = None
+        self.resv_key = None
+        # The label we installed for it on a transit router
+        self.label_route = None
+        self.refresh_timer = None
+        self.cleanup_timer = None
+        # Message ids we've sent and (neighbor, epoch, id) we've been
+        # sent for this state
+        self.sent_ids = []
+        self.received_ids = []
 
 
 class ResvStateBlock():
@@ -39,13 +63,16 @@ class ResvStateBlock():
 
 
 class RsvpSession:
-    def __init__(self, source_ip, dest_ip, lsp_name, lsp_id, protected_ip=None):
+    def __init__(self, source_ip, dest_ip, lsp_name, lsp_id, protected_ip=None,
+                 constraints=None):
         self.source_ip = source_ip
         self.dest_ip = dest_ip
         self.lsp_name = lsp_name
         self.last_send = 0
         self.lsp_id = lsp_id
         self.protected_ip = protected_ip
+        # isis.ted.Constraints the path has to satisfy
+        self.constraints = constraints
 
         self.session = Session.newSession(dest_ip, source_ip)
         self.paths = []
@@ -60,9 +87,12 @@ class RsvpSession:
 
 class RsvpProcess:
 
-    def __init__(self, event_manager, router, source_ip):
+    def __init__(self, event_manager, router, source_ip, context=None):
         self.event_manager = event_manager
         self.router = router
+        if context is None:
+            context = router.context
+        self.context = context
         self.source_ip = source_ip
         self.started = False
         self.path_state = {}
@@ -70,29 +100,80 @@ class RsvpProcess:
         self.logger = self.router.logger.getChild("rsvp")
         self.lsp_id = 1
 
-        self.current_label = random.randint(100, 500)
-
         # set of known sessions requestev via Path messages
         self.sessions = []
+        self._sessions_by_name = {}
+        # Sessions we haven't managed to send a Path message for yet
+        self._unsignalled = []
+
+        # (dest_ip, tunnel_id, sender address, sender lsp_id) -> PSB,
+        # which is what a Resv's session and filter pick out
+        self._psb_by_sender = {}
+        # protected address -> PSB of the bypass LSP around it
+        self._bypass_by_ip = {}
+        # next hop address -> (table name, route) we've installed via it
+        self._routes_by_next_hop = {}
+        # protected address -> keys of the PSBs wanting a bypass round it
+        self._repair_requests = {}
+
+        # Soft state (RFC 2205 3.7): we refresh state every
+        # refresh_interval ms (+-50%), and it times out if the neighbor
+        # doesn't refresh it for (keep_multiplier + 0.5) * 1.5 times that
+        self.refresh_interval = 30 * 1000
+        self.keep_multiplier = 3
+        self.timers = TimerWheel(context, tick=1000, owner=self)
+
+        # RFC 2961 refresh reduction. Neighbors which send us MESSAGE_IDs
+        # get Srefreshes in place of unchanged Path and Resv messages,
+        # and whatever else is going their way bundled together
+        self.refresh_reduction = False
+        self.epoch = 1
+        self._message_id = 0
+        # message id -> (psb, 'path' or 'resv') we sent it with
+        self._sent_ids = {}
+        # (neighbor, epoch, message id) -> (psb, 'path' or 'resv')
+        self._received_ids = {}
+        self._rr_neighbors = set()
+        # (interface, neighbor address) -> packets and message ids
+        # waiting to be sent there
+        self._outbox = {}
+        # (interface, neighbor address) -> message id number -> MessageId
+        # of the state we refresh there with a single Srefresh
+        self._summaries = {}
+
+        # Messages sent and received, by type. Bundles count both as a
+        # Bundle and as each of the messages in them
+        self.sent = Counter()
+        self.received = Counter()
+        self.packets_sent = 0
 
     def __refresh_paths(self):
         if not self.started:
             return
 
-        for session in self.sessions:
+        unsignalled = self._unsignalled
+        self._unsignalled = []
+        for session in unsignalled:
             path_msg = session.paths[0]
             exclude_ip = session.protected_ip
 
             psb = self.path_state.get(path_msg.key())
             if psb is None:
                 # For now we aren't really doing refreshes
-                ero = self.shortest_path(session.dest_ip, exclude_ip=exclude_ip)
+                ero = self.shortest_path(session.dest_ip, exclude_ip=exclude_ip,
+                                         constraints=session.constraints)
                 if ero is None or len(ero) == 0:
                     self.logger.warn(f"No path available for {path_msg.attributes.name} from {self.router.hostname}")
+                    self._unsignalled.append(session)
                     continue
                 else:
                     route = self.router.routing.lookup_ip(ero[0])
 
+                # Could be signalling it again after it timed out, while
+                # the last attempt is still queued somewhere
+                path_msg = copy(path_msg)
+                path_msg.explicit_route = []
+                path_msg.record_route = []
                 for entry in ero:
                     path_msg.add_explicit(entry)
 
@@ -100,11 +181,11 @@ class RsvpProcess:
                 path_msg.add_record(route.interface.address().ip)
 
 
-                packet = IP(
+                packet = ipv4(
                     dst=session.dest_ip,
                     src=session.source_ip,
-                    protocol=IPProtocol.RESV,
-                    options=IPOption_Router_Alert(),
+                    proto=IPProtocol.RSVP,
+                    options=router_alert(),
                 ) / path_msg
 
                 #packet = IPPacket(session.dest_ip,
@@ -118,251 +199,365 @@ class RsvpProcess:
                 type = 'standard'
                 if exclude_ip is not None:
                     type = 'bypass'
-                self.path_state[path_msg.key()] = PathStateBlock(path_msg, type=type, bypassed=exclude_ip)
-                self.router.send_ip(packet, source_interface=route.interface)
-
-    def create_session(self, dest_ip, lsp_name, link_protection=False, protected_ip=None):
-
-        for session in self.sessions:
-            if session.lsp_name == lsp_name:
-                self.logger.info(f"Alreday have {lsp_name}, stopping")
-                return session
-
-        self.lsp_id = self.lsp_id + 1
-        session = RsvpSession(self.source_ip, dest_ip, lsp_name, self.lsp_id, protected_ip=protected_ip)
-        session.paths[0].attributes.local_repair = link_protection
-
-        self.sessions.append(session)
-
-        self.__refresh_paths()
-        return session
-
-
-    def shortest_path(self, dest_ip, exclude_ip=None):
-        self.logger.info(f"SFP Starting for {dest_ip}, excluding {exclude_ip}")
-        originaldb = self.router.process['isis'].database
-        ted = {}
-        # For now, we're using the isis process
-        # for our source for the TED
-        # This would run a Constrained Shortest Path First
-        # in case that there were other constraints in play
-        # Really want to have it avoid the ISIS-specific stuff
-
-        # The final calculated distance to each prefix
-        distance = {}
-
-        # Calculated distance to each system, most useful for debugging
-        system_distance = {}
-
-        # linked list of paths from the destination back to us
-        prev = {}
-
-        # linked list of paths from another system back to us over shortest path
-        prev_system = {}
-
-        # Remaining LSPs we need to process
-        queue = []
-
-        # https://en.wikipedia.org/wiki/Dijkstra%27s_algorithm
-        dbvalues = sorted(
-            originaldb.values(),
-            key=lambda lsp: lsp.pdu.source_address)
-
-        for wrapper in dbvalues:
-            lsp = wrapper.pdu
-
-            router_id = lsp.routerid
-            ted[router_id] = lsp
-
-#            entry_node = lsp.source_address
-            entry_node = router_id
-            # Note the shortcut we're taking of treating the lsp_id as the system_id
-            system_distance[entry_node] = sys.maxsize
-            prev_system[entry_node] = None
-            # queue.append(lsp.source_address)
-            queue.append(router_id)
-
-        #system_id = self.router.process['isis'].system_id
-        system_distance[self.source_ip] = 0
-
-        done = False
-        while len(queue) > 0 and not done:
-
-            # find shortest element
-            min_idx = 0
-            min_dist = sys.maxsize
-            for i in range(len(queue)):
-                if system_distance[queue[i]] < min_dist:
-                    min_idx = i
-                    min_dist = system_distance[queue[i]]
+                psb = PathStateBlock(path_msg, type=type, bypassed=exclude_ip)
+                self.__store_path_state(path_msg.key(), psb)
+                self.__assign_message_id(path_msg, psb, 'path')
+                psb.path_out = (packet, route.interface, ero[0])
+                self.__send(packet, route.interface, ero[0])
+                self.__start_refreshing(psb)
+
+    def __store_path_state(self, key, psb):
+        psb.key = key
+        self.path_state[key] = psb
+        self._psb_by_sender[(psb.session.dest_ip, psb.session.tunnel_id,
+                             psb.sender.address, psb.sender.lsp_id)] = psb
+        if psb.bypassed is not None:
+            self._bypass_by_ip[psb.bypassed] = psb
+
+    def __install_route(self, route, table_name):
+        self.router.routing.add_route(route, table_name)
+        self._routes_by_next_hop.setdefault(route.next_hop_ip, []).append((table_name, route))
+
+    def __send(self, packet, interface=None, next_hop=None):
+        payload = packet.payload
+        self.packets_sent += 1
+        self.sent[type(payload).__name__] += 1
+        if isinstance(payload, Bundle):
+            for message in payload.messages:
+                self.sent[type(message).__name__] += 1
+        self.router.send_ip(packet, source_interface=interface, next_hop=next_hop)
+
+    def __assign_message_id(self, message, psb, kind):
+        if not self.refresh_reduction:
+            # Don't pass on whatever we were sent
+            message.message_id = None
+            return
+        self._message_id += 1
+        message.message_id = MessageId(self.epoch, self._message_id)
+        self._sent_ids[self._message_id] = (psb, kind)
+        psb.sent_ids.append(self._message_id)
 
-            node = queue.pop(min_idx)
+    def __note_message_id(self, message_id, neighbor, psb, kind):
+        if message_id is None:
+            return
+        self._rr_neighbors.add(neighbor)
+        key = (neighbor, message_id.epoch, message_id.message_id)
+        if key not in self._received_ids:
+            self._received_ids[key] = (psb, kind)
+            psb.received_ids.append(key)
+
+    def __lifetime(self):
+        return (self.keep_multiplier + 0.5) * 1.5 * self.refresh_interval
+
+    def __refreshed(self, psb, kind):
+        lifetime = self.__lifetime()
+        if kind == 'path':
+            psb.path_expires = self.context.now() + lifetime
+        else:
+            psb.resv_expires = self.context.now() + lifetime
+        if psb.cleanup_timer is None:
+            psb.cleanup_timer = self.timers.schedule(
+                lifetime, self.__check_state, (psb,))
+
+    def __start_refreshing(self, psb):
+        if psb.refresh_timer is None:
+            psb.refresh_timer = self.timers.schedule(
+                self.__refresh_delay(), self.__refresh_state, (psb,))
+
+    def __refresh_delay(self):
+        return self.context.random.randint(
+            self.refresh_interval // 2, self.refresh_interval * 3 // 2)
+
+    def __refresh_state(self, psb):
+        if self.path_state.get(psb.key) is not psb:
+            return
 
-            self.logger.info(f"SPF processing {node}")
-            lsp = ted[node]
+        psb.refresh_timer = None
+        resend = False
+        for out in (psb.path_out, psb.resv_out):
+            if out is None:
+                continue
+            packet, interface, neighbor = out
+            message_id = packet.payload.message_id
+            if message_id is not None and neighbor in self._rr_neighbors:
+                # Refreshed along with everything else for the neighbor
+                self.__summarize(interface, neighbor, message_id)
+            else:
+                self.__queue(interface, neighbor, packet)
+                resend = True
+
+        if resend:
+            psb.refresh_timer = self.timers.schedule(
+                self.__refresh_delay(), self.__refresh_state, (psb,))
+
+    def __summarize(self, interface, neighbor, message_id):
+        key = (interface, neighbor)
+        summary = self._summaries.get(key)
+        if summary is None:
+            summary = self._summaries[key] = {}
+            self.timers.schedule(
+                self.__refresh_delay(), self.__send_summary, (key,))
+        summary[message_id.message_id] = message_id
+
+    def __send_summary(self, key):
+        summary = self._summaries[key]
+        # Forget about anything which has gone away since
+        for number in [number for number in summary if number not in self._sent_ids]:
+            del summary[number]
+        if len(summary) == 0:
+            del self._summaries[key]
+            return
 
-            neighbors = lsp.neighbors
+        interface, neighbor = key
+        for message_id in summary.values():
+            self.__queue(interface, neighbor, message_id)
+        self.timers.schedule(
+            self.__refresh_delay(), self.__send_summary, (key,))
+
+    def __queue(self, interface, neighbor, item):
+        # Everything due on the same timer tick goes out together
+        if len(self._outbox) == 0:
+            self.context.enqueue(0, self.__flush)
+        self._outbox.setdefault((interface, neighbor), []).append(item)
+
+    def __flush(self):
+        outbox = self._outbox
+        self._outbox = {}
+        for (interface, neighbor), items in outbox.items():
+            if not interface.is_up():
+                # Whatever we had there will time out
+                continue
+            packets = [item for item in items if not isinstance(item, MessageId)]
+            message_ids = [item for item in items if isinstance(item, MessageId)]
+
+            if not self.refresh_reduction or (len(packets) == 1 and len(message_ids) == 0):
+                for packet in packets:
+                    self.__send(packet, interface, neighbor)
+                continue
+
+            messages = [packet.payload for packet in packets]
+            if len(message_ids) > 0:
+                messages.append(Srefresh(message_ids))
+            message = messages[0] if len(messages) == 1 else Bundle(messages)
+            self.__send(ipv4(
+                dst=neighbor,
+                src=interface.address().ip,
+                proto=IPProtocol.RSVP) / message, interface)
 
-            for neigh in neighbors:
-                og_neigh_id = neigh.system_id
-                neigh_id = originaldb[og_neigh_id].pdu.routerid
+    def __check_state(self, psb):
+        psb.cleanup_timer = None
+        if self.path_state.get(psb.key) is not psb:
+            return
 
-                if neigh_id == self.source_ip:
-                    self.logger.info(f"Skipping self neighbor")
+        now = self.context.now()
+        deadlines = [expires for expires in (psb.path_expires, psb.resv_expires)
+                     if expires is not None]
+        if min(deadlines) <= now:
+            self.event_manager.observe(Event(
+                EventType.RSVP, self, f"State for {psb.attributes.name} timed out", object=psb, sub_type="STATE_TIMEOUT"))
+            self.__remove_state(psb)
+            return
+        psb.cleanup_timer = self.timers.schedule(
+            min(deadlines) - now, self.__check_state, (psb,))
+
+    def __remove_state(self, psb):
+        del self.path_state[psb.key]
+        sender_key = (psb.session.dest_ip, psb.session.tunnel_id,
+                      psb.sender.address, psb.sender.lsp_id)
+        if self._psb_by_sender.get(sender_key) is psb:
+            del self._psb_by_sender[sender_key]
+        if psb.bypassed is not None and self._bypass_by_ip.get(psb.bypassed) is psb:
+            del self._bypass_by_ip[psb.bypassed]
+            self.__unprotect(psb)
+        for key in psb.received_ids:
+            self._received_ids.pop(key, None)
+        for message_id in psb.sent_ids:
+            self._sent_ids.pop(message_id, None)
+        if psb.resv_key is not None:
+            self.resv_state.pop(psb.resv_key, None)
+        if psb.refresh_timer is not None:
+            psb.refresh_timer.cancel()
+
+        installed = [('mpls', psb.label_route)]
+        if psb.type == 'standard':
+            installed.append(('rsvp', psb.route))
+        for table_name, route in installed:
+            if route is None:
+                continue
+            self.router.routing.del_route(route, table_name)
+            routes = self._routes_by_next_hop.get(route.next_hop_ip, [])
+            routes[:] = [entry for entry in routes if entry[1] is not route]
+            if len(routes) == 0:
+                self._routes_by_next_hop.pop(route.next_hop_ip, None)
+        if psb.label_route is not None:
+            self.router.labels.release(psb.label_route.prefix)
+
+        if psb.sender.address == self.source_ip:
+            # One of ours, so try setting it up again
+            session = self._sessions_by_name.get(psb.attributes.name)
+            if session is not None:
+                self._unsignalled.append(session)
+                self.context.enqueue(0, self.__refresh_paths)
+
+        # The bypass is only there for the LSPs which asked for it,
+        # once they've all gone so can it
+        if psb.repair_ip is not None:
+            requests = self._repair_requests.get(psb.repair_ip, set())
+            requests.discard(psb.key)
+            if len(requests) == 0:
+                self._repair_requests.pop(psb.repair_ip, None)
+                self.delete_session(self.__bypass_name(psb.repair_ip))
+
+    def __unprotect(self, psb):
+        """
+        Stop the routes over the link bypass psb was protecting from
+        falling back to it, its labels are given back and may be
+        handed out again
+        """
+        if psb.route is None:
+            return
+        routing = self.router.routing
+        with routing.batch(src=self):
+            for table_name, route in self._routes_by_next_hop.get(psb.bypassed, ()):
+                if route.bypass is not psb.route:
                     continue
+                # Put back so the FIB picks up the change
+                routing.del_route(route, table_name)
+                route.bypass = None
+                routing.add_route(route, table_name)
+                self.event_manager.observe(Event(
+                    EventType.RSVP, self, f"Removed {table_name.upper()} bypass route", object=psb.route, sub_type="BYPASS_REMOVED"))
 
-                metric = neigh.metric
+    def __bypass_route(self, next_hop_ip):
+        bypass = self._bypass_by_ip.get(next_hop_ip)
+        if bypass is None:
+            return None
+        return bypass.route
 
-                if exclude_ip is not None and neigh.neighbor_ip == exclude_ip:
-                    self.logger.info(
-                        f"Skipping {neigh} as it referencees IP we are excluding")
-                    continue
-                if exclude_ip is not None and neigh.local_ip == exclude_ip:
-                    self.logger.info(
-                        f"Skipping {neigh} as it referencees IP we are excluding")
-                    continue
+    def create_session(self, dest_ip, lsp_name, link_protection=False, protected_ip=None,
+                       constraints=None):
 
-                self.logger.info(f"processing {neigh_id} neighbor of {node}")
-                if neigh_id not in system_distance:
-                    self.logger.info(f"ignoring due to {neigh_id}")
-                    # We haven't actually converged
-                    return None
+        session = self._sessions_by_name.get(lsp_name)
+        if session is not None:
+            self.logger.info(f"Alreday have {lsp_name}, stopping")
+            return session
 
-                new_dist = system_distance[node] + metric
+        self.lsp_id = self.lsp_id + 1
+        session = RsvpSession(self.source_ip, dest_ip, lsp_name, self.lsp_id,
+                              protected_ip=protected_ip, constraints=constraints)
+        session.paths[0].attributes.local_repair = link_protection
 
-                if new_dist < system_distance[neigh_id]:
-                    system_distance[neigh_id] = new_dist
-                    self.logger.info(
-                        f"SPF distance to {neigh_id} is {new_dist}, via {lsp.routerid}")
-                    #prev_system[neigh_id] = lsp.source_address
-                    prev_system[neigh_id] = lsp.routerid
+        self.sessions.append(session)
+        self._sessions_by_name[lsp_name] = session
+        self._unsignalled.append(session)
 
-            # Now deal with our routable prefixes
-            for network in lsp.addresses:
-                address = network.prefix
-                metric = network.metric
+        self.__refresh_paths()
+        return session
 
-                if str(network.state) != 'UP':
-                    self.logger.debug(f"Skipping {network} as it is not up")
-                    continue
+    def delete_session(self, lsp_name):
+        session = self._sessions_by_name.pop(lsp_name, None)
+        if session is None:
+            self.logger.info(f"No {lsp_name} to delete")
+            return
 
-                if exclude_ip is not None and address.overlaps(ip_network(exclude_ip)):
-                    self.logger.info(f"Skipping {address}")
-                    continue
+        self.sessions.remove(session)
+        if session in self._unsignalled:
+            self._unsignalled.remove(session)
+
+        psb = self.path_state.get(session.paths[0].key())
+        if psb is not None:
+            self.__tear_down(psb)
+
+    def __tear_down(self, psb):
+        if psb.path_out is not None:
+            packet, interface, neighbor = psb.path_out
+            if interface.is_up():
+                tear = PathTear(psb.session, psb.sender)
+                tear.set_hop(packet.payload.hop.hop_address)
+                self.__send(ipv4(
+                    dst=packet.dst,
+                    src=packet.src,
+                    proto=IPProtocol.RSVP,
+                    options=router_alert()) / tear, interface, neighbor)
 
-                new_dist = system_distance[node] + metric
-
-                existing_metric = distance.get(address)
-                if existing_metric is None or existing_metric > new_dist:
-                    distance[address] = new_dist
-                    #prev[address] = lsp.source_address
-                    prev[address] = lsp.routerid
-                    self.logger.info(
-                        f"SPF set prev for {address} to {lsp.routerid}")
-#                if address.overlaps(ip_network(dest_ip)):
-#                    done = True
-        # right now this is super ghetto, as we have a list of system ids
-        # we're going to walk that to get the interface ips
-        address_paths = {}
-        system_paths = {}
-
-        def resolve_path(cur_elem):
-            the_path = []
-            while cur_elem is not None:
-                if cur_elem != self.source_ip:
-                    the_path.append(cur_elem)
-                cur_elem = prev_system.get(cur_elem)
-            return the_path
-
-        for address in prev:
-            path_elem = prev[address]
-            this_path = resolve_path(path_elem)
-            address_paths[address] = this_path
-            address_paths[address].reverse()
-
-        for loopbackip in prev_system:
-            this_path = []
-
-            path_elem = prev_system.get(loopbackip)
-            this_path = resolve_path(path_elem)
-            system_paths[loopbackip] = this_path
-            system_paths[loopbackip].reverse()
-
-
-#        print(f"Hunting for shortest path to {dest_ip}")
-        ero = []
-        from_entry = self.source_ip
-
-        #system_path = address_paths[ip_network(dest_ip)]
-        if dest_ip not in system_paths:
-            return None
-        system_path = system_paths[dest_ip]
-
-        for loopbackip in system_path:
-            from_lsp = ted[from_entry]
-
-            for neighbor in from_lsp.neighbors:
-                neigh_router_id = originaldb[neighbor.system_id].pdu.routerid
-                if neigh_router_id == loopbackip:
-                    target_ip = neighbor.neighbor_ip
-                    self.logger.debug(
-                        f"\tTo reach {loopbackip}, assuming address is {target_ip}")
-                    ero.append(target_ip)
-            from_entry = loopbackip
-        if from_entry is not None:
-            from_lsp = ted[from_entry]
-
-            for neighbor in from_lsp.neighbors:
-                neigh_router_id = originaldb[neighbor.system_id].pdu.routerid
-                if neigh_router_id == dest_ip:
-                    target_ip = neighbor.neighbor_ip
-                    self.logger.debug(
-                        f"\tTo reach {loopbackip}, assuming address is {target_ip}")
-                    ero.append(target_ip)
-
-        return ero
+        self.event_manager.observe(Event(
+            EventType.RSVP, self, f"Tore down {psb.attributes.name}", object=psb, sub_type="TEARDOWN"))
+        self.__remove_state(psb)
+
+    def shortest_path(self, dest_ip, exclude_ip=None, constraints=None):
+        """
+        ERO of the shortest path to dest_ip (a router id) satisfying
+        constraints, avoiding the link with exclude_ip on it
+        """
+        self.logger.info(f"CSPF Starting for {dest_ip}, excluding {exclude_ip}")
+        if constraints is None:
+            constraints = NO_CONSTRAINTS
+        if exclude_ip is not None:
+            constraints = constraints.excluding_link(exclude_ip)
+
+        # For now, we're using the isis process
+        # for our source for the TED
+        ted = self.router.process['isis'].ted
+        return ted.cspf(self.source_ip, dest_ip, constraints)
 
     def start(self):
         if self.started:
             return
 
-        GlobalQueueManager.enqueue(random.randint(0, 5), self.__refresh_paths)
+        self.context.enqueue(self.context.random.randint(0, 5), self.__refresh_paths)
         self.started = True
 
     # def send(self, packet):
     #    self.router.send_ip(packet)
 
     def _process_path(self, interface, packet):
-        pdu = packet.pdu
+        pdu = packet.payload
+        received_id = pdu.message_id
 
         self.logger.info(f"{self.router.hostname} Received RSVP Path message on {interface.address().ip} {packet}, hop={pdu.hop.hop_address} for {pdu.attributes.name}")
+        psb = self.path_state.get(pdu.key())
+        if psb is not None and psb.hop == pdu.hop.hop_address:
+            # Nothing about an LSP changes once it's been set up,
+            # so this can only be a refresh
+            self.__note_message_id(received_id, pdu.hop.hop_address, psb, 'path')
+            self.__refreshed(psb, 'path')
+            return
+        elif psb is not None:
+            # It's been set up again along a different path, which we
+            # have to treat as new. The old one will time out downstream
+            self.__remove_state(psb)
+
+        # In real life we would reserve the requested bandwidth
+        psb = PathStateBlock(pdu)
+        self.__store_path_state(pdu.key(), psb)
+        self.__note_message_id(received_id, pdu.hop.hop_address, psb, 'path')
+        self.__refreshed(psb, 'path')
+
         # this is ghetto style, we basically need to just
         # know if it's any of our IPs
-        if packet.dest_ip == self.source_ip:
+        if packet.dst == self.source_ip:
             self.logger.debug(f"{self.router.hostname} path is for us")
             resv = Resv(
                 pdu.session,
                 filter=FilterSpec(pdu.sender.address, pdu.sender.lsp_id)
             )
 
-            packet = IP(
+            packet = ipv4(
                 dst=pdu.hop.hop_address,
                 src=interface.address().ip,
-                protocol=IPProtocol.RSVP) / resv
-            resv.set_label(3)  # Implicit null
-            resv.set_hop(packet.source_ip)
+                proto=IPProtocol.RSVP) / resv
+            resv.set_label(IMPLICIT_NULL)
+            resv.set_hop(packet.src)
 
-            self.logger.info(f"Issuing RSVP Resv message to {packet.dest_ip} from {packet.source_ip}")
+            self.logger.info(f"Issuing RSVP Resv message to {packet.dst} from {packet.src}")
 
-            self.router.send_ip(packet)
+            self.__assign_message_id(resv, psb, 'resv')
+            psb.resv_out = (packet, interface, pdu.hop.hop_address)
+            self.__send(packet)
+            self.__start_refreshing(psb)
 
             return
 
-        # In real life we would reserve the requested bandwidth
-        if pdu.key() in self.path_state:
-            self.logger.info("Already have PATH STATE for {pdu.key}")
-        self.path_state[pdu.key()] = PathStateBlock(pdu)
-
         found = False
         iface_address = None
         route = None
@@ -376,56 +571,72 @@ class RsvpProcess:
             found = True
         if found and len(pdu.explicit_route) > 0:
             # The next item should be our downstream
-            route = self.router.routing.lookup_ip(pdu.explicit_route[0].route)
-            iface_address = route.interface.address().ip
+            neighbor = pdu.explicit_route[0].route
+            route = self.router.routing.lookup_ip(neighbor)
         elif found:
-            route = self.router.routing.lookup_ip(packet.dest_ip)
-            iface_address = route.interface.address().ip
+            route = self.router.routing.lookup_ip(packet.dst)
+            neighbor = route.next_hop_ip if route is not None else packet.dst
         else:
-            self.logger.warn(f"Did not find ourselves in the ERO {addr} != {interface.adress().ip}")
+            self.logger.warn(f"Did not find ourselves in the ERO {addr} != {interface.address().ip}")
             raise Exception("Did not ourselves in the ERO")
 
+        if route is None or not route.interface.is_up():
+            # Refreshing a path whose next hop has since gone away, there's
+            # nothing to keep here until it's been signalled some other way
+            self.logger.warn(f"{self.router.hostname} no way on to {neighbor} for {pdu.attributes.name}")
+            self.__remove_state(psb)
+            return
+
+        iface_address = route.interface.address().ip
         pdu.set_hop(iface_address)
         pdu.add_record(iface_address)
         self.event_manager.observe(Event(
             EventType.RSVP, self, f"Processed Path mesasge", object=pdu, sub_type="PROCESS_PATH"))
-        self.router.send_ip(packet, source_interface=route.interface)
+        self.__assign_message_id(pdu, psb, 'path')
+        psb.path_out = (packet, route.interface, neighbor)
+        self.__send(packet, route.interface, neighbor)
+        self.__start_refreshing(psb)
 
     def _process_resv(self, interface, packet):
         assert interface is not None
-        resv = packet.pdu  # Resv
-
-        rsb = self.resv_state.get(resv.key())
-        if rsb is None:
-            rsb = ResvStateBlock(resv)
-            self.resv_state[resv.key()] = rsb
-
+        resv = packet.payload  # Resv
+        received_id = resv.message_id
 
-        self.event_manager.observe(Event(
-            EventType.RSVP, self, f"Processed Resv mesasge", object=resv, sub_type="PROCESS_RESV"))
-
-        psb = None
         # TODO: The descriptions of the key into the
         # path state aren't clear
-        for key in self.path_state:
-            path_info = self.path_state[key]
-            if (path_info.session.dest_ip == resv.session.dest_ip and
-                path_info.session.tunnel_id == resv.session.tunnel_id and
-                path_info.sender.address == resv.filter.address and
-                    path_info.sender.lsp_id == resv.filter.lsp_id):
-                psb = path_info
-                break
+        psb = self._psb_by_sender.get(
+            (resv.session.dest_ip, resv.session.tunnel_id,
+             resv.filter.address, resv.filter.lsp_id))
 
         if psb is None:
+            # Nothing to reserve against, so don't keep any state for it
+            # either or the Resv for it later would look like a refresh
             self.logger.info(f"Received RESV mesage {resv} with no corresponding PSB!")
             return
 
+        rsb = self.resv_state.get(resv.key())
+        if rsb is not None and psb.resv_key == resv.key():
+            # Labels aren't changed once handed out, so this is a refresh
+            self.__note_message_id(received_id, resv.hop.hop_address, psb, 'resv')
+            self.__refreshed(psb, 'resv')
+            return
+
+        rsb = ResvStateBlock(resv)
+        self.resv_state[resv.key()] = rsb
+
+        self.event_manager.observe(Event(
+            EventType.RSVP, self, f"Processed Resv mesasge", object=resv, sub_type="PROCESS_RESV"))
+
+        psb.resv_key = resv.key()
+        self.__note_message_id(received_id, resv.hop.hop_address, psb, 'resv')
+        self.__refreshed(psb, 'resv')
+
         self.logger.debug(f"{self.router.hostname} Received RSVP RESV message on {interface.address().ip} {packet}, hop={resv.hop.hop_address}, for {psb.attributes.name}")
         label = resv.label
         psb.label = label
 
         action = None
-        if label == 3:
+        if label == IMPLICIT_NULL:
             action = PopStackOperation()
         else:
             action = ReplaceStackOperation(label)
@@ -454,57 +665,37 @@ class RsvpProcess:
             psb.route = newroute
 
             if psb.type == 'standard':
-                self.router.routing.add_route(newroute, 'rsvp')
+                self.__install_route(newroute, 'rsvp')
             else:
-                route_table = self.router.routing.tables['rsvp']
-
-                # TODO: This whole thing is terribly, really we need to just have the bypass
-                # available for later lookup
-                # Or even better associate it directly
-                for routes in route_table.values():
-                    for route in routes:
-                        if route.next_hop_ip == psb.bypassed:
-                            route.bypass = newroute
-                            self.event_manager.observe(Event(
-                                EventType.RSVP, self, f"Added RSVP bypass route", object=newroute, sub_type="BYPASS_INSTALLED"))
-
-                for routes in self.router.routing.tables['mpls'].values():
-                    for route in routes:
-                        if route.next_hop_ip == psb.bypassed:
-                            route.bypass = newroute
-                            self.event_manager.observe(Event(
-                                EventType.RSVP, self, f"Added MPLS bypass route", object=newroute, sub_type="BYPASS_INSTALLED"))
-
-                for psbinfo in self.path_state.values():
-                    if newroute.next_hop_ip == psbinfo.bypassed:
-                        newroute.bypass = psbinfo.route
+                # Protect everything we've already installed over the link
+                for table_name, route in self._routes_by_next_hop.get(psb.bypassed, ()):
+                    route.bypass = newroute
+                    self.event_manager.observe(Event(
+                        EventType.RSVP, self, f"Added {table_name.upper()} bypass route", object=newroute, sub_type="BYPASS_INSTALLED"))
+
+                newroute.bypass = self.__bypass_route(newroute.next_hop_ip)
 
         else:
             if our_ip == psb.hop:
                 self.logger.error(f"Apparenty routing loop, {our_ip} is {psb.hop} {psb.attributes.name}")
                 raise Exception(f"Routing loop detected! ")
 
-            # Now we set up our own label that we'll convey downstream
-            # Do we still do this during refreshes?
-            next_label = self.current_label
-            self.current_label += 10
+            # Now we set up our own label that we'll convey downstream,
+            # given back when the state goes
+            next_label = self.router.labels.allocate()
             # TODO: It should be safe to put this where we have BGP routes
 
             rsvproute = RSVPRoute(
-                    str(next_label),
+                    next_label,
                     interface,
                     resv.hop.hop_address,
                     lsp_name=psb.attributes.name,
                     action=action
                 )
-            for psbinfo in self.path_state.values():
-                if rsvproute.next_hop_ip == psbinfo.bypassed:
-                    rsvproute.bypass = psbinfo.route
+            rsvproute.bypass = self.__bypass_route(rsvproute.next_hop_ip)
 
-            self.router.routing.add_route(
-                rsvproute,
-                'mpls'
-            )
+            self.__install_route(rsvproute, 'mpls')
+            psb.label_route = rsvproute
 
             self.event_manager.observe(Event(
                 EventType.RSVP, self, f"Reserved new label {next_label}", object=next_label, sub_type="Reserved label"))
@@ -515,13 +706,16 @@ class RsvpProcess:
             if psb.hop == our_ip:
                 self.logger.warn(f"Invalid self-RESV {resv.filter.address}, {self.source_ip}")
                 return
-            packet = IP(
+            packet = ipv4(
                 dst=psb.hop,
-                src=our_ip, protocol=IPProtocol.RSVP) / resv
+                src=our_ip, proto=IPProtocol.RSVP) / resv
             self.logger.info(packet)
             self.logger.info(f"When sending RESV, using interface {route.interface}")
             self.logger.debug(f"{self.router.hostname} forwarding RESV via {route.interface.name} to {psb.hop} for {psb.attributes.name}")
-            self.router.send_ip(packet, source_interface=route.interface)
+            self.__assign_message_id(resv, psb, 'resv')
+            psb.resv_out = (packet, route.interface, psb.hop)
+            self.__send(packet, route.interface)
+            self.__start_refreshing(psb)
 
         # if the ingress requested local repair
         # we are going to set up a Bypass path
@@ -541,7 +735,9 @@ class RsvpProcess:
             # find the node by its loop back. Is that traffic
             # engineering router id?
 
-            GlobalQueueManager.enqueue(
+            psb.repair_ip = next_hop_ip
+            self._repair_requests.setdefault(next_hop_ip, set()).add(psb.key)
+            self.context.enqueue(
                 0,
                 functools.partial(self._create_bypass_lsp,
                                   route.interface, next_hop_ip)
@@ -555,32 +751,110 @@ class RsvpProcess:
 
         # We are assuming that the excluded is an interface address
         # of a system that we still want to reach (so just doing link bypass)
+        if protected_ip not in self._repair_requests:
+            # What wanted it has gone again already
+            return
         self.logger.info(f"Creating Bypass session to {protected_ip}")
 
-        ted = self.router.process['isis'].database
-
-        router_id = None
-        for lspid in ted:
-            lsp = ted[lspid].pdu
-
-            for neighbor in lsp.neighbors:
-                if neighbor.local_ip == protected_ip:
-                    # we are ssuming router_id = loopback/destination
-                    router_id = lsp.routerid
+        # we are ssuming router_id = loopback/destination
+        ted = self.router.process['isis'].ted
+        router_id = ted.router_for_address(protected_ip)
 
         if router_id is None:
             self.logger.warn(
                 f"Unable to create bypass for {protected_ip}, unable to find router")
 
-        session_name = f"Bypass->{protected_ip} ({self.router.hostname})"
+        # Bypasses aren't themselves protected (RFC 4090 facility
+        # backup), otherwise they'd all keep each other up
+        self.create_session(router_id, self.__bypass_name(protected_ip),
+                            protected_ip=protected_ip)
 
-        self.create_session(router_id, session_name, link_protection=True, protected_ip=protected_ip)
+    def __bypass_name(self, protected_ip):
+        return f"Bypass->{protected_ip} ({self.router.hostname})"
 
 
     def process_packet(self, interface, packet):
-        pdu = packet.pdu
+        # Both get changed as they're passed on, but the packet we
+        # got may be shared with whoever sent it
+        packet = clone(packet)
+        packet.payload = copy(packet.payload)
+        pdu = packet.payload
+        if isinstance(pdu, (Path, Resv)):
+            # As are the routes still to go and recorded so far, and
+            # the sender keeps its copy to refresh with
+            pdu.explicit_route = list(pdu.explicit_route)
+            pdu.record_route = list(pdu.record_route)
+        self.received[type(pdu).__name__] += 1
 
         if isinstance(pdu, Path):
             self._process_path(interface, packet)
         elif isinstance(pdu, Resv):
             self._process_resv(interface, packet)
+        elif isinstance(pdu, Srefresh):
+            self._process_srefresh(interface, packet)
+        elif isinstance(pdu, Ack):
+            self._process_ack(interface, packet)
+        elif isinstance(pdu, Bundle):
+            self._process_bundle(interface, packet)
+        elif isinstance(pdu, PathTear):
+            self._process_path_tear(interface, packet)
+
+    def _process_path_tear(self, interface, packet):
+        tear = packet.payload
+        psb = self.path_state.get(tear.key())
+        if psb is None or psb.hop != tear.hop.hop_address:
+            # Already gone, or it's since been set up some other way
+            return
+        self.__tear_down(psb)
+
+    def _process_srefresh(self, interface, packet):
+        nacks = []
+        for message_id in packet.payload.message_ids:
+            found = self._received_ids.get(
+                (packet.src, message_id.epoch, message_id.message_id))
+            if found is None:
+                nacks.append(message_id)
+            else:
+                self.__refreshed(*found)
+
+        if len(nacks) > 0:
+            # They'll have to send us the whole thing
+            self.__send(ipv4(
+                dst=packet.src,
+                src=interface.address().ip,
+                proto=IPProtocol.RSVP) / Ack(nacks=nacks), interface)
+
+    def _process_ack(self, interface, packet):
+        for message_id in packet.payload.nacks:
+            found = self._sent_ids.get(message_id.message_id)
+            if found is None:
+                continue
+            psb, kind = found
+            out = psb.path_out if kind == 'path' else psb.resv_out
+            if out is not None:
+                self.__queue(out[1], out[2], out[0])
+
+    def _process_bundle(self, interface, packet):
+        for message in packet.payload.messages:
+            if isinstance(message, Path):
+                # As it would have been sent on its own
+                inner = ipv4(
+                    dst=message.session.dest_ip,
+                    src=message.sender.address,
+                    proto=IPProtocol.RSVP,
+                    options=router_alert()) / message
+            else:
+                inner = ipv4(
+                    dst=packet.dst,
+                    src=packet.src,
+                    proto=IPProtocol.RSVP) / message
+            self.process_packet(interface, inner)
+
+    def statistics(self):
+        return {
+            'sent': dict(self.sent),
+            'received': dict(self.received),
+            'packets_sent': self.packets_sent,
+            'path_state': len(self.path_state),
+            'timers': len(self.timers),
+        }
@@ -1,10 +1,67 @@
+"""
+The simulator's hooks into scapy
+
+scapy takes a few hundred milliseconds to import, so nothing in routersim
+imports it at module level. Anything wanting a scapy layer gets it from
+here instead, at the point it builds a packet:
+
+    from .scapy import IP, IPOption_Router_Alert
+
+Importing this module loads scapy, detaches it from the host's real
+interfaces and adds the methods the simulator expects packets to have
+(seq_note(), inspectable(), ...).
+"""
+from scapy import interfaces
 from scapy.interfaces import IFACES, InterfaceProvider, NetworkInterface, \
-    network_name
+    NetworkInterfaceDict, network_name
 
 from scapy.supersocket import SuperSocket
 from scapy.route import Route
 from scapy.config import conf as scapy_conf
+from scapy.packet import Packet, Raw
+from scapy.layers.inet import IP, ICMP, UDP, TCP, IPOption_Router_Alert
+from scapy.layers.l2 import ARP, Ether
 from .routing import RoutingTables
+from .arp import ArpType
+
+# reset, as we don't want the default links
+# Then we can inject our interfaces as necessary
+scapy_conf.ifaces = IFACES = NetworkInterfaceDict()
+interfaces.IFACES = None
+scapy_conf.ifaces = None
+scapy_conf.iface = None
+
+
+def seq_note(self):
+    notefn = getattr(self.payload, "seq_note", None)
+    if notefn is not None:
+        note = notefn()
+    else:
+         note = None
+
+    return note
+    
+def ip_inspectable(self):
+    return len(
+        [opt for opt in self.options if isinstance(opt, IPOption_Router_Alert)]
+    ) > 0
+
+
+def icmp_seq_note(self) -> str:
+    return f"{self.type}\n{self.payload.load}"
+ICMP.seq_note = icmp_seq_note
+IP.seq_note = seq_note
+IP.inspectable = ip_inspectable
+
+
+def arp_str(self) -> str:
+    if self.op == ArpType.Request.value:
+        return f"ARP Request Who-Is {self.pdst}, tell {self.psrc} at {self.hwsrc}"
+    else:
+        return f"ARP Response {self.psrc} is {self.hwsrc}"
+
+
+ARP.__str__ = arp_str
 
 
 class RouterSimNetworkInterface(NetworkInterface):
@@ -5,13 +5,8 @@ from .observers import LoggingObserver, EventType
 from .messaging import BROADCAST_MAC, FrameType
 from .arp import ArpHandler
 import ipaddress
-from .scapy import RouterSimRoute
-from scapy.sendrecv import send as scapy_l3_send
-from scapy.config import conf as scapy_conf
-from scapy.layers.l2 import Ether
-from scapy.layers.inet import UDP,TCP
 from dataclasses import dataclass
-from .dhcp import DHCPClient
+from .packets import UDPDatagram, is_scapy
 
 V4_ADDR_UNSPECIFIED = "0.0.0.0"
 @dataclass(frozen=True)
@@ -116,14 +111,14 @@ class PacketListener:
 
 # An end host
 class Server(NetworkDevice):
-    def __init__(self, hostname):
-        super().__init__(hostname)
+    def __init__(self, hostname, context=None):
+        super().__init__(hostname, context=context)
 
         self.add_physical_interface("et1")
         self.routing = RoutingTables(evt_manager=self.event_manager, parent_logger=self.logger)
-        self.arp = ArpHandler(self, self.event_manager, self.logger)
+        self.arp = ArpHandler(self, self.event_manager, self.logger, context=self.context)
         self.event_manager.listen(
-            '*', LoggingObserver(self.hostname, self.logger).observe)
+            '*', LoggingObserver(self.hostname, self.logger))
         self.event_manager.listen(
             EventType.PACKET_RECV, PacketListener(self).observe)
         self.event_manager.listen(
@@ -172,28 +167,37 @@ class Server(NetworkDevice):
         interface.send(dest_address, frame_type, pdu)
 
     def scapy_send_ip(self, packet, source_interface=None):
+        from .scapy import RouterSimRoute, scapy_conf
+        from scapy.sendrecv import send as scapy_l3_send
         scapy_conf.route = RouterSimRoute(self.routing)
         scapy_l3_send(packet)
 
     # In order to send a Layer 3 (IP) packet that is on the same layer 3 network as
     # our packet, we need to to know it's Layer 2 (Ethernet) address. This
-    def send_ip(self, packet, source_interface=None):
+    #
+    # next_hop (with source_interface) sends it to that neighbor whatever
+    # the routing table says, e.g. RSVP messages which have to follow the
+    # path they were signalled along
+    def send_ip(self, packet, source_interface=None, next_hop=None):
   
-  #      route = self.routing.lookup_ip(packet.dest_ip)
-        route = self.routing.lookup_ip(packet.dst)
-        if route is None:
-            # TODO: NoRouteException
-            raise Exception()
-            #f"{packet.dest_ip}: no route to host")
-
-        if source_interface is None:
-            if route is not None:
-                source_interface = route.interface
-
-        # Now, we need to determine whether this packet is destined for our
-        # local network to go over Layer 2, or if it should be sent off
-        # to to the default route
-        lookup_addr = route.next_hop_ip
+        if next_hop is not None and source_interface is not None:
+            lookup_addr = next_hop
+        else:
+  #          route = self.routing.lookup_ip(packet.dest_ip)
+            route = self.routing.lookup_ip(packet.dst)
+            if route is None:
+                # TODO: NoRouteException
+                raise Exception()
+                #f"{packet.dest_ip}: no route to host")
+
+            if source_interface is None:
+                if route is not None:
+                    source_interface = route.interface
+
+            # Now, we need to determine whether this packet is destined for our
+            # local network to go over Layer 2, or if it should be sent off
+            # to to the default route
+            lookup_addr = route.next_hop_ip
 #        dest_ip = packet.dest_ip
         dest_ip = packet.dst
         dest_ip_as_net = ipaddress.ip_network(f"{dest_ip}/32")
@@ -211,7 +215,7 @@ class Server(NetworkDevice):
                             FrameType.IPV4,
                             packet)
 
-    def process_frame(self, frame: Ether, source_interface: LogicalInterface):
+    def process_frame(self, frame, source_interface: LogicalInterface):
         if frame.dst != BROADCAST_MAC and frame.dst != source_interface.hw_address:
             return
 
@@ -226,7 +230,7 @@ class Server(NetworkDevice):
         
 
         payload = packet.payload
-        if isinstance(payload, UDP):
+        if isinstance(payload, UDPDatagram) or is_scapy(payload, 'UDP'):
 
             udp_sockets = self.sockets["UDP"]
 
@@ -261,6 +265,7 @@ class Server(NetworkDevice):
 
         
     def dhcp_client_start(self):
+        from .dhcp import DHCPClient
         self.dhcpclient = DHCPClient(self)
 
         self.dhcpclient.discover(self.main_interface)
@@ -0,0 +1,170 @@
+"""
+Run the same topology under many scenarios, spread across a process pool
+
+A scenario is a mutation applied to a freshly built, converged topology
+(e.g. "fail the link between r1 and r2"). Each scenario is run in its own
+worker with its own seed, and only a compact summary of what happened
+is shipped back to the parent:
+
+    def build(seed):
+        topology = Topology("lab", seed=seed)
+        ...
+        topology.isis_enable_all()
+        topology.isis_start_all()
+        return topology
+
+    results = run_sweep(build, link_failure_scenarios(build(0)))
+
+The factory and the scenario mutations are sent to the workers, so they
+need to be picklable (module level functions, or partials of them).
+"""
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import dataclass, field
+from functools import partial
+from typing import Callable, Optional
+from .messaging import FrameType
+from .observers import EventType
+
+
+@dataclass
+class Scenario:
+    name: str
+    # Called with the converged topology
+    mutate: Callable
+
+
+@dataclass
+class ScenarioResult:
+    name: str
+    seed: int
+    # Ticks from the mutation until the last route change, None if
+    # nothing changed at all
+    convergence_tick: Optional[float] = None
+    # Only counted when the topology is collecting events
+    event_count: int = 0
+    event_counts: dict = field(default_factory=dict)
+    # hostname -> {'added': {prefix: entry}, 'removed': {prefix: entry},
+    #              'changed': {prefix: (before, after)}}
+    fib_diff: dict = field(default_factory=dict)
+    error: Optional[str] = None
+
+
+def find_device(topology, hostname):
+    for cluster in topology.clusters.values():
+        if hostname in cluster:
+            return cluster[hostname]
+    raise KeyError(f"{hostname} is not part of {topology.name}")
+
+
+def _fail_link(hostname, interface_name, topology):
+    iface = find_device(topology, hostname).interfaces[interface_name]
+    if iface.link is None:
+        raise Exception(f"{hostname}/{interface_name} is not linked")
+    iface.link.down()
+
+
+def fail_link(hostname, interface_name):
+    return Scenario(f"fail {hostname}/{interface_name}",
+                    partial(_fail_link, hostname, interface_name))
+
+
+def link_failure_scenarios(topology):
+    """
+    One scenario per link in the topology, failing that link
+    """
+    return [
+        fail_link(link['endpoint1']['system'], link['endpoint1']['iface'])
+        for link in topology.get_topology(layer2=False)['links']
+    ]
+
+
+def fib_snapshot(topology):
+    snapshot = {}
+    for device in topology.routers():
+        forwarding = getattr(device, '_forwarding', None)
+        if forwarding is None or forwarding.fib is None:
+            continue
+        snapshot[device.hostname] = {
+            str(prefix): str(entry)
+            for prefix, entry in forwarding.fib[FrameType.IPV4].items()
+        }
+    return snapshot
+
+
+def fib_diff(before, after):
+    diff = {}
+    for hostname in after:
+        old = before.get(hostname, {})
+        new = after[hostname]
+
+        added = {p: new[p] for p in new if p not in old}
+        removed = {p: old[p] for p in old if p not in new}
+        changed = {p: (old[p], new[p]) for p in new if p in old and old[p] != new[p]}
+
+        if len(added) > 0 or len(removed) > 0 or len(changed) > 0:
+            diff[hostname] = {
+                'added': added,
+                'removed': removed,
+                'changed': changed,
+            }
+    return diff
+
+
+def run_scenario(topology_factory, scenario, seed,
+                 settle_ticks=30000, run_ticks=30000):
+    """
+    Build, converge, mutate and re-run a single scenario. This is what
+    each worker runs, but it can be called directly when debugging one
+    """
+    result = ScenarioResult(scenario.name, seed)
+    try:
+        topology = topology_factory(seed)
+        for _ in topology.run_another(settle_ticks, stream=True, raise_errors=True):
+            pass
+        before = fib_snapshot(topology)
+
+        # Listened for directly, so convergence is still worked out
+        # when the topology isn't collecting events
+        last_change = []
+
+        def route_changed(evt):
+            last_change[:] = [evt.when]
+
+        for router in topology.routers():
+            router.event_manager.listen(EventType.ROUTE_CHANGE, route_changed)
+
+        mutated_at = topology.clock.clockfn()
+        scenario.mutate(topology)
+        for _, evt in topology.run_another(run_ticks, stream=True, raise_errors=True):
+            result.event_count += 1
+            name = str(evt.event_type)
+            result.event_counts[name] = result.event_counts.get(name, 0) + 1
+
+        if len(last_change) > 0:
+            result.convergence_tick = last_change[0] - mutated_at
+
+        result.fib_diff = fib_diff(before, fib_snapshot(topology))
+    except Exception as e:
+        result.error = repr(e)
+
+    return result
+
+
+def run_sweep(topology_factory, scenarios, base_seed=0,
+              settle_ticks=30000, run_ticks=30000, max_workers=None):
+    """
+    Run each of scenarios against its own topology built by
+    topology_factory(seed), returning a ScenarioResult per scenario
+    in the same order. Scenario N is always run with base_seed + N.
+
+    With max_workers=1 everything runs in this process
+    """
+    seeds = [base_seed + i for i in range(len(scenarios))]
+    run = partial(run_scenario, topology_factory,
+                  settle_ticks=settle_ticks, run_ticks=run_ticks)
+
+    if max_workers == 1:
+        return [run(scenario, seed) for scenario, seed in zip(scenarios, seeds)]
+
+    with ProcessPoolExecutor(max_workers=max_workers) as executor:
+        return list(executor.map(run, scenarios, seeds))
@@ -1,7 +1,6 @@
-from ..observers import GlobalQueueManager, Event, EventType
+from ..observers import Event, EventType
 from ..interface import LogicalInterface, PhysicalInterface
 from ..messaging import BROADCAST_MAC, MACAddress
-from scapy.layers.l2 import Ether
 
 from binascii import hexlify
 
@@ -45,7 +44,7 @@ class BridgingTable:
 
     def is_expired(self, entry):
         return (entry.last_seen <
-                (GlobalQueueManager.now() - (1000 * self.config['mac-aging-time']))
+                (self.event_manager.now() - (1000 * self.config['mac-aging-time']))
                 )
 
     def set_table(self, table):
@@ -55,10 +54,10 @@ class BridgingTable:
     def learn(self, mac: MACAddress, interface: LogicalInterface):
         entry = self.table.get(mac)
         if entry is None or entry.interface != interface:
-            self.table[mac] = BridgeEntry(mac, interface, GlobalQueueManager.now())
+            self.table[mac] = BridgeEntry(mac, interface, self.event_manager.now())
             self.logger.debug(f"Learned new mac entry: {self.table[mac]}")
         else:
-            entry.last_seen = GlobalQueueManager.now()
+            entry.last_seen = self.event_manager.now()
 
     def lookup_mac(self, mac: MACAddress) -> LogicalInterface:
         entry = self.table.get(mac)
@@ -98,7 +97,7 @@ class SwitchingEngine():
 
     # A frame always comes over a PhysicalInterface, and then may get
     # interpreted as a LogicalInterface depending on data in the frame
-    def process_frame(self, frame: Ether, source_interface: PhysicalInterface):
+    def process_frame(self, frame, source_interface: PhysicalInterface):
         self.logger.info("processing frame")
         # TODO: This is where we would look at the encapsulation to work
         # out where this is really intended
@@ -131,7 +130,7 @@ class SwitchingEngine():
             self.logger.info(f"Successfully found entry for {frame.dst}")
             out_interface.send_frame(frame)
 
-    def broadcast_frame(self, frame: Ether, source_interface: PhysicalInterface):
+    def broadcast_frame(self, frame, source_interface: PhysicalInterface):
         self.logger.info(f"Broadcasting {frame}")
         for interface in self.interfaces:
             if interface != source_interface.name:
@@ -28,8 +28,8 @@ class PacketListener:
 # extend from a base class
 class Switch(NetworkDevice):
 
-    def __init__(self, hostname, interface_count=12):
-        super().__init__(hostname)
+    def __init__(self, hostname, interface_count=12, context=None):
+        super().__init__(hostname, context=context)
         self.logger = logging.getLogger(hostname)
         self.phy_interfaces = dict()
         self.interfaces = dict()
@@ -43,7 +43,7 @@ class Switch(NetworkDevice):
         self._bridging = SwitchingEngine(self,  self.interfaces, None) 
 
         self.event_manager.listen(
-            '*', LoggingObserver(self.hostname, self.logger).observe) 
+            '*', LoggingObserver(self.hostname, self.logger)) 
         self.event_manager.listen(
             EventType.PACKET_RECV, PacketListener(self).observe)
 
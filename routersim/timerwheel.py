@@ -0,0 +1,88 @@
+"""
+Hashed timing wheel for large numbers of coarse timers
+
+Protocols with per-state timers (RSVP refreshes and cleanups, one or
+two per LSP at every hop) would otherwise each put an event on the
+simulation's queue, and pay for a heap push and pop every time a timer
+is (re)scheduled. The wheel hashes timers into slots of tick ms and
+keeps only a single event on the queue, for its next turn:
+
+    wheel = TimerWheel(context, tick=1000)
+    timer = wheel.schedule(30 * 1000, self.refresh, (state,))
+    ...
+    timer.cancel()
+
+Timers fire on the first tick at or after they are due, so never
+early and at most tick ms late. All the timers due on a tick run in
+the same callback. The wheel stops turning when it has no timers left.
+"""
+import math
+
+
+class Timer:
+    __slots__ = ('tick', 'action', 'arguments', 'cancelled')
+
+    def __init__(self, tick, action, arguments):
+        self.tick = tick
+        self.action = action
+        self.arguments = arguments
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True
+
+
+class TimerWheel:
+
+    def __init__(self, context, tick=1000, slots=64, owner=None):
+        self.context = context
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        # So the profiler can account turns to the device
+        self.owner = owner
+
+        # Last tick we have turned to
+        self.position = None
+        self.armed = False
+        # Timers on the wheel, including cancelled ones not yet reached
+        self.count = 0
+
+    def __len__(self):
+        return self.count
+
+    def schedule(self, delay, action, arguments=()):
+        now = self.context.now()
+        if not self.armed:
+            # Catch up with however long we've been stopped for
+            current = math.floor(now / self.tick)
+            if self.position is None or current > self.position:
+                self.position = current
+
+        tick = max(math.ceil((now + delay) / self.tick), self.position + 1)
+        timer = Timer(tick, action, arguments)
+        self.slots[tick % len(self.slots)].append(timer)
+        self.count += 1
+        self._arm(now)
+        return timer
+
+    def _arm(self, now):
+        if self.armed or self.count == 0:
+            return
+        self.armed = True
+        self.context.enqueue((self.position + 1) * self.tick - now, self._turn)
+
+    def _turn(self):
+        self.armed = False
+        self.position += 1
+        position = self.position
+
+        slot = self.slots[position % len(self.slots)]
+        due = [timer for timer in slot if timer.tick <= position]
+        if len(due) > 0:
+            slot[:] = [timer for timer in slot if timer.tick > position]
+            self.count -= len(due)
+            for timer in due:
+                if not timer.cancelled:
+                    timer.action(*timer.arguments)
+
+        self._arm(self.context.now())
@@ -1,28 +1,14 @@
 from routersim.router import Router
 from routersim.switching.switch import Switch
 from routersim.server import Server
-from routersim.observers import GlobalQueueManager, EventCollector
+from routersim.observers import Clock, SimulationContext, GlobalQueueManager
+from routersim.observers import EventCollector
+from routersim.profiling import Profiler
+from routersim.interface import PhysicalLink
 import ipaddress
 import logging
+import random
 from functools import reduce, partial
-import copy
-
-
-# This doesn't feel like it belongs here but I don't have a better place yet
-class Clock():
-    
-    def __init__(self):
-        self.tick = 0
-
-    def next_tick(self) -> int:
-        self.delayfn(1)
-        return self.tick
-
-    def clockfn(self) -> int:
-        return self.tick
-
-    def delayfn(self, delay):
-        self.tick = self.tick + delay
 
 
 class Topology():
@@ -30,7 +16,8 @@ class Topology():
     """
 
     def __init__(self, name="Test Topology", loopback_network=None,
-                 area_id="49.0001", clock=None):
+                 area_id="49.0001", clock=None, seed=None,
+                 collect_events=True, event_retention=None):
 
         self.clusters = {
             'default': {}
@@ -38,16 +25,35 @@ class Topology():
         # TODO: might not keep this
         self._routers = []
         self.logger = logging.getLogger("topology." + name)
-        self.collector = EventCollector()
+        # With collect_events off run_until() returns nothing, and
+        # devices skip building events nobody else is listening for.
+        # event_retention caps how many events a run holds on to, only
+        # the most recent ones are returned
+        self.collector = EventCollector(
+            enabled=collect_events, retention=event_retention)
         self.name = name
 
         self.area_id = area_id
 
         if clock is None:
             clock = Clock()
-            GlobalQueueManager.setup(clock.clockfn, clock.delayfn)
         self.clock = clock
 
+        # Each topology is its own simulation, so nothing is shared
+        # with any other topology living in the same process
+        self.context = SimulationContext(clock.clockfn, clock.delayfn, seed=seed)
+
+        # Devices created by hand (rather than via add_router and friends)
+        # pick up the process-wide context. The first topology provides
+        # it unless something else already has, later ones leave it
+        # alone (GlobalQueueManager.use(topology.context) to switch)
+        if GlobalQueueManager.context is None:
+            GlobalQueueManager.use(self.context)
+
+        # Set up by enable_profiling(), kept after disabling so what
+        # was recorded can still be reported
+        self.profiler = None
+
         # When using auto-addressing, addresses will be allocated
         # from here for loopbacks
         if loopback_network is None:
@@ -60,9 +66,7 @@ class Topology():
         # When using auto-addressing, /31s will be allocated from this range
         self.point_to_point_network = ipaddress.ip_network("100.65.0.0/16")
 
-        self._p2p_iter = iter(
-            self.point_to_point_network.subnets(new_prefix=31)
-            )
+        self._p2p_next = int(self.point_to_point_network.network_address)
 
     @property
     def now(self):
@@ -144,7 +148,7 @@ class Topology():
         if cluster_name not in self.clusters:
             self.clusters[cluster_name] = {}
 
-        switch = Server(name)
+        switch = Server(name, context=self.context)
 
         if interface_addr is not None:
             switch.add_ip_address(switch.main_interface.name, interface_addr)
@@ -171,7 +175,7 @@ class Topology():
         if cluster_name not in self.clusters:
             self.clusters[cluster_name] = {}
 
-        switch = Switch(name)
+        switch = Switch(name, context=self.context)
 
         if interfaces is not None:
             for ifacename in interfaces:
@@ -190,8 +194,12 @@ class Topology():
 
         if cluster_name not in self.clusters:
             self.clusters[cluster_name] = {}
-        loopback = next(self._loopback_iter)
-        router = Router(name, loopback_address=loopback)
+        loopback = next(self._loopback_iter, None)
+        if loopback is None:
+            raise Exception(
+                f"No loopback addresses left in {self.loopback_network}, "
+                "use a larger loopback_network")
+        router = Router(name, loopback_address=loopback, context=self.context)
 
         # implied interface name
         # we could wait until IS-IS is enabled, but alas
@@ -213,41 +221,158 @@ class Topology():
     def routers(self):
         return self._routers
 
+    def allocate_p2p(self, count=1):
+        """
+        Allocate count /31s from point_to_point_network, returned as
+        a list of (IPv4Interface, IPv4Interface) pairs
+        """
+        network = self.point_to_point_network
+        first = self._p2p_next
+        last = first + 2 * count
+        if last > int(network.broadcast_address) + 1:
+            raise Exception(f"No point-to-point addresses left in {network}")
+        self._p2p_next = last
+
+        return [
+            (ipaddress.IPv4Interface((address, 31)),
+             ipaddress.IPv4Interface((address + 1, 31)))
+            for address in range(first, last, 2)
+        ]
+
     def link_router_pair(self, r1, r2, latency_ms=10, te_metric=10):
         """
         Link this pair of routers by finding the first open
         interface on each one. If no point-to-point address
         is assigned it will do so at this time
         """
+        link = self._link(r1, r2, self.allocate_p2p()[0],
+                          latency_ms=latency_ms, te_metric=te_metric)
+        link.up()
+        return link
 
-        p2p = next(self._p2p_iter)
-        hosts = p2p.hosts()
+    def link_router_pairs(self, pairs, latency_ms=10, te_metric=10):
+        """
+        link_router_pair() for each (r1, r2) in pairs, with the
+        addresses allocated in one go and all the links brought up
+        together rather than each scheduling its own link-up
+        """
+        pairs = list(pairs)
+        links = [
+            self._link(r1, r2, addresses, latency_ms=latency_ms, te_metric=te_metric,
+                       log=False)
+            for (r1, r2), addresses in zip(pairs, self.allocate_p2p(len(pairs)))
+        ]
+        PhysicalLink.up_all(links)
+
+        self.logger.info(f"Linked {len(links)} pairs of routers")
+        return links
+
+    def _link(self, r1, r2, addresses, latency_ms=10, te_metric=10, log=True):
+        r1int = r1.free_port()
+        if r1int is None:
+            raise Exception(f"{r1.hostname} has no free interface to link to {r2.hostname}")
+        r2int = r2.free_port()
+        if r2int is None:
+            raise Exception(f"{r2.hostname} has no free interface to link to {r1.hostname}")
+
+        r1new = r1.add_logical_interface(r1int, r1int.name + ".0", addresses={'ip': addresses[0]})
+        r2new = r2.add_logical_interface(r2int, r2int.name + ".0", addresses={'ip': addresses[1]})
+        r1new.te_metric = te_metric
+        r2new.te_metric = te_metric
 
-        host1 = next(hosts)
-        host2 = next(hosts)
+        if log:
+            self.logger.info(f"Linked {r1.hostname}/{r1new.name} to {r2.hostname}/{r2new.name}")
 
-        r1int = None
-        r2int = None
-        for ifacename in r1.phy_interfaces:
-            iface = r1.interfaces[ifacename]
-            if iface.is_physical() and iface.link is None and not iface.is_loopback:
-                r1int = iface
-                break
+        return r1int.connect(r2int, latency_ms=latency_ms, up=False)
 
-        for ifacename in r2.phy_interfaces:
-            iface = r2.interfaces[ifacename]
-            if iface.is_physical() and iface.link is None and not iface.is_loopback:
-                r2int = iface
-                break
+    def _build(self, names, links, cluster_name='default', latency_ms=10, te_metric=10):
+        """
+        Add a router for each name, with just enough interfaces for
+        links (pairs of indexes into names), and link them up
+        """
+        ports = [0] * len(names)
+        for a, b in links:
+            ports[a] += 1
+            ports[b] += 1
+
+        routers = [
+            self.add_router(
+                name,
+                interfaces=[f"et{port}" for port in range(1, count + 1)],
+                cluster_name=cluster_name)
+            for name, count in zip(names, ports)
+        ]
+        self.link_router_pairs(
+            [(routers[a], routers[b]) for a, b in links],
+            latency_ms=latency_ms, te_metric=te_metric)
+        return routers
 
-        r1new = r1.add_logical_interface(r1int, r1int.name + ".0", addresses={'ip': str(host1) + "/31"})
-        r2new = r2.add_logical_interface(r2int, r2int.name + ".0", addresses={'ip': str(host2) + "/31"})
-        r1new.te_metric = te_metric
-        r2new.te_metric = te_metric
+    @staticmethod
+    def _ring_links(count):
+        links = [(idx, idx + 1) for idx in range(count - 1)]
+        if count > 2:
+            links.append((count - 1, 0))
+        return links
 
-        self.logger.info(f"Linked {r1.hostname}/{r1new.name} to {r2.hostname}/{r2new.name}")
+    def build_ring(self, count, prefix="r", **kwargs):
+        """
+        count routers, each linked to the next and the last back to
+        the first. Takes cluster_name, latency_ms and te_metric as for
+        link_router_pair()
+        """
+        links = Topology._ring_links(count)
+        return self._build([f"{prefix}{idx}" for idx in range(count)], links, **kwargs)
 
-        return r1int.connect(r2int, latency_ms=latency_ms)
+    def build_grid(self, rows, columns, prefix="r", **kwargs):
+        """
+        rows x columns routers, each linked to the ones beside and
+        below it. Returned row by row
+        """
+        links = []
+        for row in range(rows):
+            for column in range(columns):
+                idx = row * columns + column
+                if column + 1 < columns:
+                    links.append((idx, idx + 1))
+                if row + 1 < rows:
+                    links.append((idx, idx + columns))
+        names = [f"{prefix}{row}-{column}"
+                 for row in range(rows) for column in range(columns)]
+        return self._build(names, links, **kwargs)
+
+    def build_clos(self, spines, leaves, **kwargs):
+        """
+        Two tier leaf and spine fabric with every leaf linked to every
+        spine. Returns (spine routers, leaf routers)
+        """
+        links = [(spines + leaf, spine)
+                 for leaf in range(leaves) for spine in range(spines)]
+        names = ([f"spine{idx}" for idx in range(spines)] +
+                 [f"leaf{idx}" for idx in range(leaves)])
+        routers = self._build(names, links, **kwargs)
+        return routers[:spines], routers[spines:]
+
+    def build_random(self, count, degree=3, seed=None, prefix="r", **kwargs):
+        """
+        count routers in a ring (so it is always connected) with random
+        links added until the average degree is reached. Without a
+        seed the topology's own random source is used
+        """
+        rng = self.context.random if seed is None else random.Random(seed)
+
+        links = Topology._ring_links(count)
+        seen = set(links)
+        extra = min(count * max(degree - 2, 0) // 2,
+                    count * (count - 1) // 2 - len(links))
+        while extra > 0:
+            a, b = rng.randrange(count), rng.randrange(count)
+            if a == b or (a, b) in seen or (b, a) in seen:
+                continue
+            seen.add((a, b))
+            links.append((a, b))
+            extra -= 1
+
+        return self._build([f"{prefix}{idx}" for idx in range(count)], links, **kwargs)
 
     # Go through each router we know about and enable IS-IS on each
     # of its current interfaces
@@ -314,28 +439,94 @@ class Topology():
     # which can then be passed into any number of things that
     # might care
     # Returns list of (aggregator, event)
-    def run_another(self, relative_ticks):
-        return self.run_until(self.clock.clockfn() + relative_ticks)
+    def run_another(self, relative_ticks, stream=False, raise_errors=False):
+        return self.run_until(self.clock.clockfn() + relative_ticks, stream=stream,
+                              raise_errors=raise_errors)
 
     # Returns list of (aggregator, event)
-    def run_until(self, tick):
+    def run_until(self, tick, stream=False, raise_errors=False):
         """
         Run simulation of this topology until tick has been reached
+
+        With stream=True nothing is run straight away, instead a
+        generator is returned which runs the simulation a tick at a
+        time as it is iterated, handing over each tick's events as it
+        goes. Events don't pile up, so this is the way to go for long
+        runs:
+
+            for name, evt in topology.run_another(3600 * 1000, stream=True):
+                ...
+
+        Stopping the iteration early leaves the simulation at whatever
+        tick it had got to.
+
+        An exception raised by anything in the simulation is logged and
+        the run stops there, unless raise_errors is set in which case
+        it is passed on to the caller
         """
         # for now we assume each time we run more we want to dump
         # the collected events
         self.collector.clear()
+        if stream:
+            return self._stream_until(tick, raise_errors)
+
+        try:
+            self.context.run_until(tick)
+        except Exception as e:
+            self.logger.exception("Caught exception during run")
+            if raise_errors:
+                raise
+
+        return self.collector.take()
+
+    def _stream_until(self, tick, raise_errors=False):
+        queue = self.context.queue
         try:
-            delay = GlobalQueueManager.run()
-            while self.clock.clockfn() < tick:
-                if delay is None:
-                    delay = 1
-                self.clock.delayfn(delay)
-                delay = GlobalQueueManager.run()
+            while True:
+                when = queue.next_time()
+                if when is None or when > tick:
+                    break
+                self.context.run_until(when)
+                yield from self.collector.take()
+
+            self.context.run_until(tick)
         except Exception as e:
             self.logger.exception("Caught exception during run")
+            if raise_errors:
+                raise
 
-        return copy.copy(self.collector.events())
+        yield from self.collector.take()
 
     def schedule(self, delay, func):
-        GlobalQueueManager.enqueue(delay, func)
+        self.context.enqueue(delay, func)
+
+    def enable_profiling(self, reset=False):
+        """
+        Start timing every callback the simulation runs, by device and
+        handler. Carries on adding to what was recorded before unless
+        reset is set
+        """
+        if self.profiler is None:
+            self.profiler = Profiler()
+        elif reset:
+            self.profiler.clear()
+        self.context.queue.profiler = self.profiler
+        return self.profiler
+
+    def disable_profiling(self):
+        self.context.queue.profiler = None
+
+    def profile_report(self, device=None, limit=None):
+        """
+        ProfileEntry (device, handler, calls, total/max/mean time) for
+        everything timed since profiling was enabled, most expensive
+        first
+        """
+        if self.profiler is None:
+            return []
+        report = self.profiler.report()
+        if device is not None:
+            report = [entry for entry in report if entry.device == device]
+        if limit is not None:
+            report = report[:limit]
+        return report
@@ -0,0 +1,321 @@
+"""
+Compact on-disk traces of simulation events
+
+Events hold on to routers, interfaces and packets, so they can't
+sensibly be kept around (or pickled) once a run is over. A trace keeps
+just what is needed to analyze a run offline: the tick, the device,
+the event type and sub_type, the source and the message.
+
+    with TraceWriter("convergence.trace") as trace:
+        trace.extend(topology.run_another(60 * 1000, stream=True))
+
+    with TraceReader("convergence.trace") as trace:
+        for record in trace.query(device="r5",
+                                  event_type=EventType.ROUTE_CHANGE,
+                                  start=1000, end=5000):
+            print(record.when, record.msg)
+
+The file is a sequence of blocks. Names (devices, sub_types, sources)
+are written once into name blocks and referred to by id. Events are
+written in blocks of up to block_size, each stored column by column
+(all the ticks, then all the devices, ...) together with the range of
+ticks it covers. The reader memory-maps the file and looks at the
+columns in place, so a query only touches the blocks in its time
+range and only decodes the rows which match.
+"""
+from array import array
+from collections import namedtuple
+import mmap
+import struct
+from .observers import EventType
+
+
+MAGIC = b"RSTRACE1"
+
+# kind, length of what follows. Everything is padded to 8 bytes so the
+# columns can be viewed in place
+_BLOCK = struct.Struct("<4sI")
+# count, (padding), min tick, max tick
+_EVENTS = struct.Struct("<IIdd")
+# first id, count
+_NAMES = struct.Struct("<II")
+
+NAMES_BLOCK = b"NAME"
+EVENTS_BLOCK = b"EVTS"
+
+
+TraceRecord = namedtuple(
+    "TraceRecord", ["when", "device", "event_type", "sub_type", "source", "msg"])
+
+
+def _pad(length):
+    return -length % 8
+
+
+def _describe(source):
+    # Anything without a __str__ of its own would be recorded by its
+    # address, which would make two traces of the same run differ
+    cls = type(source)
+    if cls.__str__ is object.__str__ and cls.__repr__ is object.__repr__:
+        return cls.__name__
+    return str(source)
+
+
+class TraceWriter:
+    """
+    Appends (aggregator name, event) pairs, as handed out by
+    Topology.run_until(), to a trace file
+    """
+
+    def __init__(self, path, block_size=4096):
+        self.path = path
+        self.block_size = block_size
+        self._file = open(path, "wb")
+        self._file.write(MAGIC)
+
+        self._names = {}
+        self._new_names = []
+
+        self._when = array("d")
+        self._device = array("I")
+        self._event_type = array("I")
+        self._sub_type = array("I")
+        self._source = array("I")
+        self._msgs = []
+
+        self.count = 0
+
+    def _name(self, name):
+        name_id = self._names.get(name)
+        if name_id is None:
+            name_id = len(self._names)
+            self._names[name] = name_id
+            self._new_names.append(name)
+        return name_id
+
+    def write(self, aggregator_name, evt):
+        self._when.append(evt.when)
+        self._device.append(self._name(aggregator_name))
+        self._event_type.append(evt.event_type.value)
+        self._sub_type.append(self._name(str(evt.sub_type)))
+        self._source.append(self._name(_describe(evt.source)))
+        self._msgs.append(str(evt.msg).encode())
+        self.count += 1
+
+        if len(self._when) >= self.block_size:
+            self.flush()
+
+    def extend(self, events):
+        for aggregator_name, evt in events:
+            self.write(aggregator_name, evt)
+
+    def flush(self):
+        if len(self._new_names) > 0:
+            self._write_names()
+        if len(self._when) > 0:
+            self._write_events()
+        self._file.flush()
+
+    def _write_names(self):
+        first_id = len(self._names) - len(self._new_names)
+        payload = bytearray(_NAMES.pack(first_id, len(self._new_names)))
+        for name in self._new_names:
+            encoded = name.encode()
+            payload += struct.pack("<I", len(encoded))
+            payload += encoded
+        self._write_block(NAMES_BLOCK, payload)
+        self._new_names = []
+
+    def _write_events(self):
+        offsets = array("I", [0])
+        for msg in self._msgs:
+            offsets.append(offsets[-1] + len(msg))
+
+        payload = bytearray(_EVENTS.pack(
+            len(self._when), 0, min(self._when), max(self._when)))
+        for column in (self._when, self._device, self._event_type,
+                       self._sub_type, self._source, offsets):
+            payload += column.tobytes()
+        payload += b"".join(self._msgs)
+        self._write_block(EVENTS_BLOCK, payload)
+
+        for column in (self._when, self._device, self._event_type,
+                       self._sub_type, self._source):
+            del column[:]
+        self._msgs = []
+
+    def _write_block(self, kind, payload):
+        payload += bytes(_pad(len(payload)))
+        self._file.write(_BLOCK.pack(kind, len(payload)))
+        self._file.write(payload)
+
+    def close(self):
+        if self._file.closed:
+            return
+        self.flush()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class _EventBlock:
+    """
+    Views onto the columns of one block of events, straight out of
+    the mapped file
+    """
+
+    def __init__(self, view, start):
+        count, _, self.min_when, self.max_when = _EVENTS.unpack_from(view, start)
+        self.count = count
+
+        offset = start + _EVENTS.size
+        self.when = view[offset:offset + 8 * count].cast("d")
+        offset += 8 * count
+
+        columns = []
+        for _ in range(4):
+            columns.append(view[offset:offset + 4 * count].cast("I"))
+            offset += 4 * count
+        self.device, self.event_type, self.sub_type, self.source = columns
+
+        self.offsets = view[offset:offset + 4 * (count + 1)].cast("I")
+        offset += 4 * (count + 1)
+        self.msgs = view[offset:offset + self.offsets[count]]
+
+    def msg(self, row):
+        return bytes(self.msgs[self.offsets[row]:self.offsets[row + 1]]).decode()
+
+    def release(self):
+        for column in (self.when, self.device, self.event_type, self.sub_type,
+                       self.source, self.offsets, self.msgs):
+            column.release()
+
+
+class TraceReader:
+    """
+    Reads a trace written by TraceWriter. Only the block headers and
+    names are read up front, events are decoded as they are asked for
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._file = open(path, "rb")
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ)
+        self._view = memoryview(self._map)
+
+        self.names = []
+        self._ids = {}
+        self._blocks = []
+
+        if bytes(self._view[:len(MAGIC)]) != MAGIC:
+            self.close()
+            raise ValueError(f"{path} is not a routersim trace")
+
+        offset = len(MAGIC)
+        while offset < len(self._view):
+            kind, length = _BLOCK.unpack_from(self._view, offset)
+            offset += _BLOCK.size
+            if kind == NAMES_BLOCK:
+                self._read_names(offset)
+            elif kind == EVENTS_BLOCK:
+                self._blocks.append(_EventBlock(self._view, offset))
+            offset += length
+
+    def _read_names(self, offset):
+        _, count = _NAMES.unpack_from(self._view, offset)
+        offset += _NAMES.size
+        for _ in range(count):
+            (length, ) = struct.unpack_from("<I", self._view, offset)
+            offset += 4
+            name = bytes(self._view[offset:offset + length]).decode()
+            offset += length
+            self._ids[name] = len(self.names)
+            self.names.append(name)
+
+    def __len__(self):
+        return sum(block.count for block in self._blocks)
+
+    def __iter__(self):
+        return self.query()
+
+    def devices(self):
+        devices = set()
+        for block in self._blocks:
+            devices.update(block.device)
+        return sorted(self.names[device] for device in devices)
+
+    def query(self, device=None, event_type=None, sub_type=None,
+              start=None, end=None):
+        """
+        Records matching everything given, in the order they were
+        written. start and end are inclusive ticks
+
+        sub_types are written (and returned) as strings, so the ints
+        some events use (ICMP types) are looked up as strings too
+        """
+        if sub_type is not None:
+            sub_type = str(sub_type)
+        wanted = []
+        for column, value in (("device", device), ("sub_type", sub_type)):
+            if value is not None:
+                if value not in self._ids:
+                    return
+                wanted.append((column, self._ids[value]))
+        if event_type is not None:
+            wanted.append(("event_type", event_type.value))
+
+        for block in self._blocks:
+            if start is not None and block.max_when < start:
+                continue
+            if end is not None and block.min_when > end:
+                continue
+
+            rows = range(block.count)
+            for column, value in wanted:
+                values = getattr(block, column)
+                rows = [row for row in rows if values[row] == value]
+            if start is not None or end is not None:
+                when = block.when
+                rows = [row for row in rows
+                        if (start is None or when[row] >= start) and
+                           (end is None or when[row] <= end)]
+
+            for row in rows:
+                yield self._record(block, row)
+
+    def _record(self, block, row):
+        return TraceRecord(
+            block.when[row],
+            self.names[block.device[row]],
+            EventType(block.event_type[row]),
+            self.names[block.sub_type[row]],
+            self.names[block.source[row]],
+            block.msg(row))
+
+    def close(self):
+        for block in self._blocks:
+            block.release()
+        self._blocks = []
+        self._view.release()
+        self._map.close()
+        self._file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def write_trace(path, events, block_size=4096):
+    """
+    Write events ((aggregator name, event) pairs) to path, returning
+    how many were written
+    """
+    with TraceWriter(path, block_size=block_size) as trace:
+        trace.extend(events)
+        return trace.count
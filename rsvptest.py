@@ -0,0 +1,238 @@
+"""
+RSVP soft state (routersim.rsvp.process): state along a failed link
+times out and the ingress signals the LSP again some other way, RFC 2961
+refresh reduction keeps the same LSPs up with far fewer messages, and a
+neighbor which doesn't recognise a MESSAGE_ID is sent the whole thing
+
+    python rsvptest.py
+    python -m pytest rsvptest.py
+"""
+from routersim.messaging import IPProtocol
+from routersim.observers import EventType
+from routersim.packets import ipv4
+from routersim.rsvp.object import FilterSpec
+from routersim.rsvp.pdu import Resv
+from routersim.topology import Topology
+import logging
+
+
+def converged_ring(count, refresh_reduction=True):
+    topology = Topology("rsvptest", seed=1, collect_events=False)
+    routers = topology.build_ring(count)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(30000)
+    for router in routers:
+        router.process['rsvp'].refresh_reduction = refresh_reduction
+    topology.rsvp_start_all()
+    return topology, routers
+
+
+def lsps_up(routers):
+    """
+    (ingress, LSP name) for every LSP with a route installed at its
+    ingress
+    """
+    return sorted((router.hostname, route.lsp_name)
+                  for router in routers
+                  for routes in router.routing.tables['rsvp'].values()
+                  for route in routes)
+
+
+def lsp_route(router, lsp_name):
+    for routes in router.routing.tables['rsvp'].values():
+        for route in routes:
+            if route.lsp_name == lsp_name:
+                return route
+    return None
+
+
+def transits(routers, lsp_name):
+    return [router.hostname for router in routers
+            if any(psb.attributes.name == lsp_name and psb.label_route is not None
+                   for psb in router.process['rsvp'].path_state.values())]
+
+
+def listen_for(routers, sub_type):
+    seen = []
+    for router in routers:
+        router.event_manager.listen(
+            EventType.RSVP,
+            lambda evt, router=router: seen.append((router.hostname, evt.when)),
+            sub_type=sub_type)
+    return seen
+
+
+def test_failed_link_times_out_and_resignals():
+    topology, routers = converged_ring(4)
+    routers[0].create_lsp("lsp", routers[2].loopback_address)
+    topology.run_another(5000)
+    assert lsp_route(routers[0], "lsp").next_hop_ip == routers[1].interface('et1').logical().address().ip
+    assert transits(routers, "lsp") == ["r1"]
+
+    timeouts = listen_for(routers, "STATE_TIMEOUT")
+    failed_at = topology.clock.clockfn()
+    routers[1].interface('et2').link.down()
+
+    # Nothing comes back along the old path, so it all times out (the
+    # lifetime is 157.5s) and the ingress tries again round the other way
+    topology.run_another(150000)
+    assert timeouts == []
+    topology.run_another(300000)
+    assert set(hostname for hostname, _ in timeouts) == {"r0", "r1", "r2"}
+    # Counted from the last refresh before the failure, which could have
+    # been up to one and a half refresh intervals earlier
+    first = min(when for _, when in timeouts)
+    assert failed_at + 157500 - 45000 <= first <= failed_at + 157500 + 1000
+
+    route = lsp_route(routers[0], "lsp")
+    assert route is not None
+    assert route.next_hop_ip == routers[3].interface('et2').logical().address().ip
+    assert transits(routers, "lsp") == ["r3"]
+    # Nothing left on r1 for the LSP it's no longer part of
+    assert len(routers[1].process['rsvp'].path_state) == 0
+
+    # And it stays up
+    topology.run_another(300000)
+    assert lsps_up(routers) == [("r0", "lsp")]
+
+
+def test_srefresh_unknown_message_id_nacked():
+    topology, routers = converged_ring(4)
+    routers[0].create_lsp("lsp", routers[2].loopback_address)
+    topology.run_another(100000)
+    ingress = routers[0].process['rsvp']
+    transit = routers[1].process['rsvp']
+    assert ingress.sent['Srefresh'] > 0
+    assert ingress.received.get('Ack', 0) == 0
+    paths_sent = ingress.sent['Path']
+
+    # As though r1 had restarted and lost track of what the IDs were for
+    transit._received_ids.clear()
+    topology.run_another(60000)
+
+    assert transit.sent['Ack'] > 0
+    assert ingress.received['Ack'] > 0
+    # The whole Path again, which r1 takes as a refresh
+    assert ingress.sent['Path'] > paths_sent
+    assert len(transit._received_ids) > 0
+
+    topology.run_another(300000)
+    assert lsps_up(routers) == [("r0", "lsp")]
+    assert transits(routers, "lsp") == ["r1"]
+
+
+def full_mesh(refresh_reduction):
+    topology, routers = converged_ring(6, refresh_reduction=refresh_reduction)
+    for ingress in routers:
+        for egress in routers:
+            if ingress is not egress:
+                ingress.create_lsp(f"{ingress.hostname}-{egress.hostname}",
+                                   egress.loopback_address)
+    topology.run_another(10000)
+
+    up = []
+    for _ in range(9):
+        topology.run_another(100000)
+        up.append(lsps_up(routers))
+    sent = sum(sum(router.process['rsvp'].sent.values()) for router in routers)
+    return up, sent
+
+
+def test_same_lsps_up_with_and_without_refresh_reduction():
+    plain, plain_sent = full_mesh(False)
+    reduced, reduced_sent = full_mesh(True)
+    for up in plain + reduced:
+        assert len(up) == 30
+    assert plain == reduced
+    # Most refreshes are a single Srefresh per neighbor instead
+    assert reduced_sent * 3 < plain_sent
+
+
+def test_resv_before_path():
+    topology, routers = converged_ring(4)
+    routers[0].create_lsp("lsp", routers[2].loopback_address)
+    session = routers[0].process['rsvp'].sessions[-1]
+
+    # Still on its way, so r1 has no Path state for what r2 sends
+    transit = routers[1]
+    interface = transit.interface('et2').logical()
+    neighbor = routers[2].interface('et1').logical().address().ip
+    resv = Resv(session.session, FilterSpec(session.source_ip, session.lsp_id))
+    resv.set_label(1000)
+    resv.set_hop(neighbor)
+    transit.process['rsvp'].process_packet(interface, ipv4(
+        dst=interface.address().ip,
+        src=neighbor,
+        proto=IPProtocol.RSVP) / resv)
+    assert len(transit.process['rsvp'].resv_state) == 0
+
+    topology.run_another(5000)
+    assert lsps_up(routers) == [("r0", "lsp")]
+    assert transits(routers, "lsp") == ["r1"]
+
+
+def test_bypasses_dont_ask_for_local_repair():
+    topology, routers = converged_ring(5)
+    for router in routers:
+        router.create_lsp(f"{router.hostname}-far", routers[(routers.index(router) + 2) % 5].loopback_address,
+                          link_protection=True)
+    topology.run_another(30000)
+
+    bypasses = {}
+    for router in routers:
+        for psb in router.process['rsvp'].path_state.values():
+            if psb.type == 'bypass':
+                assert not psb.attributes.local_repair, psb.attributes.name
+                bypasses.setdefault(router.hostname, set()).add(psb.attributes.name)
+    # One round each link the protected LSPs leave by
+    assert sum(len(names) for names in bypasses.values()) > 0
+    for names in bypasses.values():
+        assert len(names) <= 2
+
+    topology.run_another(600000)
+    assert len(lsps_up(routers)) == 5
+    for router in routers:
+        sessions = [session for session in router.process['rsvp'].sessions
+                    if session.protected_ip is not None]
+        assert len(sessions) == len(bypasses.get(router.hostname, ()))
+
+
+def test_bypasses_go_with_the_lsps_they_protect():
+    topology, routers = converged_ring(5)
+    routers[0].create_lsp("protected", routers[2].loopback_address, link_protection=True)
+    routers[0].create_lsp("other", routers[2].loopback_address, link_protection=True)
+    topology.run_another(30000)
+
+    def bypasses():
+        return {router.hostname: sorted(session.lsp_name for session in router.process['rsvp'].sessions
+                                        if session.protected_ip is not None)
+                for router in routers}
+
+    # Round r0-r1 and r1-r2, for both LSPs
+    before = bypasses()
+    assert [hostname for hostname, names in before.items() if len(names) > 0] == ["r0", "r1"]
+    assert len(before["r0"]) == 1 and len(before["r1"]) == 1
+
+    # Still wanted by the other one
+    routers[0].delete_lsp("protected")
+    topology.run_another(30000)
+    assert bypasses() == before
+    assert lsps_up(routers) == [("r0", "other")]
+
+    routers[0].delete_lsp("other")
+    topology.run_another(30000)
+    for router in routers:
+        rsvp = router.process['rsvp']
+        assert rsvp.sessions == [], router.hostname
+        assert len(rsvp.path_state) == 0, router.hostname
+        assert len(router.routing.tables['mpls']) == 0, router.hostname
+        assert len(router.labels) == 0, router.hostname
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -1,6 +1,7 @@
 from routersim.observers import EventType
+from routersim.messaging import FrameType
 from plantuml import Sequence, ObjectDiagram, ComponentDiagram
-from scapy.layers.l2 import Ether
+from routersim.packets import EtherFrame, is_scapy
 
 def topology_diagram(title, topo_data, events=None):
     diagram = ObjectDiagram(title)
@@ -133,7 +134,7 @@ def isis_sequence_add_event(sequence, src_name, evt, start_time=0):
 
 
     if evt.event_type == EventType.PACKET_SEND:
-        notefn = getattr(evt.object.pdu, "seq_note", None)
+        notefn = getattr(evt.object.payload, "seq_note", None)
         if notefn is not None:
             note = notefn()
         else:
@@ -152,7 +153,7 @@ def isis_sequence_add_event(sequence, src_name, evt, start_time=0):
 
         sequence.actor(src_name).send_message(
             sequence.actor(hostname),
-            f"[{evt.when-start_time}] {evt.object.pdu}",
+            f"[{evt.when-start_time}] {evt.object.payload}",
             note=note
         )
     elif evt.event_type == EventType.ISIS:
@@ -181,7 +182,7 @@ def frame_sequence_add_event(sequence, src_name, evt, start_time=0,l3=True):
 
     if evt.event_type == EventType.PACKET_SEND:
 
-        if not isinstance(evt.object, Ether):
+        if not (isinstance(evt.object, EtherFrame) or is_scapy(evt.object, 'Ether')):
             return
 #        if evt.object.type.name == 'CLNS':
 #            return
@@ -223,10 +224,10 @@ def packet_sequence_add_event(sequence, src_name, evt, start_time=0):
 
     if evt.event_type == EventType.PACKET_SEND:
 
-        if evt.object.type.name == 'CLNS':
+        if evt.object.type == FrameType.CLNS:
             return
 
-        notefn = getattr(evt.object.pdu, "seq_note", None)
+        notefn = getattr(evt.object.payload, "seq_note", None)
         if notefn is not None:
             note = notefn()
         else:
@@ -245,7 +246,7 @@ def packet_sequence_add_event(sequence, src_name, evt, start_time=0):
 
         sequence.actor(src_name).send_message(
             sequence.actor(f"{hostname}"),
-            f"[{evt.when-start_time}] {evt.object.pdu}",
+            f"[{evt.when-start_time}] {evt.object.payload}",
             note=note
         )
     elif evt.event_type == EventType.MPLS:
@@ -264,9 +265,9 @@ def rsvp_sequence_add_event(sequence, src_name, evt):
     # TODO: Dynamically discover group membership
 
     if evt.event_type == EventType.PACKET_SEND:
-        if evt.object.type.name == 'CLNS':
+        if evt.object.type == FrameType.CLNS:
             return
-        notefn = getattr(evt.object.pdu, "seq_note", None)
+        notefn = getattr(evt.object.payload, "seq_note", None)
         if notefn is not None:
             note = notefn()
         else:
@@ -292,7 +293,7 @@ def rsvp_sequence_add_event(sequence, src_name, evt):
 
         sequence.actor(src_name).send_message(
             sequence.actor(hostname),
-            evt.object.pdu,
+            evt.object.payload,
             note=note
         )
     elif evt.event_type == EventType.RSVP:
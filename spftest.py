@@ -0,0 +1,116 @@
+"""
+Keeping the SPF tree up to date (iSPF for link changes, PRC for prefix
+changes) should always end up where a full run from scratch does
+
+    python spftest.py
+    python -m pytest spftest.py
+"""
+from routersim.isis.spf import SPFGraph, ShortestPathTree
+from routersim.isis.synthetic import generate_database, system_id, flap_prefix, change_metric
+from routersim.observers import EventType
+from routersim.topology import Topology
+import logging
+import random
+
+
+def remove_link(database, rng):
+    """
+    Drop one link in both directions, returning the system ids involved
+    """
+    lsp = database[rng.choice(sorted(database))].pdu
+    neighbor = rng.choice(lsp.neighbors)
+    lsp.tlvs.remove(neighbor)
+    far = database[neighbor.system_id].pdu
+    for other in far.neighbors:
+        if other.system_id == lsp.source_address:
+            far.tlvs.remove(other)
+            break
+    return [lsp.source_address, neighbor.system_id]
+
+
+def tree_state(spt):
+    return (spt.distance, spt.parent, spt.prefix_distance, spt.prefix_node, spt.paths)
+
+
+def apply(database, graph, spt, dirty):
+    topology_changes = {}
+    prefix_changes = set()
+    for system in dirty:
+        old_links, prefixes = graph.update(system, database[system].pdu)
+        if old_links is not None:
+            topology_changes[graph.index[system]] = old_links
+        prefix_changes.update(prefixes)
+    return spt.update(topology_changes, prefix_changes)
+
+
+def check_incremental(mutations, size=200, changes=40, seed=0):
+    rng = random.Random(seed)
+    database = generate_database(size, seed=seed)
+    root = system_id(0)
+    graph = SPFGraph(database)
+    spt = ShortestPathTree(graph, root)
+
+    for step in range(changes):
+        before = ShortestPathTree(SPFGraph(database), root)
+        mutate = mutations[step % len(mutations)]
+        _, changed_prefixes = apply(database, graph, spt, mutate(database, rng))
+
+        full = ShortestPathTree(SPFGraph(database), root)
+        assert tree_state(spt) == tree_state(full), f"{mutate.__name__} at step {step}"
+
+        # Everything whose result moved has to be reported, or it
+        # wouldn't be re-installed
+        for prefix in before.prefix_distance.keys() | full.prefix_distance.keys():
+            moved = (before.prefix_distance.get(prefix) != full.prefix_distance.get(prefix) or
+                     before.prefix_node.get(prefix) != full.prefix_node.get(prefix))
+            if moved:
+                assert prefix in changed_prefixes, f"{prefix} missed at step {step}"
+
+
+def test_prc_matches_full_spf():
+    check_incremental([flap_prefix])
+
+
+def test_ispf_matches_full_spf():
+    check_incremental([change_metric])
+
+
+def test_ispf_after_links_removed():
+    check_incremental([remove_link, change_metric, flap_prefix], changes=30, seed=1)
+
+
+def test_process_routes_match_full_run():
+    topology = Topology("spftest", seed=1, collect_events=False)
+    routers = topology.build_grid(3, 3)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(30000)
+
+    runs = []
+    for router in routers:
+        router.event_manager.listen(
+            EventType.ISIS, lambda evt: runs.append(evt.sub_type),
+            sub_type=("ISPF_RUN", "PRC_RUN"))
+
+    routers[4].interface('et1').link.down()
+    topology.run_another(30000)
+    assert "ISPF_RUN" in runs
+
+    for router in routers:
+        isis = router.process['isis']
+        incremental = (dict(isis.address_distances), dict(isis.address_paths),
+                       {prefix: [str(route) for route in routes]
+                        for prefix, routes in router.routing.tables['isis'].items()})
+        isis.run_full_dijkstra()
+        full = (dict(isis.address_distances), dict(isis.address_paths),
+                {prefix: [str(route) for route in routes]
+                 for prefix, routes in router.routing.tables['isis'].items()})
+        assert incremental == full, router.hostname
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,101 @@
+"""
+Sweeping link failures over a topology (routersim.sweep) gives the same
+results however many workers it's spread over, and reports what
+changed in the FIBs and whatever went wrong
+
+    python sweeptest.py
+    python -m pytest sweeptest.py
+"""
+from routersim.sweep import Scenario, fail_link, fib_diff, link_failure_scenarios, run_sweep
+from routersim.topology import Topology
+import logging
+
+
+SETTLE_TICKS = 15000
+RUN_TICKS = 15000
+
+
+# Module level, so the workers can be sent them
+def build_ring(seed):
+    topology = Topology("sweeptest", seed=seed, collect_events=False)
+    topology.build_ring(4)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    return topology
+
+
+def fail_later(topology):
+    def fail():
+        raise RuntimeError("failed mid-run")
+    topology.schedule(100, fail)
+
+
+def sweep(scenarios, max_workers):
+    return run_sweep(build_ring, scenarios, base_seed=10, max_workers=max_workers,
+                     settle_ticks=SETTLE_TICKS, run_ticks=RUN_TICKS)
+
+
+def test_same_results_with_more_workers():
+    scenarios = link_failure_scenarios(build_ring(0))
+    assert len(scenarios) == 4
+
+    results = sweep(scenarios, 1)
+    assert [result.name for result in results] == [scenario.name for scenario in scenarios]
+    assert [result.seed for result in results] == [10, 11, 12, 13]
+    for result in results:
+        assert result.error is None, result.error
+        assert result.convergence_tick is not None
+        assert len(result.fib_diff) > 0
+
+    assert sweep(scenarios, 2) == results
+
+
+def test_fib_diff_has_failed_link():
+    result = sweep([fail_link("r0", "et1")], 1)[0]
+    assert result.error is None, result.error
+
+    topology = build_ring(0)
+    r0 = topology.routers()[0]
+    network = str(r0.interface('et1.0').address().network)
+
+    # Both ends lose the connected /31, and everyone else the route to it
+    for hostname in ("r0", "r1", "r2", "r3"):
+        assert network in result.fib_diff[hostname]['removed'], hostname
+        assert len(result.fib_diff[hostname]['changed']) > 0
+    assert str(r0.interface('et1.0').address().ip) + "/32" in result.fib_diff["r0"]['removed']
+
+
+def test_fib_diff():
+    before = {"r1": {"10.0.0.0/24": "via et1", "10.0.1.0/24": "via et1", "10.0.2.0/24": "via et2"},
+              "r2": {"10.0.0.0/24": "via et1"}}
+    after = {"r1": {"10.0.0.0/24": "via et2", "10.0.2.0/24": "via et2", "10.0.3.0/24": "via et1"},
+             "r2": {"10.0.0.0/24": "via et1"},
+             "r3": {"10.0.0.0/24": "via et1"}}
+    assert fib_diff(before, after) == {
+        "r1": {'added': {"10.0.3.0/24": "via et1"},
+               'removed': {"10.0.1.0/24": "via et1"},
+               'changed': {"10.0.0.0/24": ("via et1", "via et2")}},
+        "r3": {'added': {"10.0.0.0/24": "via et1"}, 'removed': {}, 'changed': {}},
+    }
+    assert fib_diff(before, before) == {}
+
+
+def test_failing_scenarios_reported():
+    scenarios = [fail_link("r9", "et1"),
+                 fail_link("r0", "et1"),
+                 Scenario("fail later", fail_later)]
+    for max_workers in (1, 2):
+        results = sweep(scenarios, max_workers)
+        assert len(results) == 3
+        assert "r9" in results[0].error
+        assert results[1].error is None
+        assert len(results[1].fib_diff) > 0
+        assert "failed mid-run" in results[2].error
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
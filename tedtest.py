@@ -0,0 +1,282 @@
+"""
+The TED and CSPF (routersim.isis.ted) against working the paths out by
+hand on a generated database, and the cached trees being thrown away
+when (and only when) the links change
+
+    python tedtest.py
+    python -m pytest tedtest.py
+"""
+from routersim.isis.spf import SPFGraph, ShortestPathTree
+from routersim.isis.synthetic import generate_database, system_id, router_id
+from routersim.isis.synthetic import flap_prefix, change_metric
+from routersim.isis.ted import Constraints, NO_CONSTRAINTS, TELink, TrafficEngineeringDatabase
+import ipaddress
+import logging
+import random
+
+
+RED, GREEN, BLUE = 0x1, 0x2, 0x4
+MBPS = 10**6
+
+
+def link(admin_group=0, bandwidth=None, local_ip="100.64.0.0", remote_ip="100.64.0.1"):
+    return TELink(ipaddress.ip_address(local_ip), ipaddress.ip_address(remote_ip),
+                  system_id(1), 10, admin_group, bandwidth)
+
+
+def te_database(size=40, seed=0):
+    """
+    A generated database with admin groups and bandwidths on its links,
+    the same in both directions
+    """
+    rng = random.Random(seed)
+    database = generate_database(size, degree=4, seed=seed)
+    attributes = {}
+    for lsp_id in sorted(database):
+        for neighbor in database[lsp_id].pdu.neighbors:
+            key = frozenset((lsp_id, neighbor.system_id))
+            if key not in attributes:
+                attributes[key] = (rng.choice([0, RED, GREEN, RED | GREEN, BLUE]),
+                                   rng.choice([None, 10 * MBPS, 100 * MBPS, 1000 * MBPS]))
+            neighbor.set_te_attributes(*attributes[key])
+    return database
+
+
+def ted_for(database):
+    ted = TrafficEngineeringDatabase(database)
+    for lsp_id in database:
+        ted.changed(lsp_id)
+    ted.sync()
+    return ted
+
+
+def shortest_distances(ted, source, constraints):
+    """
+    Plain Dijkstra over the TED's links, without the heap
+    """
+    distance = {source: 0}
+    done = set()
+    while True:
+        candidates = [(dist, node) for node, dist in distance.items() if node not in done]
+        if len(candidates) == 0:
+            return distance
+        dist, node = min(candidates)
+        done.add(node)
+        for te_link in ted.nodes[node]:
+            neighbor = ted.router_ids.get(te_link.remote_system)
+            if neighbor is None or neighbor in constraints.exclude_nodes:
+                continue
+            if not constraints.allows(te_link):
+                continue
+            if neighbor not in distance or dist + te_link.metric < distance[neighbor]:
+                distance[neighbor] = dist + te_link.metric
+
+
+def path_cost(ted, source, ero, constraints):
+    """
+    Cost of following ero from source, checking every link on the way
+    satisfies constraints
+    """
+    node = source
+    cost = 0
+    for address in ero:
+        te_link = [te_link for te_link in ted.nodes[node] if te_link.remote_ip == address]
+        assert len(te_link) == 1, f"{node} has no link to {address}"
+        te_link = te_link[0]
+        assert constraints.allows(te_link)
+        node = ted.router_ids[te_link.remote_system]
+        assert node not in constraints.exclude_nodes
+        cost += te_link.metric
+    return node, cost
+
+
+def test_include_any():
+    constraints = Constraints(include_any=RED | GREEN)
+    assert constraints.allows(link(RED))
+    assert constraints.allows(link(GREEN | BLUE))
+    assert not constraints.allows(link(BLUE))
+    assert not constraints.allows(link(0))
+
+
+def test_include_all():
+    constraints = Constraints(include_all=RED | GREEN)
+    assert constraints.allows(link(RED | GREEN))
+    assert constraints.allows(link(RED | GREEN | BLUE))
+    assert not constraints.allows(link(RED))
+    assert not constraints.allows(link(0))
+
+
+def test_exclude_any():
+    constraints = Constraints(exclude_any=RED | BLUE)
+    assert constraints.allows(link(0))
+    assert constraints.allows(link(GREEN))
+    assert not constraints.allows(link(RED))
+    assert not constraints.allows(link(GREEN | BLUE))
+
+
+def test_bandwidth():
+    constraints = Constraints(bandwidth=100 * MBPS)
+    assert constraints.allows(link(bandwidth=100 * MBPS))
+    assert constraints.allows(link(bandwidth=1000 * MBPS))
+    assert not constraints.allows(link(bandwidth=10 * MBPS))
+    # Nothing advertised, so nothing to say it isn't enough
+    assert constraints.allows(link(bandwidth=None))
+    assert NO_CONSTRAINTS.allows(link(bandwidth=0))
+
+
+def test_exclude_links():
+    constraints = Constraints(exclude_links={ipaddress.ip_address("100.64.0.1")})
+    assert not constraints.allows(link(local_ip="100.64.0.0", remote_ip="100.64.0.1"))
+    # Either end
+    assert not constraints.allows(link(local_ip="100.64.0.1", remote_ip="100.64.0.0"))
+    assert constraints.allows(link(local_ip="100.64.0.2", remote_ip="100.64.0.3"))
+
+    more = constraints.excluding_link(ipaddress.ip_address("100.64.0.2"))
+    assert not more.allows(link(local_ip="100.64.0.2", remote_ip="100.64.0.3"))
+    assert constraints.allows(link(local_ip="100.64.0.2", remote_ip="100.64.0.3"))
+    # Given as a set, still usable as a cache key
+    assert hash(more) == hash(Constraints(exclude_links=frozenset(more.exclude_links)))
+
+
+def test_exclude_nodes():
+    database = te_database()
+    ted = ted_for(database)
+    source = router_id(0)
+    avoided = router_id(1)
+    constraints = Constraints(exclude_nodes={avoided})
+
+    tree = ted.tree(source, constraints)
+    assert avoided not in tree
+    for node, entry in tree.items():
+        if entry is not None:
+            assert entry[1] != avoided
+    assert ted.cspf(source, avoided, constraints) is None
+
+    # Only the path around it, not the node's own links
+    ero = ted.cspf(source, router_id(2), constraints)
+    assert ero is not None
+    assert path_cost(ted, source, ero, constraints)[0] == router_id(2)
+
+
+def test_cspf_matches_brute_force():
+    rng = random.Random(1)
+    database = te_database()
+    ted = ted_for(database)
+    nodes = [router_id(idx) for idx in range(len(database))]
+
+    choices = [
+        NO_CONSTRAINTS,
+        Constraints(include_any=RED | GREEN),
+        Constraints(include_all=RED),
+        Constraints(exclude_any=BLUE),
+        Constraints(bandwidth=100 * MBPS),
+        Constraints(exclude_any=RED, bandwidth=100 * MBPS),
+        Constraints(exclude_nodes={router_id(3), router_id(7)}),
+    ]
+    for constraints in choices:
+        for _ in range(10):
+            source, destination = rng.sample(nodes, 2)
+            distances = shortest_distances(ted, source, constraints)
+            ero = ted.cspf(source, destination, constraints)
+            if destination not in distances:
+                assert ero is None, (constraints, source, destination)
+                continue
+            assert ero is not None, (constraints, source, destination)
+            end, cost = path_cost(ted, source, ero, constraints)
+            assert end == destination
+            assert cost == distances[destination]
+
+        # Excluding a link on the way forces it elsewhere
+        source, destination = nodes[0], nodes[len(nodes) // 2]
+        ero = ted.cspf(source, destination, constraints)
+        if ero is not None:
+            avoiding = constraints.excluding_link(ero[0])
+            other = ted.cspf(source, destination, avoiding)
+            assert other is None or ero[0] not in other
+
+
+def test_unconstrained_matches_full_spf():
+    database = te_database(size=60, seed=2)
+    ted = ted_for(database)
+    for idx in (0, 17, 59):
+        spt = ShortestPathTree(SPFGraph(database), system_id(idx))
+        source = router_id(idx)
+        tree = ted.tree(source)
+        assert len(tree) == len(database)
+        for node, system in enumerate(spt.graph.nodes):
+            destination = ted.router_ids[system]
+            if destination == source:
+                assert ted.cspf(source, destination) == []
+                continue
+            end, cost = path_cost(ted, source, ted.cspf(source, destination), NO_CONSTRAINTS)
+            assert end == destination
+            assert cost == spt.distance[node], system
+
+
+def test_cache_follows_link_changes():
+    rng = random.Random(3)
+    database = te_database()
+    ted = ted_for(database)
+    source = router_id(0)
+    constraints = Constraints(exclude_any=BLUE)
+
+    tree = ted.tree(source, constraints)
+    version = ted.version
+    assert ted.tree(source, constraints) is tree
+    assert ted.statistics()['hits'] == 1
+
+    # Nothing new to look at
+    ted.sync()
+    assert ted.version == version
+
+    # Prefix changes aren't anything CSPF looks at
+    for _ in range(5):
+        for lsp_id in flap_prefix(database, rng):
+            ted.changed(lsp_id)
+        assert ted.tree(source, constraints) is tree
+        assert ted.version == version
+
+    # A metric change is
+    for lsp_id in change_metric(database, rng):
+        ted.changed(lsp_id)
+    changed = ted.tree(source, constraints)
+    assert ted.version > version
+    assert changed is not tree
+    assert ted.statistics()['cached_trees'] == 1
+    assert changed == ted_for(database).tree(source, constraints)
+    version = ted.version
+
+    # And so is an LSP going away
+    purged = system_id(5)
+    del database[purged]
+    ted.changed(purged)
+    after = ted.tree(source, constraints)
+    assert ted.version == version + 1
+    assert after is not changed
+    assert router_id(5) not in after
+    assert purged not in ted.router_ids
+    assert router_id(5) not in ted.nodes
+    assert after == ted_for(database).tree(source, constraints)
+
+    # Purging what's already gone changes nothing
+    ted.changed(purged)
+    assert ted.tree(source, constraints) is after
+    assert ted.version == version + 1
+
+
+def test_router_for_address():
+    database = te_database(size=10)
+    ted = ted_for(database)
+    for idx in range(10):
+        for neighbor in database[system_id(idx)].pdu.neighbors:
+            assert ted.router_for_address(neighbor.local_ip) == router_id(idx)
+            assert ted.router_for_address(neighbor.neighbor_ip) != router_id(idx)
+    assert ted.router_for_address(ipaddress.ip_address("192.0.2.1")) is None
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,121 @@
+"""
+Throttle (routersim.isis.throttle) backs off from initial to secondary
+and then doubling up to maximum while it keeps being triggered, and
+starts again from initial once things have been quiet
+
+    python throttletest.py
+    python -m pytest throttletest.py
+"""
+from routersim.isis.throttle import Throttle
+from routersim.observers import SimulationContext
+from routersim.topology import Topology
+import logging
+
+
+def make_throttle(initial=50, secondary=200, maximum=5000):
+    context = SimulationContext(seed=1)
+    runs = []
+    throttle = Throttle(context, lambda: runs.append(context.now()),
+                        initial=initial, secondary=secondary, maximum=maximum)
+    return context, throttle, runs
+
+
+def trigger_at(context, throttle, tick):
+    context.run_until(tick)
+    throttle.trigger()
+
+
+def test_backs_off_to_maximum():
+    context, throttle, runs = make_throttle()
+
+    # Triggered again straight after each run
+    trigger_at(context, throttle, 0)
+    for _ in range(9):
+        context.run_until(context.queue.next_time())
+        throttle.trigger()
+    context.run_until(context.queue.next_time())
+
+    gaps = [b - a for a, b in zip(runs, runs[1:])]
+    assert runs[0] == 50
+    assert gaps == [200, 400, 800, 1600, 3200, 5000, 5000, 5000, 5000]
+    assert throttle.wait == 5000
+    assert throttle.runs == 10 and throttle.triggers == 10
+    assert throttle.coalesced == 0
+
+
+def test_not_held_back_once_wait_has_passed():
+    context, throttle, runs = make_throttle()
+    trigger_at(context, throttle, 0)
+    # Well after the wait, but not long enough to count as quiet
+    trigger_at(context, throttle, 1000)
+    context.run_until(2000)
+    assert runs == [50, 1000]
+    assert throttle.wait == 400
+
+
+def test_resets_after_quiet_period():
+    context, throttle, runs = make_throttle(maximum=1000)
+    trigger_at(context, throttle, 0)
+    for _ in range(5):
+        context.run_until(context.queue.next_time())
+        throttle.trigger()
+    context.run_until(context.queue.next_time())
+    assert throttle.wait == 1000
+    # Quiet is measured from the last trigger, not the last run
+    last = throttle.last_trigger
+    assert last < runs[-1]
+
+    # Twice maximum isn't quite quiet enough...
+    trigger_at(context, throttle, last + 2000)
+    context.run_until(context.queue.next_time())
+    assert runs[-1] == last + 2000
+    assert throttle.wait == 1000
+
+    # ...but any longer is
+    last = throttle.last_trigger
+    trigger_at(context, throttle, last + 2001)
+    context.run_until(context.queue.next_time())
+    assert runs[-1] == last + 2001 + 50
+    assert throttle.wait == 200
+
+
+def test_triggers_coalesced():
+    context, throttle, runs = make_throttle()
+    for tick in range(0, 50, 5):
+        trigger_at(context, throttle, tick)
+    context.run_until(100)
+    assert runs == [50]
+
+    # Run at 50, so the next is due at 250 however often it's asked for
+    for tick in range(100, 250, 10):
+        trigger_at(context, throttle, tick)
+    context.run_until(1000)
+    assert runs == [50, 250]
+
+    stats = throttle.statistics()
+    assert stats == {'triggers': 25, 'runs': 2, 'coalesced': 23, 'wait': 400}
+    assert str(throttle) == "2 runs for 25 triggers (23 coalesced, next wait 400ms)"
+
+
+def test_isis_spf_runs_coalesced():
+    topology = Topology("throttletest", seed=1, collect_events=False)
+    routers = topology.build_grid(3, 3)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_another(30000)
+
+    for router in routers:
+        stats = router.process['isis'].throttle_statistics()
+        for name in ('spf', 'lsp'):
+            assert stats[name]['runs'] + stats[name]['coalesced'] == stats[name]['triggers']
+        # Bringing up the grid asks for far more SPF runs than it needs
+        assert stats['spf']['runs'] < stats['spf']['triggers'], router.hostname
+        assert not router.process['isis'].spf_pending
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,120 @@
+"""
+TimerWheel (routersim.timerwheel) fires every timer on the first tick at
+or after it is due, never early and at most a tick late, however far
+past the end of the wheel it was scheduled
+
+    python timertest.py
+    python -m pytest timertest.py
+"""
+from routersim.observers import SimulationContext
+from routersim.timerwheel import TimerWheel
+import logging
+import random
+
+
+def assert_on_time(fired, tick):
+    for due, when in fired:
+        assert due <= when, f"due at {due}, fired early at {when}"
+        assert when - due <= tick, f"due at {due}, fired late at {when}"
+        # On a turn of the wheel
+        assert when % tick == 0
+
+
+def test_never_early_at_most_a_tick_late():
+    context = SimulationContext(seed=1)
+    wheel = TimerWheel(context, tick=1000, slots=64)
+    rng = random.Random(1)
+    fired = []
+
+    def fire(due):
+        fired.append((due, context.now()))
+
+    scheduled = 0
+    for step in range(200):
+        context.run_until(step * 777)
+        for _ in range(10):
+            # Up to six times round the wheel, the default RSVP
+            # lifetime (157.5s) is well past one
+            delay = rng.choice([0, 1, 999, 1000, 1001, 64000, 157500,
+                                rng.randint(0, 400000)])
+            wheel.schedule(delay, fire, (context.now() + delay,))
+            scheduled += 1
+
+    context.run_until(200 * 777 + 400000 + 1000)
+    assert len(fired) == scheduled
+    assert_on_time(fired, 1000)
+    assert len(wheel) == 0
+
+
+def test_past_the_horizon():
+    context = SimulationContext(seed=1)
+    wheel = TimerWheel(context, tick=1000, slots=64)
+    fired = []
+    # Same slot, different turns of the wheel
+    for delay in (157500, 5000, 69000, 133000):
+        wheel.schedule(delay, lambda due=delay: fired.append((due, context.now())))
+
+    context.run_until(100000)
+    assert fired == [(5000, 5000), (69000, 69000)]
+    context.run_until(200000)
+    assert fired[2:] == [(133000, 133000), (157500, 158000)]
+
+
+def test_cancelled_timers_dont_fire():
+    context = SimulationContext(seed=1)
+    wheel = TimerWheel(context, tick=1000)
+    fired = []
+    timers = [wheel.schedule(delay * 1000, fired.append, (delay,)) for delay in range(1, 11)]
+    for timer in timers[::2]:
+        timer.cancel()
+    context.run_until(20000)
+    assert fired == [2, 4, 6, 8, 10]
+    assert len(wheel) == 0
+
+
+def test_stops_turning_when_empty():
+    context = SimulationContext(seed=1)
+    wheel = TimerWheel(context, tick=1000)
+    fired = []
+    wheel.schedule(3000, fired.append, (1,))
+    context.run_until(10000)
+    assert fired == [1]
+    # Nothing left on the simulation's queue
+    assert len(context.queue) == 0
+    processed = context.queue.processed
+
+    # Picks up from wherever the clock has got to
+    context.run_until(1000000)
+    assert context.queue.processed == processed
+    wheel.schedule(2500, fired.append, (2,))
+    context.run_until(1002000)
+    assert fired == [1]
+    context.run_until(1003000)
+    assert fired == [1, 2]
+
+
+def test_scheduled_from_a_timer():
+    context = SimulationContext(seed=1)
+    wheel = TimerWheel(context, tick=1000)
+    fired = []
+
+    def again(due, count):
+        fired.append((due, context.now()))
+        if count > 0:
+            delay = 30000 + count * 1234
+            wheel.schedule(delay, again, (context.now() + delay, count - 1))
+
+    wheel.schedule(0, again, (0, 20))
+    context.run_until(2000000)
+    assert len(fired) == 21
+    assert_on_time(fired, 1000)
+    # Only ever the one event on the queue
+    assert context.queue.processed < 2000000 / 1000
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
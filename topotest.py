@@ -0,0 +1,161 @@
+"""
+The generated topologies (Topology.build_ring(), build_grid(),
+build_clos() and build_random()) have the links they should, each with
+its own /31, and the free ports they're cabled from are handed out once
+
+    python topotest.py
+    python -m pytest topotest.py
+"""
+from routersim.interface import ConnectionState
+from routersim.topology import Topology
+import logging
+
+
+def topology(seed=1):
+    return Topology("topotest", seed=seed, collect_events=False)
+
+
+def links(routers):
+    found = {}
+    for router in routers:
+        for intf in router.phy_interfaces.values():
+            if intf.link is not None:
+                found[id(intf.link)] = intf.link
+    return list(found.values())
+
+
+def link_names(routers):
+    return sorted(
+        tuple(sorted((link.endpoint1.parent.hostname, link.endpoint2.parent.hostname)))
+        for link in links(routers))
+
+
+def assert_addressed(topo, routers):
+    """
+    Both ends of every link in the same /31, and no /31 used twice
+    """
+    networks = set()
+    for link in links(routers):
+        ends = [list(endpoint.interfaces.values())[0].address()
+                for endpoint in (link.endpoint1, link.endpoint2)]
+        assert ends[0].network.prefixlen == 31
+        assert ends[0].network == ends[1].network
+        assert ends[0].ip != ends[1].ip
+        assert ends[0].network.subnet_of(topo.point_to_point_network)
+        assert ends[0].network not in networks
+        networks.add(ends[0].network)
+    return networks
+
+
+def assert_degrees(routers, degrees):
+    for router, degree in zip(routers, degrees):
+        linked = [intf for intf in router.phy_interfaces.values()
+                  if intf.link is not None and not intf.is_loopback]
+        assert len(linked) == degree, router.hostname
+        # Nothing spare
+        assert router.free_port() is None
+
+
+def test_ring():
+    for count in (2, 3, 8):
+        topo = topology()
+        routers = topo.build_ring(count)
+        expected = 1 if count == 2 else count
+        assert len(routers) == count
+        assert len(links(routers)) == expected
+        assert len(assert_addressed(topo, routers)) == expected
+        assert_degrees(routers, [1] * count if count == 2 else [2] * count)
+
+
+def test_grid():
+    topo = topology()
+    routers = topo.build_grid(3, 4)
+    assert len(routers) == 12
+    assert len(links(routers)) == 3 * 3 + 2 * 4
+    assert len(assert_addressed(topo, routers)) == 17
+    assert routers[0].hostname == "r0-0" and routers[4].hostname == "r1-0"
+    assert_degrees(routers, [2, 3, 3, 2,
+                             3, 4, 4, 3,
+                             2, 3, 3, 2])
+
+
+def test_clos():
+    topo = topology()
+    spines, leaves = topo.build_clos(2, 5)
+    routers = spines + leaves
+    assert len(links(routers)) == 2 * 5
+    assert len(assert_addressed(topo, routers)) == 10
+    assert_degrees(spines, [5, 5])
+    assert_degrees(leaves, [2] * 5)
+    # Only ever leaf to spine
+    for a, b in link_names(routers):
+        assert a.startswith("leaf") and b.startswith("spine")
+
+
+def test_random():
+    for count, degree in ((10, 3), (12, 4), (6, 10)):
+        topo = topology()
+        routers = topo.build_random(count, degree, seed=7)
+        expected = min(count * degree // 2, count * (count - 1) // 2)
+        assert len(links(routers)) == expected
+        assert len(assert_addressed(topo, routers)) == expected
+        # Still a ring underneath
+        names = link_names(routers)
+        for idx in range(count):
+            pair = tuple(sorted((f"r{idx}", f"r{(idx + 1) % count}")))
+            assert pair in names
+
+
+def test_random_same_for_a_seed():
+    def build(seed, topology_seed=1):
+        return link_names(topology(topology_seed).build_random(20, 4, seed=seed))
+
+    assert build(3) == build(3)
+    # Whatever the topology's own seed
+    assert build(3, topology_seed=1) == build(3, topology_seed=2)
+    assert build(3) != build(4)
+
+    # Without one, the topology's seed decides
+    def unseeded(topology_seed):
+        return link_names(topology(topology_seed).build_random(20, 4))
+    assert unseeded(5) == unseeded(5)
+
+
+def test_free_ports_handed_out_once():
+    topo = topology()
+    r1 = topo.add_router("r1", interfaces=["et1", "et2"])
+    r2 = topo.add_router("r2", interfaces=["et1", "et2"])
+    r3 = topo.add_router("r3", interfaces=["et1"])
+
+    assert r1.free_port().name == "et1"
+    # Only taken once it's linked
+    assert r1.free_port().name == "et1"
+    topo.link_router_pair(r1, r2)
+    assert r1.free_port().name == "et2"
+    assert r2.free_port().name == "et2"
+
+    # Unlinking one by hand doesn't make it free again
+    r1.phy_interfaces["et1"].link = None
+    assert r1.free_port().name == "et2"
+
+    # r3 runs out of ports on the second pair, the first keeps its
+    # ports and /31 but is left down
+    try:
+        topo.link_router_pairs([(r3, r1), (r3, r2)])
+    except Exception:
+        pass
+    else:
+        assert False, "r3 only has one port"
+    assert r3.free_port() is None
+    assert r1.free_port() is None
+    assert r2.free_port().name == "et2"
+    assert r3.phy_interfaces["et1"].link.endpoint2 is r1.phy_interfaces["et2"]
+    assert r3.phy_interfaces["et1"].link.state == ConnectionState.DOWN
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
@@ -0,0 +1,132 @@
+"""
+TraceReader.query (routersim.trace) against filtering the events that
+were written by hand
+
+    python tracetest.py
+    python -m pytest tracetest.py
+"""
+from routersim.observers import Event, EventType
+from routersim.topology import Topology
+from routersim.trace import TraceReader, write_trace
+import logging
+import os
+import random
+import tempfile
+
+
+DEVICES = ["r1", "r2", "r3", "sw1"]
+EVENT_TYPES = [EventType.ICMP, EventType.ISIS, EventType.ROUTE_CHANGE, EventType.RSVP]
+# ICMP events use the (int) ICMP type
+SUB_TYPES = [0, 3, 8, 11, "ADJ_UP", "PATH_RECV", ""]
+
+
+class Source:
+    def __str__(self):
+        return "source"
+
+
+def random_events(rng, count):
+    events = []
+    when = 0
+    for i in range(count):
+        # Several events on most ticks
+        when += rng.choice([0, 0, 0, 1, 5])
+        evt = Event(rng.choice(EVENT_TYPES), Source(), f"event {i}",
+                    sub_type=rng.choice(SUB_TYPES))
+        evt.when = when
+        events.append((rng.choice(DEVICES), evt))
+    return events
+
+
+def brute_force(events, device=None, event_type=None, sub_type=None,
+                start=None, end=None):
+    return [(evt.when, name, evt.event_type, str(evt.sub_type), evt.msg)
+            for name, evt in events
+            if (device is None or name == device) and
+               (event_type is None or evt.event_type == event_type) and
+               (sub_type is None or evt.sub_type == sub_type) and
+               (start is None or evt.when >= start) and
+               (end is None or evt.when <= end)]
+
+
+def queried(trace, **kwargs):
+    return [(record.when, record.device, record.event_type, record.sub_type, record.msg)
+            for record in trace.query(**kwargs)]
+
+
+def test_query_matches_brute_force():
+    rng = random.Random(1)
+    events = random_events(rng, 3000)
+    last = events[-1][1].when
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "test.trace")
+        # Small blocks, so queries have to skip some and look in others
+        assert write_trace(path, events, block_size=100) == len(events)
+
+        with TraceReader(path) as trace:
+            assert len(trace) == len(events)
+            assert trace.devices() == sorted(DEVICES)
+            assert queried(trace) == brute_force(events)
+
+            for _ in range(200):
+                kwargs = {}
+                if rng.random() < 0.5:
+                    kwargs['device'] = rng.choice(DEVICES)
+                if rng.random() < 0.5:
+                    kwargs['event_type'] = rng.choice(EVENT_TYPES)
+                if rng.random() < 0.5:
+                    kwargs['sub_type'] = rng.choice(SUB_TYPES)
+                if rng.random() < 0.5:
+                    kwargs['start'] = rng.randrange(last)
+                if rng.random() < 0.5:
+                    kwargs['end'] = rng.randrange(kwargs.get('start', 0), last + 1)
+                assert queried(trace, **kwargs) == brute_force(events, **kwargs), kwargs
+
+            # Nothing by those names, rather than everything
+            assert queried(trace, device="r9") == []
+            assert queried(trace, sub_type="NO_SUCH") == []
+
+
+def test_int_sub_types():
+    events = []
+    for when, icmp_type in enumerate([8, 0, 8, 0, 3]):
+        evt = Event(EventType.ICMP, Source(), "ping", sub_type=icmp_type)
+        evt.when = when
+        events.append(("r1", evt))
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "test.trace")
+        write_trace(path, events)
+        with TraceReader(path) as trace:
+            assert [record.when for record in trace.query(sub_type=0)] == [1, 3]
+            assert [record.when for record in trace.query(sub_type="8")] == [0, 2]
+            # Always handed back as strings
+            assert set(record.sub_type for record in trace) == {"0", "3", "8"}
+
+
+def test_trace_of_a_run():
+    topology = Topology("tracetest", seed=1)
+    routers = topology.build_ring(3)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    events = list(topology.run_another(15000, stream=True))
+    assert len(events) > 0
+
+    with tempfile.TemporaryDirectory() as directory:
+        path = os.path.join(directory, "run.trace")
+        write_trace(path, events, block_size=256)
+        with TraceReader(path) as trace:
+            assert len(trace) == len(events)
+            for router in routers:
+                kwargs = dict(device=router.hostname, event_type=EventType.ISIS,
+                              start=1000, end=10000)
+                assert queried(trace, **kwargs) == brute_force(events, **kwargs)
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")
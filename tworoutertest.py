@@ -0,0 +1,56 @@
+"""
+Two linked routers bring up an IS-IS adjacency, learn each other's
+loopback and signal an RSVP LSP between them
+
+    python tworoutertest.py
+    python -m pytest tworoutertest.py
+"""
+from routersim.topology import Topology
+import ipaddress
+import logging
+
+
+def linked_pair():
+    topology = Topology("tworoutertest")
+    r1 = topology.add_router("r1", interfaces=['et1'])
+    r2 = topology.add_router("r2", interfaces=['et1'])
+    topology.link_router_pair(r1, r2)
+    topology.isis_enable_all()
+    topology.isis_start_all()
+    topology.run_until(30000)
+    return topology, r1, r2
+
+
+def test_isis_adjacency():
+    topology, r1, r2 = linked_pair()
+    for router, other in ((r1, r2), (r2, r1)):
+        neighbors = router.process['isis'].adjacencies['et1.0'].values()
+        assert [neighbor.state for neighbor in neighbors] == ['UP'], router.hostname
+
+        # And a route to the other's loopback through it
+        route = router.routing.lookup_ip(other.loopback_address)
+        assert route is not None, router.hostname
+        assert route.interface.name == 'et1.0'
+        assert route.prefix == ipaddress.ip_network(f"{other.loopback_address}/32")
+
+
+def test_rsvp_lsp():
+    topology, r1, r2 = linked_pair()
+    topology.rsvp_start_all()
+    r1.create_lsp("r1-r2", r2.loopback_address)
+    topology.run_another(5000)
+
+    routes = r1.routing.tables['rsvp'][ipaddress.ip_network(f"{r2.loopback_address}/32")]
+    assert [route.lsp_name for route in routes] == ["r1-r2"]
+    assert routes[0].interface.name == 'et1.0'
+    assert routes[0].next_hop_ip == r2.interface('et1').logical().address().ip
+    # Nothing to do at r2, it's the egress
+    assert len(r2.routing.tables['rsvp']) == 0
+
+
+if __name__ == '__main__':
+    logging.disable(logging.INFO)
+    for name, test in list(globals().items()):
+        if name.startswith('test_'):
+            test()
+            print(f"{name} OK")